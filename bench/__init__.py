@@ -0,0 +1,8 @@
+"""
+Benchmark suite for the dispatcher.
+
+datagen      synthetic e-commerce data (the schema of init_realistic_database.ps1) at any scale
+mock_worker  /execute backed by SQLite, standing in for the Go workers and Postgres
+loadgen      drives /query at a fixed concurrency and writes throughput, latency and CPU/memory as JSON
+run          starts mock workers and a dispatcher locally and runs loadgen against them
+"""
@@ -0,0 +1,169 @@
+"""
+Synthetic data for the e-commerce schema (departments, employees, products,
+orders, order_items), generated deterministically from a seed.
+
+Scale 1 matches init_realistic_database.ps1 (5 departments, 1,000 employees,
+500 products, 5,000 orders, 15,000 order items); every table but departments
+grows linearly with the scale. The same rows can be written as a SQLite file
+for the mock worker or as a psql script (CREATE TABLE + COPY) for Postgres:
+
+    python -m bench.datagen --scale 10 --sqlite bench/data/ecommerce-10.db
+    python -m bench.datagen --scale 10 --postgres ecommerce-10.sql
+    psql -U user -d demo -f ecommerce-10.sql
+"""
+import argparse
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+DEPARTMENTS = [
+    ("Sales", "New York", 500000.00),
+    ("Engineering", "San Francisco", 1200000.00),
+    ("Marketing", "Los Angeles", 350000.00),
+    ("HR", "Chicago", 200000.00),
+    ("Finance", "Boston", 400000.00),
+]
+JOB_TITLES = ["Manager", "Senior Engineer", "Engineer", "Sales Representative", "Marketing Specialist",
+              "Analyst", "Coordinator", "Consultant", "Associate", "Specialist"]
+CATEGORIES = ["Electronics", "Clothing", "Food", "Books", "Home & Garden"]
+STATUSES = ["Pending", "Completed", "Shipped"]
+
+# (table, [(column, Postgres type, SQLite type)])
+SCHEMA = [
+    ("departments", [("dept_id", "SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY"),
+                     ("dept_name", "VARCHAR(100) NOT NULL", "TEXT NOT NULL"),
+                     ("location", "VARCHAR(100)", "TEXT"),
+                     ("budget", "DECIMAL(12,2)", "REAL")]),
+    ("employees", [("emp_id", "SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY"),
+                   ("emp_name", "VARCHAR(100) NOT NULL", "TEXT NOT NULL"),
+                   ("email", "VARCHAR(100)", "TEXT"),
+                   ("dept_id", "INTEGER REFERENCES departments(dept_id)", "INTEGER"),
+                   ("salary", "DECIMAL(10,2)", "REAL"),
+                   ("hire_date", "DATE", "TEXT"),
+                   ("job_title", "VARCHAR(100)", "TEXT")]),
+    ("products", [("product_id", "SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY"),
+                  ("product_name", "VARCHAR(200) NOT NULL", "TEXT NOT NULL"),
+                  ("category", "VARCHAR(50)", "TEXT"),
+                  ("price", "DECIMAL(10,2)", "REAL"),
+                  ("stock_quantity", "INTEGER", "INTEGER")]),
+    ("orders", [("order_id", "SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY"),
+                ("emp_id", "INTEGER REFERENCES employees(emp_id)", "INTEGER"),
+                ("order_date", "DATE", "TEXT"),
+                ("total_amount", "DECIMAL(12,2)", "REAL"),
+                ("status", "VARCHAR(20)", "TEXT")]),
+    ("order_items", [("item_id", "SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY"),
+                     ("order_id", "INTEGER REFERENCES orders(order_id)", "INTEGER"),
+                     ("product_id", "INTEGER REFERENCES products(product_id)", "INTEGER"),
+                     ("quantity", "INTEGER", "INTEGER"),
+                     ("unit_price", "DECIMAL(10,2)", "REAL")]),
+]
+# Secondary indexes the split planner can use (see catalog.key_columns)
+INDEXES = [("orders", "emp_id"), ("order_items", "order_id"), ("order_items", "product_id"), ("employees", "dept_id")]
+
+
+def table_sizes(scale):
+    """Row count per table at scale."""
+    return {
+        "departments": len(DEPARTMENTS),
+        "employees": max(1, round(1000 * scale)),
+        "products": max(1, round(500 * scale)),
+        "orders": max(1, round(5000 * scale)),
+        "order_items": max(1, round(15000 * scale)),
+    }
+
+
+def generate(scale=1.0, seed=42):
+    """Yield (table, rows) in dependency order; rows is an iterator of tuples in SCHEMA column order."""
+    rng = random.Random(seed)
+    sizes = table_sizes(scale)
+    n_employees, n_products, n_orders = sizes["employees"], sizes["products"], sizes["orders"]
+
+    yield "departments", ((i, name, location, budget) for i, (name, location, budget) in enumerate(DEPARTMENTS, 1))
+
+    start = date(2015, 1, 1)
+    yield "employees", (
+        (i, f"Employee_{i}", f"emp{i}@company.com", (i % len(DEPARTMENTS)) + 1,
+         float(30000 + rng.randint(0, 120000)), (start + timedelta(days=rng.randint(0, 3000))).isoformat(),
+         JOB_TITLES[i % len(JOB_TITLES)])
+        for i in range(1, n_employees + 1))
+
+    yield "products", (
+        (i, f"Product_{i}", CATEGORIES[i % len(CATEGORIES)], round(10 + rng.random() * 990, 2), rng.randint(0, 1000))
+        for i in range(1, n_products + 1))
+
+    start = date(2023, 1, 1)
+    yield "orders", (
+        (i, rng.randint(1, n_employees), (start + timedelta(days=rng.randint(0, 700))).isoformat(),
+         round(100 + rng.random() * 9900, 2), rng.choice(STATUSES))
+        for i in range(1, n_orders + 1))
+
+    yield "order_items", (
+        (i, rng.randint(1, n_orders), rng.randint(1, n_products), rng.randint(1, 11), round(10 + rng.random() * 990, 2))
+        for i in range(1, sizes["order_items"] + 1))
+
+
+def write_sqlite(path, scale=1.0, seed=42):
+    """Write the data set to a fresh SQLite file at path."""
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    columns = dict(SCHEMA)
+    try:
+        for table, rows in generate(scale, seed):
+            cols = columns[table]
+            conn.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {lite}' for name, _, lite in cols)})")
+            conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(cols))})", rows)
+        for table, column in INDEXES:
+            conn.execute(f"CREATE INDEX idx_{table}_{column} ON {table} ({column})")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def copy_value(value):
+    """One value in COPY text format."""
+    if value is None:
+        return r"\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def write_postgres(path, scale=1.0, seed=42):
+    """Write a psql script that recreates the schema and loads the data set with COPY."""
+    columns = dict(SCHEMA)
+    with open(path, "w", encoding="utf-8") as out:
+        for table, _ in reversed(SCHEMA):
+            out.write(f"DROP TABLE IF EXISTS {table} CASCADE;\n")
+        for table, rows in generate(scale, seed):
+            cols = columns[table]
+            out.write(f"CREATE TABLE {table} ({', '.join(f'{name} {pg}' for name, pg, _ in cols)});\n")
+            out.write(f"COPY {table} ({', '.join(name for name, _, _ in cols)}) FROM stdin;\n")
+            for row in rows:
+                out.write("\t".join(map(copy_value, row)) + "\n")
+            out.write("\\.\n")
+            # Keep SERIAL columns usable for later inserts
+            out.write(f"SELECT setval(pg_get_serial_sequence('{table}', '{cols[0][0]}'), (SELECT MAX({cols[0][0]}) FROM {table}));\n")
+        for table, column in INDEXES:
+            out.write(f"CREATE INDEX idx_{table}_{column} ON {table} ({column});\n")
+        out.write("ANALYZE;\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the e-commerce benchmark data set")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 = 21,505 rows; tables grow linearly")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite", help="write a SQLite database for the mock worker")
+    parser.add_argument("--postgres", help="write a psql script (CREATE TABLE + COPY)")
+    args = parser.parse_args()
+    if not args.sqlite and not args.postgres:
+        parser.error("give --sqlite and/or --postgres")
+    if args.sqlite:
+        write_sqlite(args.sqlite, args.scale, args.seed)
+    if args.postgres:
+        write_postgres(args.postgres, args.scale, args.seed)
+    print(", ".join(f"{table}={n:,}" for table, n in table_sizes(args.scale).items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Load generator for the dispatcher's /query endpoint.
+
+Runs the query mix (the ```sql blocks of DEMO_QUERIES.md by default) from a
+fixed number of concurrent clients for a fixed time after a warm-up, and
+reports throughput, p50/p95/p99 latency overall and per query, and the
+dispatcher's CPU and memory, read from its Prometheus endpoint
+(process_cpu_seconds_total, process_resident_memory_bytes). Results are
+written as JSON; --compare prints the change against an earlier result.
+
+    python -m bench.loadgen --url http://localhost:8000/query --metrics-url http://localhost:8002/metrics \\
+        --concurrency 16 --duration 30 --out bench/results/baseline.json
+    python -m bench.loadgen ... --out bench/results/change.json --compare bench/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUERIES = os.path.join(ROOT, "DEMO_QUERIES.md")
+# Mix entries that need a real Postgres (pg_sleep, generate_series) are skipped
+POSTGRES_ONLY = re.compile(r"\b(pg_sleep|generate_series)\s*\(", re.IGNORECASE)
+
+
+def load_queries(path):
+    """[(name, sql)] from the ```sql blocks of a Markdown file (named by the preceding heading) or one statement per line."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if not path.endswith(".md"):
+        lines = [line.strip() for line in text.splitlines()]
+        return [(f"q{i}", line) for i, line in enumerate((l for l in lines if l and not l.startswith("--")), 1)]
+    queries, heading = [], None
+    for match in re.finditer(r"^#+\s*(.+?)\s*$|^```sql\s*\n(.*?)^```", text, re.MULTILINE | re.DOTALL):
+        if match.group(1) is not None:
+            heading = match.group(1)
+            continue
+        sql = " ".join(match.group(2).split())
+        if POSTGRES_ONLY.search(sql):
+            continue
+        name = re.sub(r"[^a-z0-9]+", "_", (heading or f"q{len(queries) + 1}").lower()).strip("_")
+        queries.append((name, sql))
+    return queries
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list (None when empty)."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "p50": ms(percentile(values, 50)),
+        "p95": ms(percentile(values, 95)),
+        "p99": ms(percentile(values, 99)),
+        "mean": ms(sum(values) / len(values)) if values else None,
+        "max": ms(values[-1]) if values else None,
+    }
+
+
+def parse_metrics(text, names):
+    """Values of unlabelled samples names from a Prometheus text exposition."""
+    found = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if name in names:
+            found[name] = float(value)
+    return found
+
+
+class ResourceSampler:
+    """Polls the dispatcher's process metrics while the load runs."""
+
+    NAMES = ("process_cpu_seconds_total", "process_resident_memory_bytes")
+
+    def __init__(self, client, url, interval=1.0):
+        self.client = client
+        self.url = url
+        self.interval = interval
+        self.samples = []  # (monotonic time, {name: value})
+
+    async def sample(self):
+        try:
+            r = await self.client.get(self.url)
+            values = parse_metrics(r.text, self.NAMES)
+        except httpx.HTTPError:
+            return
+        if values:
+            self.samples.append((time.monotonic(), values))
+
+    async def run(self, stop):
+        while not stop.is_set():
+            await self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        await self.sample()
+
+    def summary(self):
+        cpu = [(t, v["process_cpu_seconds_total"]) for t, v in self.samples if "process_cpu_seconds_total" in v]
+        rss = [v["process_resident_memory_bytes"] for _, v in self.samples if "process_resident_memory_bytes" in v]
+        if not cpu and not rss:
+            return None
+        result = {}
+        if len(cpu) >= 2:
+            seconds = cpu[-1][1] - cpu[0][1]
+            result["cpu_seconds"] = round(seconds, 3)
+            result["cpu_cores"] = round(seconds / (cpu[-1][0] - cpu[0][0]), 3)  # 1.0 = one core fully busy
+        if rss:
+            result["rss_mb_max"] = round(max(rss) / 2**20, 1)
+            result["rss_mb_mean"] = round(sum(rss) / len(rss) / 2**20, 1)
+        return result
+
+
+async def client_loop(client, url, queries, offset, payload_extra, until, record):
+    """One simulated client: sends the mix round-robin, starting at offset, until the deadline."""
+    i = offset
+    while time.monotonic() < until:
+        name, sql = queries[i % len(queries)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            r = await client.post(url, json={"sql": sql, **payload_extra})
+            status = r.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        record(name, time.perf_counter() - started, status)
+
+
+async def run_load(url, queries, concurrency=8, duration=30.0, warmup=5.0, metrics_url=None, payload_extra=None,
+                   timeout=60.0):
+    """Drive url with queries; returns the result document (without config/environment)."""
+    payload_extra = payload_extra or {}
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        # Warm-up: plan caches, statistics and connection pools; nothing is recorded
+        if warmup > 0:
+            until = time.monotonic() + warmup
+            await asyncio.gather(*(client_loop(client, url, queries, i, payload_extra, until, lambda *a: None)
+                                   for i in range(concurrency)))
+
+        latencies = {name: [] for name, _ in queries}
+        errors = {}
+
+        def record(name, elapsed, status):
+            if status == 200:
+                latencies[name].append(elapsed)
+            else:
+                errors.setdefault(name, {}).setdefault(str(status), 0)
+                errors[name][str(status)] += 1
+
+        stop = asyncio.Event()
+        sampler = ResourceSampler(client, metrics_url) if metrics_url else None
+        sampling = asyncio.ensure_future(sampler.run(stop)) if sampler else None
+        started = time.monotonic()
+        until = started + duration
+        await asyncio.gather(*(client_loop(client, url, queries, i, payload_extra, until, record)
+                               for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+        stop.set()
+        if sampling:
+            await sampling
+
+    ok = [v for values in latencies.values() for v in values]
+    n_errors = sum(sum(by_status.values()) for by_status in errors.values())
+    return {
+        "summary": {
+            "requests": len(ok) + n_errors,
+            "errors": n_errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_qps": round(len(ok) / elapsed, 2) if elapsed else None,
+            "latency_ms": latency_summary(ok),
+        },
+        "queries": {
+            name: {"requests": len(values) + sum(errors.get(name, {}).values()), "errors": errors.get(name, {}),
+                   "latency_ms": latency_summary(values)}
+            for name, values in latencies.items()
+        },
+        "dispatcher": sampler.summary() if sampler else None,
+    }
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "") if out.returncode == 0 else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def change(new, old):
+    if new is None or old is None or old == 0:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(result, baseline):
+    """Lines describing result relative to baseline (throughput, latency percentiles, CPU, memory)."""
+    rows = [("throughput_qps", result["summary"]["throughput_qps"], baseline["summary"]["throughput_qps"])]
+    for q in ("p50", "p95", "p99"):
+        rows.append((f"latency {q} (ms)", result["summary"]["latency_ms"][q], baseline["summary"]["latency_ms"][q]))
+    mine, theirs = result.get("dispatcher") or {}, baseline.get("dispatcher") or {}
+    for key in ("cpu_cores", "rss_mb_max"):
+        rows.append((key, mine.get(key), theirs.get(key)))
+    lines = [f"{'metric':<20}{'baseline':>12}{'this run':>12}{'change':>10}"]
+    for name, new, old in rows:
+        lines.append(f"{name:<20}{old if old is not None else '-':>12}{new if new is not None else '-':>12}{change(new, old):>10}")
+    for name, entry in result["queries"].items():
+        old = baseline.get("queries", {}).get(name)
+        if old:
+            lines.append(f"  {name:<44} p95 {change(entry['latency_ms']['p95'], old['latency_ms']['p95'])}")
+    return lines
+
+
+def percentiles_text(latency):
+    return " ".join(f"{q} {latency[q]}ms" if latency[q] is not None else f"{q} -" for q in ("p50", "p95", "p99"))
+
+
+def report(result):
+    s = result["summary"]
+    lines = [f"{s['requests']} requests ({s['errors']} errors) in {s['elapsed_s']}s: {s['throughput_qps']} q/s, "
+             + percentiles_text(s["latency_ms"])]
+    for name, entry in result["queries"].items():
+        lines.append(f"  {name:<44} n={entry['requests']:<6} {percentiles_text(entry['latency_ms'])}"
+                     + (f" errors {entry['errors']}" if entry["errors"] else ""))
+    if result.get("dispatcher"):
+        lines.append("  dispatcher: " + ", ".join(f"{k}={v}" for k, v in result["dispatcher"].items()))
+    return lines
+
+
+def add_arguments(parser):
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="Markdown with ```sql blocks, or one statement per line")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of unmeasured load first")
+    parser.add_argument("--cache", action="store_true", help="allow the result cache (off by default to measure execution)")
+    parser.add_argument("--out", help="write the result JSON here")
+    parser.add_argument("--compare", help="earlier result JSON to compare against")
+
+
+async def benchmark(args, url, metrics_url, setup=None):
+    """Run the load described by args and write/print the result document."""
+    queries = load_queries(args.queries)
+    if not queries:
+        raise SystemExit(f"no queries in {args.queries}")
+    payload_extra = {} if args.cache else {"cache": False}
+    result = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "config": {"url": url, "queries": os.path.relpath(args.queries, ROOT), "concurrency": args.concurrency,
+                   "duration_s": args.duration, "warmup_s": args.warmup, "cache": args.cache, **(setup or {})},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    }
+    result.update(await run_load(url, queries, args.concurrency, args.duration, args.warmup, metrics_url, payload_extra))
+    print("\n".join(report(result)))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"wrote {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print("\n".join(compare(result, json.load(f))))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a running dispatcher's /query endpoint")
+    parser.add_argument("--url", default="http://localhost:8000/query")
+    parser.add_argument("--metrics-url", default="http://localhost:8002/metrics",
+                        help="dispatcher Prometheus endpoint for CPU/memory ('' to skip)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    result = asyncio.run(benchmark(args, args.url, args.metrics_url or None))
+    sys.exit(1 if result["summary"]["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
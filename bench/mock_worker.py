@@ -0,0 +1,272 @@
+"""
+Mock worker: the /execute endpoint of worker/main.go backed by a SQLite file
+(see datagen), so the dispatcher can be benchmarked without Postgres or the
+Go workers. Sub-queries arrive in the dispatcher's dialect and are transpiled
+to SQLite with sqlglot. Answers in the same formats as the real worker: JSON,
+the compact row format and NDJSON, chosen by the Accept header.
+
+    python -m bench.mock_worker --db bench/data/ecommerce-1.db --port 8001 --latency-ms 2
+
+--latency-ms adds a fixed delay per sub-query, standing in for the network and
+Postgres overhead a real worker pays.
+
+SQLite lacks the Postgres features some sub-queries use; TABLESAMPLE and the
+COUNT(DISTINCT)/percentile summaries of dispatcher/sketches.py are emulated
+with a random row filter and Python functions.
+"""
+import argparse
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sqlglot
+from sqlglot import exp
+
+NDJSON_TYPE = "application/x-ndjson"
+COMPACT_TYPE = "application/x-parallax-rows+json"
+
+
+def emulate_tablesample(tree):
+    """SQLite has no TABLESAMPLE: read sampled tables through a random row filter instead (SYSTEM too, row by row)."""
+    for table in list(tree.find_all(exp.Table)):
+        sample = table.args.get("sample")
+        if sample is None:
+            continue
+        keep = int(float(sample.args["percent"].name) * 10000)  # out of 1,000,000
+        table.set("sample", None)
+        alias = table.alias or table.name
+        rows = exp.select("*").from_(exp.table_(table.name)).where(f"ABS(RANDOM()) % 1000000 < {keep}")
+        table.replace(rows.subquery(alias))
+    return tree
+
+
+def emulate_sketches(tree):
+    """
+    Swap the sketch states for the aggregates of register_functions(). They
+    return JSON text; the "[json]" type in the column alias has sqlite3 decode
+    it (PARSE_COLNAMES), so the rows carry lists like the real worker's arrays.
+    """
+    def swap(node):
+        if isinstance(node, exp.Bracket) and isinstance(node.this, exp.Paren) and isinstance(node.this.this, exp.ArrayAgg):
+            # (array_agg(DISTINCT h ORDER BY h))[1:k]
+            digest = node.this.this.this.this.expressions[0]
+            return exp.Anonymous(this="kmv_sketch", expressions=[digest, node.expressions[0].expression])
+        if isinstance(node, exp.ArrayAgg) and isinstance(node.this, exp.Distinct):
+            return exp.Anonymous(this="distinct_values", expressions=node.this.expressions)
+        if isinstance(node, exp.WithinGroup) and isinstance(node.this.this, exp.Array):
+            name = "percentile_cont_array" if isinstance(node.this, exp.PercentileCont) else "percentile_disc_array"
+            fractions = ",".join(e.name for e in node.this.this.expressions)
+            return exp.Anonymous(this=name, expressions=[node.expression.expressions[0].this, exp.Literal.string(fractions)])
+        if isinstance(node, exp.WithinGroup) and isinstance(node.this, (exp.PercentileCont, exp.PercentileDisc)):
+            # The original aggregate, sent when a statement runs unsplit
+            name = "percentile_cont_value" if isinstance(node.this, exp.PercentileCont) else "percentile_disc_value"
+            ordered = node.expression.expressions[0]
+            return exp.Anonymous(this=name, expressions=[ordered.this, node.this.this,
+                                                         exp.Literal.number(1 if ordered.args.get("desc") else 0)])
+        return node
+
+    tree = tree.transform(swap)
+    for alias in tree.find_all(exp.Alias):
+        if isinstance(alias.this, exp.Anonymous) and alias.this.name in SKETCH_AGGREGATES:
+            alias.set("alias", exp.to_identifier(f"{alias.alias} [json]", quoted=True))
+    return tree
+
+
+def hashtextextended(text, seed):
+    """Signed 64-bit hash of text, standing in for Postgres' hashtextextended()."""
+    if text is None:
+        return None
+    digest = hashlib.blake2b(f"{seed}:{text}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class KmvSketch:
+    """(array_agg(DISTINCT h ORDER BY h))[1:k]: the k smallest distinct hashes, NULL last."""
+
+    def __init__(self):
+        self.hashes, self.size, self.rows = set(), 0, 0
+
+    def step(self, value, size):
+        self.hashes.add(value)
+        self.size, self.rows = size, self.rows + 1
+
+    def finalize(self):
+        if not self.rows:
+            return None
+        values = sorted(h for h in self.hashes if h is not None) + ([None] if None in self.hashes else [])
+        return json.dumps(values[:self.size])
+
+
+class DistinctValues:
+    """array_agg(DISTINCT x)."""
+
+    def __init__(self):
+        self.values, self.rows = set(), 0
+
+    def step(self, value):
+        self.values.add(value)
+        self.rows += 1
+
+    def finalize(self):
+        return json.dumps(list(self.values)) if self.rows else None
+
+
+class PercentileArray:
+    """percentile_cont/percentile_disc(ARRAY[...]) WITHIN GROUP (ORDER BY x) with the fractions as "0,0.01,..."."""
+    continuous = True
+
+    def __init__(self):
+        self.values, self.fractions = [], ""
+
+    def step(self, value, fractions):
+        self.fractions = fractions
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        return json.dumps([self.pick(values, float(f)) for f in self.fractions.split(",")])
+
+    def pick(self, values, fraction):
+        if not self.continuous:
+            return values[max(1, math.ceil(fraction * len(values))) - 1]
+        position = fraction * (len(values) - 1)
+        low = int(position)
+        if low + 1 >= len(values):
+            return values[low]
+        return values[low] + (position - low) * (values[low + 1] - values[low])
+
+
+class PercentileDiscArray(PercentileArray):
+    continuous = False
+
+
+class PercentileValue(PercentileArray):
+    """percentile_cont/percentile_disc(fraction) WITHIN GROUP (ORDER BY x [DESC])."""
+
+    def step(self, value, fraction, descending):
+        self.fractions, self.descending = fraction, descending
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        return self.pick(sorted(self.values, reverse=bool(self.descending)), float(self.fractions))
+
+
+class PercentileDiscValue(PercentileValue):
+    continuous = False
+
+
+SKETCH_AGGREGATES = {"kmv_sketch": (2, KmvSketch), "distinct_values": (1, DistinctValues),
+                     "percentile_cont_array": (2, PercentileArray), "percentile_disc_array": (2, PercentileDiscArray)}
+VALUE_AGGREGATES = {"percentile_cont_value": (3, PercentileValue), "percentile_disc_value": (3, PercentileDiscValue)}
+sqlite3.register_converter("json", json.loads)
+
+
+def register_functions(conn):
+    """The Python stand-ins emulate_sketches() rewrites sub-queries to."""
+    conn.create_function("hashtextextended", 2, hashtextextended, deterministic=True)
+    for name, (n_args, aggregate) in {**SKETCH_AGGREGATES, **VALUE_AGGREGATES}.items():
+        conn.create_aggregate(name, n_args, aggregate)
+
+
+@lru_cache(maxsize=4096)
+def to_sqlite(sql, dialect):
+    return emulate_sketches(emulate_tablesample(sqlglot.parse_one(sql, read=dialect))).sql(dialect="sqlite")
+
+
+class MockWorker(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db_path, dialect="postgres", latency=0.0):
+        super().__init__(address, ExecuteHandler)
+        self.db_path = db_path
+        self.dialect = dialect
+        self.latency = latency
+        self.local = threading.local()
+
+    def connection(self):
+        """One read-only SQLite connection per handler thread."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False,
+                                                     detect_types=sqlite3.PARSE_COLNAMES)
+            register_functions(conn)
+        return conn
+
+    def execute(self, sql):
+        cursor = self.connection().execute(to_sqlite(sql, self.dialect))
+        columns = [d[0] for d in cursor.description or ()]
+        return columns, cursor.fetchall()
+
+
+class ExecuteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/execute":
+            return self.reply(404, "text/plain", b"not found")
+        try:
+            sql = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["sql"]
+        except (ValueError, KeyError):
+            return self.reply(400, "text/plain", b"bad json")
+        started = time.perf_counter()
+        try:
+            columns, rows = self.server.execute(sql)
+        except Exception as e:
+            return self.reply(502, "text/plain", str(e).encode())
+        remaining = self.server.latency - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        accept = self.headers.get("Accept", "")
+        if NDJSON_TYPE in accept:
+            body = "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+            return self.reply(200, NDJSON_TYPE, body.encode())
+        if COMPACT_TYPE in accept:
+            return self.reply(200, COMPACT_TYPE, json.dumps({"columns": columns, "rows": rows}).encode())
+        body = {"rows": [dict(zip(columns, row)) for row in rows] or None}
+        return self.reply(200, "application/json", json.dumps(body).encode())
+
+    def reply(self, status, content_type, body):
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The dispatcher gave up on this sub-query (a hedge won, or the query was cancelled)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite-backed stand-in for the query worker")
+    parser.add_argument("--db", required=True, help="SQLite file written by bench.datagen --sqlite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dialect", default="postgres", help="dialect of the incoming sub-queries")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="minimum time per sub-query")
+    args = parser.parse_args()
+    server = MockWorker((args.host, args.port), args.db, args.dialect, args.latency_ms / 1000)
+    print(f"mock worker listening on {args.host}:{args.port} ({args.db})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Local benchmark run: generates the data set (once per scale/seed), starts
+mock workers and a dispatcher against them, runs loadgen and stops
+everything again. The dispatcher runs from this checkout without Postgres
+(DB_DSN is empty), so planning uses no catalog statistics or EXPLAIN costs;
+only statements whose WHERE bounds the partition column are split.
+Benchmark against docker-compose (real Postgres and workers) with
+bench.loadgen directly.
+
+    python -m bench.run --scale 5 --workers 4 --concurrency 16 --duration 30 --out bench/results/baseline.json
+    python -m bench.run --scale 5 --workers 4 --concurrency 16 --duration 30 --compare bench/results/baseline.json
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench import datagen, loadgen
+
+DISPATCHER_DIR = os.path.join(loadgen.ROOT, "dispatcher")
+DATA_DIR = os.path.join(loadgen.ROOT, "bench", "data")
+QUERY_URL = "http://127.0.0.1:8000/query"  # python dispatcher/main.py serves :8000 and metrics on :8002
+METRICS_URL = "http://127.0.0.1:8002/metrics"
+
+
+def wait_for(url, process, timeout=30.0):
+    """Poll url until it answers; fail early if process exits."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout:g}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a local dispatcher against SQLite mock workers")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4, help="mock worker processes")
+    parser.add_argument("--worker-port", type=int, default=18001, help="first mock worker port")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="minimum time per sub-query on the mock workers")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra dispatcher environment, e.g. --env MAX_PARTS=8 (repeatable)")
+    loadgen.add_arguments(parser)
+    args = parser.parse_args()
+
+    db = os.path.join(DATA_DIR, f"ecommerce-{args.scale:g}-{args.seed}.db")
+    if not os.path.exists(db):
+        print(f"generating {db}")
+        datagen.write_sqlite(db, args.scale, args.seed)
+
+    endpoints = [f"http://127.0.0.1:{args.worker_port + i}/execute" for i in range(args.workers)]
+    env = dict(os.environ, DB_DSN="", WORKER_URL=endpoints[0], WORKER_ENDPOINTS=",".join(endpoints),
+               WORKER_COUNT=str(args.workers), LOG_LEVEL="WARNING")
+    env.update(item.split("=", 1) for item in args.env)
+
+    processes = []
+    try:
+        for i in range(args.workers):
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "bench.mock_worker", "--db", db, "--port", str(args.worker_port + i),
+                 "--latency-ms", str(args.latency_ms)], cwd=loadgen.ROOT, stdout=subprocess.DEVNULL))
+        dispatcher = subprocess.Popen([sys.executable, "main.py"], cwd=DISPATCHER_DIR, env=env, stdout=subprocess.DEVNULL)
+        processes.append(dispatcher)
+        wait_for(METRICS_URL, dispatcher)
+        wait_for(QUERY_URL.rsplit("/", 1)[0] + "/docs", dispatcher)
+        setup = {"mode": "local-mock", "scale": args.scale, "seed": args.seed, "workers": args.workers,
+                 "worker_latency_ms": args.latency_ms, "dispatcher_env": dict(item.split("=", 1) for item in args.env)}
+        result = asyncio.run(loadgen.benchmark(args, QUERY_URL, METRICS_URL, setup))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    sys.exit(1 if result["summary"]["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
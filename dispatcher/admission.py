@@ -0,0 +1,170 @@
+"""
+Admission control for /query.
+
+Without it a burst of requests fans out to the workers all at once and every
+query slows down together. Each query reserves one slot per sub-query it is
+about to run, against a global limit and a per-client limit. Queries that
+don't fit wait in a bounded queue ordered by priority (interactive before
+batch, then arrival order); batch queries may only fill batch_share of the
+global limit so interactive traffic always finds room.
+
+When the queue is full the newest waiter of the lowest priority is shed, or
+the arrival itself if nothing queued ranks below it. Waiters give up after
+queue_timeout. Shed requests surface as Overloaded, which the dispatcher
+turns into 429.
+
+A query is never granted more than one query of its priority can hold, so
+it may get fewer slots than it has sub-queries; the dispatcher then runs at
+most that many at once. Extra attempts (hedges, re-split ranges) take slots
+with try_acquire(), which never waits: without a free slot they don't run.
+"""
+import asyncio
+import heapq
+import itertools
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Overloaded(Exception):
+    """A request was shed; reason is queue_full, displaced or timeout."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Grant:
+    """Slots held by one admitted query, returned with AdmissionController.release()."""
+
+    __slots__ = ("client", "slots", "priority")
+
+    def __init__(self, client, slots, priority="interactive"):
+        self.client = client
+        self.slots = slots
+        self.priority = priority
+
+
+class AdmissionController:
+    """Global and per-client sub-query limits with a bounded priority queue."""
+
+    def __init__(self, max_inflight=64, per_client=0, queue_size=100, queue_timeout=10.0, batch_share=0.5):
+        self.max_inflight = max_inflight
+        self.per_client = per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.batch_share = batch_share
+        self.inflight = 0
+        self._clients = {}   # client -> slots in flight
+        self._queue = []     # heap of [rank, seq, client, slots, future, priority]
+        self._seq = itertools.count()
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    async def acquire(self, client, priority="interactive", slots=1):
+        """
+        Reserve slots for client (at most cap(priority)), waiting in the queue if
+        needed. Raises Overloaded when shed.
+        """
+        rank = PRIORITIES[priority]
+        slots = max(1, min(slots, self._cap(rank)))
+        if not self._queue and self._blocked(rank, client, slots) is None:
+            return self._grant(client, slots, priority)
+
+        if len(self._queue) >= self.queue_size:
+            worst = max(self._queue, default=None)
+            if worst is None or worst[0] <= rank:
+                raise Overloaded("queue_full")
+            self._remove(worst)
+            worst[4].set_exception(Overloaded("displaced"))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [rank, next(self._seq), client, slots, future, priority]
+        heapq.heappush(self._queue, entry)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the caller gave up
+                self.release(future.result())
+            elif not future.done():
+                future.cancel()
+                self._remove(entry)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise Overloaded("timeout") from None
+
+    def try_acquire(self, client, priority="interactive", slots=1):
+        """
+        Up to slots more slots for client right now, without waiting: a Grant for
+        as many as are free, or None when none are or other queries are waiting.
+        """
+        rank = PRIORITIES[priority]
+        if self._queue:
+            return None
+        free = slots
+        if self.max_inflight:
+            free = min(free, self._limit(rank) - self.inflight)
+        if self.per_client:
+            free = min(free, self.per_client - self._clients.get(client, 0))
+        return self._grant(client, free, priority) if free > 0 else None
+
+    def cap(self, priority="interactive"):
+        """Most slots one query of this priority can hold, or None when unlimited."""
+        cap = self._cap(PRIORITIES[priority])
+        return None if cap == float("inf") else cap
+
+    def release(self, grant):
+        self.inflight -= grant.slots
+        held = self._clients.get(grant.client, 0) - grant.slots
+        if held > 0:
+            self._clients[grant.client] = held
+        else:
+            self._clients.pop(grant.client, None)
+        self._wake()
+
+    def _cap(self, rank):
+        """Most slots one query of this priority can ever hold."""
+        caps = [self._limit(rank)] if self.max_inflight else []
+        if self.per_client:
+            caps.append(self.per_client)
+        return min(caps, default=float("inf"))
+
+    def _limit(self, rank):
+        return self.max_inflight if rank == 0 else max(1, int(self.max_inflight * self.batch_share))
+
+    def _blocked(self, rank, client, slots):
+        """Why slots can't be granted right now ("global"/"client"), or None if they can."""
+        if self.max_inflight and self.inflight + slots > self._limit(rank):
+            return "global"
+        if self.per_client and self._clients.get(client, 0) + slots > self.per_client:
+            return "client"
+        return None
+
+    def _grant(self, client, slots, priority):
+        self.inflight += slots
+        self._clients[client] = self._clients.get(client, 0) + slots
+        return Grant(client, slots, priority)
+
+    def _wake(self):
+        """Admit waiters in priority order until one is held back by the global limit."""
+        admitted = []
+        for entry in sorted(self._queue):
+            rank, _, client, slots, future, priority = entry
+            reason = self._blocked(rank, client, slots)
+            if reason == "global":
+                break
+            if reason is None:
+                future.set_result(self._grant(client, slots, priority))
+                admitted.append(entry)
+            # A client at its own limit doesn't hold up other clients
+        for entry in admitted:
+            self._remove(entry)
+
+    def _remove(self, entry):
+        try:
+            self._queue.remove(entry)
+        except ValueError:
+            return
+        heapq.heapify(self._queue)
@@ -0,0 +1,73 @@
+"""
+Shared execution for /query/batch.
+
+Dashboards send many related statements at once, typically several
+aggregates over the same tables and filters grouped the same way. Statements
+of a batch that differ only in their aggregates (same FROM and joins, same
+bound WHERE, same GROUP BY) are run as one statement: its SELECT list holds
+their group columns once and the union of their partial aggregate states,
+so each partition is read by a single worker call. Every statement then
+merges its own states from those partial rows (through a merge spec renamed
+to the shared columns) and applies its own HAVING, ORDER BY and LIMIT.
+"""
+from sqlglot import exp
+
+from rollups import split_template
+
+RESERVED_PREFIX = "__b"  # shared state column names
+
+
+def share_key(plan, where, dialect):
+    """
+    Statements with equal keys can share sub-queries; None for plans that
+    can't (not a split aggregate, or sampled).
+    """
+    if plan['merge_spec'] is None or plan['sample']:
+        return None
+    skeleton = plan['template'].copy()
+    skeleton.set("expressions", [exp.Star()])
+    for arg in ("where", "group", "order", "limit", "offset"):
+        skeleton.set(arg, None)
+    group = plan['template'].args.get("group")
+    groups, _ = split_template(plan)
+    return (skeleton.sql(dialect=dialect),
+            where.sql(dialect=dialect) if where is not None else None,
+            frozenset(e.sql(dialect=dialect) for e in (group.expressions if group else [])),
+            frozenset(node.sql(dialect=dialect) for node in groups),
+            plan['merge'], plan['table'], plan['partition_col'])
+
+
+def combine_plans(plans, dialect):
+    """
+    One plan running the partial states of all plans (which share a key), and
+    per plan the merge spec reading its states from the shared columns.
+    The group columns keep the first plan's names, so a GROUP BY on a SELECT
+    alias still resolves.
+    """
+    first = plans[0]
+    template = first['template'].copy()
+    group_items = template.expressions[:len(first['merge_spec']['group_cols'])]
+    group_names = {}
+    for node, (name, _) in zip(split_template(first)[0], first['merge_spec']['group_cols']):
+        group_names.setdefault(node.sql(dialect=dialect), name)
+
+    state_items, state_names, specs = [], {}, []
+    for plan in plans:
+        spec = plan['merge_spec']
+        groups, states = split_template(plan)
+        group_cols = [(group_names[node.sql(dialect=dialect)], output)
+                      for node, (_, output) in zip(groups, spec['group_cols'])]
+        renamed = []
+        for node, (_, op) in zip(states, spec['states']):
+            key = (node.sql(dialect=dialect), op)
+            name = state_names.get(key)
+            if name is None:
+                name = state_names[key] = f"{RESERVED_PREFIX}{len(state_names)}"
+                state_items.append(exp.alias_(node.copy(), name))
+            renamed.append((name, op))
+        specs.append(dict(spec, group_cols=group_cols, states=renamed))
+
+    template.set("expressions", group_items + state_items)
+    combined = dict(first, template=template, shape=("batch",) + tuple(plan.get('shape') for plan in plans),
+                    merge_spec=None, rollups=[], unsplit=None)
+    return combined, specs
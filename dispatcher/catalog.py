@@ -0,0 +1,269 @@
+"""
+Table statistics catalog for the dispatcher.
+
+Planning needs the value range of the partition column for every query that
+has no literal bounds. Instead of running MIN/MAX against Postgres each time,
+the catalog keeps per-(table, column) statistics in an LRU with a TTL and
+refreshes hot entries in the background. Statistics come from pg_class /
+pg_stats when the table has been ANALYZEd and from a MIN/MAX probe
+(an index probe when the column is indexed) plus sampled quantiles otherwise.
+It also remembers which columns lead an index (primary key first), so the
+planner can partition on a column Postgres can range-scan.
+
+Lookups that find nothing (an unknown column, an empty table) are cached too,
+for a shorter negative_ttl, so queries on such tables don't ask Postgres
+every time and still see the statistics soon after the table fills up.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge, Histogram
+
+log = logging.getLogger("dispatcher.catalog")
+
+STATS_LOOKUPS = Counter("dispatcher_stats_lookups_total", "Statistics catalog lookups", ["result"])
+STATS_LOAD_LATENCY = Histogram("dispatcher_stats_load_seconds", "Time spent loading table statistics from Postgres", ["source"])
+STATS_ENTRIES = Gauge("dispatcher_stats_entries", "Entries held in the statistics catalog")
+
+COLUMN_TYPE_SQL = """
+SELECT format_type(a.atttypid, a.atttypmod)
+FROM pg_attribute a
+WHERE a.attrelid = to_regclass($1)
+  AND a.attname IN ($2, lower($2))
+  AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY a.attname = $2 DESC
+LIMIT 1
+"""
+
+# Leading column of every valid index, primary key first
+KEY_COLUMNS_SQL = """
+SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+WHERE i.indrelid = to_regclass($1) AND i.indisvalid
+ORDER BY i.indisprimary DESC, i.indisunique DESC, i.indexrelid
+"""
+
+# Histogram bounds are stored as anyarray; round-trip through text to get typed values.
+PG_STATS_SQL = """
+SELECT c.reltuples::bigint AS reltuples,
+       (s.histogram_bounds::text)::{col_type}[] AS histogram
+FROM pg_class c
+LEFT JOIN pg_stats s
+       ON s.schemaname = c.relnamespace::regnamespace::text
+      AND s.tablename = c.relname
+      AND s.attname IN ($2, lower($2))
+WHERE c.oid = to_regclass($1)
+LIMIT 1
+"""
+
+# Equi-depth fallback when pg_stats has no histogram for the column
+SAMPLE_QUANTILES_SQL = """
+SELECT percentile_disc($1::float8[]) WITHIN GROUP (ORDER BY {column})
+FROM {table} TABLESAMPLE SYSTEM ($2)
+WHERE {column} IS NOT NULL
+"""
+
+
+class StatsCatalog:
+    """LRU/TTL cache of table statistics keyed by (table, column)."""
+
+    def __init__(self, pool_getter, ttl=300.0, max_entries=1024, refresh_interval=60.0,
+                 sample_rows=30000, sample_quantiles=100, negative_ttl=30.0):
+        self._pool_getter = pool_getter
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self.sample_rows = sample_rows
+        self.sample_quantiles = sample_quantiles
+        self._entries = OrderedDict()
+        self._keys = {}  # table -> (indexed columns, loaded_at)
+        self._loading = {}
+        self._task = None
+
+    async def get(self, table, column):
+        """
+        Return cached statistics for table.column, loading them on a miss.
+        Result: dict with low, high, histogram, row_estimate, source, loaded_at
+        or None when the table/column cannot be resolved.
+        """
+        key = (table, column)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry["loaded_at"] < self._ttl(entry):
+            self._entries.move_to_end(key)
+            entry["last_used"] = time.monotonic()
+            if entry.get("missing"):
+                STATS_LOOKUPS.labels(result="missing").inc()
+                return None
+            STATS_LOOKUPS.labels(result="hit").inc()
+            return entry
+
+        STATS_LOOKUPS.labels(result="miss" if entry is None else "expired").inc()
+        return await self._load_shared(key)
+
+    async def key_columns(self, table):
+        """
+        Columns that lead an index on table, primary key first ([] when unknown).
+        Cached for ttl seconds.
+        """
+        cached = self._keys.get(table)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        pool = self._pool_getter()
+        if pool is None:
+            return []
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(KEY_COLUMNS_SQL, table)
+        except Exception as e:
+            log.warning("Error loading index columns for %s: %s", table, e)
+            return []
+        columns = list(dict.fromkeys(r[0] for r in rows))
+        self._keys[table] = (columns, time.monotonic())
+        return columns
+
+    def invalidate(self, table=None, column=None):
+        """Drop cached entries for a table/column (or everything). Returns the count dropped."""
+        keys = [k for k in self._entries
+                if (table is None or k[0] == table) and (column is None or k[1] == column)]
+        for key in keys:
+            del self._entries[key]
+        if column is None:
+            for name in [t for t in self._keys if table is None or t == table]:
+                del self._keys[name]
+        STATS_ENTRIES.set(len(self._entries))
+        return len(keys)
+
+    async def refresh(self, table=None, column=None):
+        """Reload matching cached entries now; loads table.column if it is not cached yet."""
+        keys = [k for k in self._entries
+                if (table is None or k[0] == table) and (column is None or k[1] == column)]
+        if table is not None and column is not None and (table, column) not in keys:
+            keys.append((table, column))
+        await asyncio.gather(*(self._load_shared(k) for k in keys))
+        return keys
+
+    def start(self):
+        """Start the background refresh loop (no-op when refresh_interval <= 0)."""
+        if self.refresh_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _ttl(self, entry):
+        return self.negative_ttl if entry.get("missing") else self.ttl
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self._refresh_stale()
+
+    async def _refresh_stale(self):
+        """One pass of the background refresh."""
+        now = time.monotonic()
+        # Entries nobody asked for within a TTL are left to expire instead of refreshed forever;
+        # negative entries just expire and the next lookup asks again
+        for key, entry in list(self._entries.items()):
+            if now - entry["last_used"] > self.ttl or entry.get("missing") and now - entry["loaded_at"] >= self.negative_ttl:
+                self._entries.pop(key, None)
+        stale = [k for k, e in self._entries.items() if not e.get("missing") and now - e["loaded_at"] >= self.refresh_interval]
+        for key in stale:
+            try:
+                await self._load_shared(key)
+            except Exception as e:
+                log.warning("Error refreshing statistics for %s: %s", key, e)
+        STATS_ENTRIES.set(len(self._entries))
+
+    async def _load_shared(self, key):
+        """Load statistics once per key even when several queries miss at the same time."""
+        pending = self._loading.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(*key))
+            self._loading[key] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _load(self, table, column):
+        pool = self._pool_getter()
+        if pool is None:
+            return None
+        started = time.perf_counter()
+        source = "pg_stats"
+        try:
+            async with pool.acquire() as conn:
+                col_type = await conn.fetchval(COLUMN_TYPE_SQL, table, column)
+                if col_type is None:
+                    return self._store_missing(table, column)
+                row = await conn.fetchrow(PG_STATS_SQL.format(col_type=col_type), table, column)
+                row_estimate = row["reltuples"] if row and row["reltuples"] is not None and row["reltuples"] >= 0 else None
+                histogram = list(row["histogram"]) if row and row["histogram"] else None
+
+                if histogram and len(histogram) >= 2:
+                    low, high = histogram[0], histogram[-1]
+                else:
+                    # No histogram (never analyzed): MIN/MAX is answered from the index when one exists
+                    source = "probe"
+                    histogram = None
+                    bounds = await conn.fetchrow(f"SELECT MIN({column}), MAX({column}) FROM {table}")
+                    if not bounds or bounds[0] is None or bounds[1] is None:
+                        return self._store_missing(table, column)
+                    low, high = bounds[0], bounds[1]
+                    if row_estimate:
+                        histogram = await self._sample_histogram(conn, table, column, row_estimate)
+        except Exception as e:
+            log.warning("Error loading statistics for %s.%s: %s", table, column, e)
+            return None
+        finally:
+            STATS_LOAD_LATENCY.labels(source=source).observe(time.perf_counter() - started)
+
+        if histogram:
+            histogram = sorted(set(histogram))
+        now = time.monotonic()
+        entry = {
+            "low": low,
+            "high": high,
+            "histogram": histogram,
+            "row_estimate": row_estimate,
+            "type": col_type,
+            "source": source,
+            "loaded_at": now,
+            "last_used": now,
+        }
+        self._store(table, column, entry)
+        return entry
+
+    def _store(self, table, column, entry):
+        self._entries[(table, column)] = entry
+        self._entries.move_to_end((table, column))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        STATS_ENTRIES.set(len(self._entries))
+
+    def _store_missing(self, table, column):
+        """Remember for negative_ttl that table.column has no statistics; returns None like the lookup."""
+        if self.negative_ttl > 0:
+            now = time.monotonic()
+            self._store(table, column, {"missing": True, "loaded_at": now, "last_used": now})
+        return None
+
+    async def _sample_histogram(self, conn, table, column, row_estimate):
+        """Approximate equi-depth bounds from a block sample of roughly sample_rows rows."""
+        if self.sample_quantiles < 2:
+            return None
+        percent = min(100.0, max(0.01, 100.0 * self.sample_rows / row_estimate))
+        fractions = [i / self.sample_quantiles for i in range(self.sample_quantiles + 1)]
+        values = await conn.fetchval(SAMPLE_QUANTILES_SQL.format(table=table, column=column), fractions, percent)
+        if not values:
+            return None
+        values = [v for v in values if v is not None]
+        return values if len(values) >= 2 else None
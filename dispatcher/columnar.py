@@ -0,0 +1,161 @@
+"""
+Columnar merge of partial aggregate states.
+
+For large GROUP BY results the per-row dict merge in main.py spends most of
+its time in the interpreter. This path turns the worker rows into NumPy
+arrays once, factorizes the group keys into integer codes and combines every
+state column with a single vectorized reduction. It produces exactly the
+same rows as the dict merge.
+
+NumPy is optional: without it (or for state columns that aren't plain
+integers/floats, e.g. MIN over text or dates) callers fall back to the dict
+merge.
+"""
+from itertools import chain
+
+import rowformat
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+NONE_TYPE = type(None)
+# Integer sums are only vectorized while they provably fit in int64
+INT64_LIMIT = 2 ** 63
+
+
+def available():
+    return np is not None
+
+
+def state_array(values):
+    """
+    Typed array for one state column.
+    Returns (array of the non-null values, null mask or None when there are no
+    nulls), or None when the column isn't purely int or float (Decimal, str,
+    dates, bools, ...).
+    """
+    types = set(map(type, values))
+    has_nulls = NONE_TYPE in types
+    types.discard(NONE_TYPE)
+    try:
+        if types <= {int, float} and float in types:
+            # None converts to NaN
+            array = np.array(values, dtype=np.float64)
+            if not has_nulls:
+                return array, None
+            mask = ~np.isnan(array)
+            return array[mask], mask
+        if types <= {int}:
+            if not has_nulls:
+                return np.array(values, dtype=np.int64), None
+            array = np.array(values, dtype=object)
+            mask = np.not_equal(array, None)
+            return array[mask].astype(np.int64), mask
+    except OverflowError:
+        pass
+    return None
+
+
+def reduce_state(codes, array, n_groups, op):
+    """
+    Combine one state column per group.
+    Returns (values array, mask of groups that had a non-null value) or None
+    when an integer sum could overflow int64.
+    """
+    seen = np.bincount(codes, minlength=n_groups) > 0
+    if op == "add":
+        if array.dtype == np.float64:
+            out = np.bincount(codes, weights=array, minlength=n_groups)
+        else:
+            if len(array) and int(np.abs(array).max()) * len(array) >= INT64_LIMIT:
+                return None
+            out = np.zeros(n_groups, dtype=array.dtype)
+            np.add.at(out, codes, array)
+    else:
+        info = np.finfo if array.dtype == np.float64 else np.iinfo
+        if op == "min":
+            out = np.full(n_groups, info(array.dtype).max, dtype=array.dtype)
+            np.minimum.at(out, codes, array)
+        else:
+            out = np.full(n_groups, info(array.dtype).min, dtype=array.dtype)
+            np.maximum.at(out, codes, array)
+    return out, seen
+
+
+def with_nulls(values, valid):
+    """values as a list, None where valid is False."""
+    result = values.tolist()
+    if not valid.all():
+        result = [v if ok else None for v, ok in zip(result, valid.tolist())]
+    return result
+
+
+def finalize(func, states, slots):
+    """Final value list of one aggregate, mirroring main.finalize_aggregate()."""
+    if func == 'avg':
+        (total, total_seen), (count, _) = states[slots[0]], states[slots[1]]
+        valid = total_seen & (count > 0)
+        return with_nulls(total / np.where(valid, count, 1), valid)
+    values, seen = states[slots[0]]
+    if func == 'count':
+        return values.tolist()  # groups without rows already sum to 0
+    return with_nulls(values, seen)
+
+
+def column(parts, name):
+    """One column across all partitions (row lists or RowBatches) as a list."""
+    return list(chain.from_iterable(rowformat.column(rows, name) for rows in parts))
+
+
+def factorize(values):
+    """Integer code per value plus the distinct values in first-seen order."""
+    uniques = list(dict.fromkeys(values))
+    lookup = {v: i for i, v in enumerate(uniques)}
+    return np.fromiter(map(lookup.__getitem__, values), dtype=np.int64, count=len(values)), uniques
+
+
+def group_codes(parts, group_names, n_rows):
+    """Dense group id per row, numbered in first-seen order like the dict merge, plus the group key tuples."""
+    if not group_names:
+        return np.zeros(n_rows, dtype=np.int64), [()] if n_rows else []
+    if len(group_names) == 1:
+        codes, uniques = factorize(column(parts, group_names[0]))
+        return codes, [(v,) for v in uniques]
+    return factorize(list(zip(*[column(parts, name) for name in group_names])))
+
+
+def merge_result_rows(parts, spec):
+    """
+    Vectorized equivalent of main.build_result_rows(main.merge_partial_states()).
+    Returns the merged result rows, or None if some state column can't be
+    merged as a numeric array.
+    """
+    if any(op not in ("add", "min", "max") for _, op in spec['states']):
+        return None  # sketch states (lists) merge in main.merge_partial_states()
+    codes, group_keys = group_codes(parts, [name for name, _ in spec['group_cols']], sum(map(len, parts)))
+    n_groups = len(group_keys)
+
+    states = []
+    for col, op in spec['states']:
+        typed = state_array(column(parts, col))
+        if typed is None:
+            return None
+        array, mask = typed
+        state = reduce_state(codes if mask is None else codes[mask], array, n_groups, op)
+        if state is None:
+            return None
+        states.append(state)
+
+    key_columns = list(zip(*group_keys)) or [()] * len(spec['group_cols'])
+    names, columns = [], []
+    for kind, idx in spec['outputs']:
+        if kind == 'group':
+            names.append(spec['group_cols'][idx][1])
+            columns.append(key_columns[idx])
+        else:
+            name, func, slots = spec['finals'][idx]
+            names.append(name)
+            columns.append(finalize(func, states, slots))
+    return [dict(zip(names, values)) for values in zip(*columns)]
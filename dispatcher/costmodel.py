@@ -0,0 +1,132 @@
+"""
+Query cost estimates for the split decision.
+
+Fanning a point lookup out to every worker costs more in round trips and
+merging than the lookup itself. Before splitting, the dispatcher asks
+Postgres for EXPLAIN (FORMAT JSON) of the unsplit statement, runs anything
+cheaper than a threshold on one worker and sizes the split of everything
+else by its estimated cost. Estimates are cached per query shape for a TTL,
+so the EXPLAIN round trip is paid once per shape, not once per request;
+concurrent misses for the same shape share one EXPLAIN.
+
+A shape leaves out the WHERE literals, so its requests can cover very
+different ranges. Each estimate is kept with the catalog's row estimate for
+the range it was made for, and a request with a row estimate for its own
+range gets the cost and scanned rows scaled by the ratio of the two. Planner
+costs are far from linear in rows (a point lookup is an index probe, a wide
+range a scan), so estimates are only scaled within a band of max_scale: each
+band of row counts (1-9, 10-99, ... for 10) has its own EXPLAIN. Requests
+without a row estimate (no catalog statistics) are cached per bound WHERE instead.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+log = logging.getLogger("dispatcher.costmodel")
+
+COST_ESTIMATES = Counter("dispatcher_cost_estimates_total", "Cost estimate lookups", ["result"])
+
+
+def scan_rows(node):
+    """Rows the plan's leaf (scan) nodes are expected to produce, counting every parallel worker."""
+    children = node.get("Plans")
+    if not children:
+        return node.get("Plan Rows", 0)
+    rows = sum(scan_rows(child) for child in children)
+    # Nodes below Gather report rows per process; the leader participates too
+    return rows * (node["Workers Planned"] + 1) if "Workers Planned" in node else rows
+
+
+def scale_estimate(entry, rows):
+    """
+    A cached entry's estimate for a request expected to read rows (the catalog's
+    estimate for its range) instead of the rows the entry was made for.
+    Rows returned are left alone: an aggregate returns as many groups either way.
+    """
+    estimate, base = entry["estimate"], entry["rows"]
+    if rows is None or base is None or rows == base:
+        return estimate
+    factor = max(rows, 1.0) / max(base, 1.0)
+    return dict(estimate, cost=estimate["cost"] * factor, rows=estimate["rows"] * factor)
+
+
+def row_band(rows, max_scale):
+    """Band of row counts within which estimates are scaled: rows within max_scale of each other."""
+    if max_scale <= 1:
+        return rows
+    return math.floor(math.log(max(rows, 1.0), max_scale))
+
+
+class CostEstimator:
+    """Per-shape (and row band) LRU/TTL cache of EXPLAIN estimates."""
+
+    def __init__(self, pool_getter, ttl=300.0, max_entries=1024, max_scale=10.0):
+        self._pool_getter = pool_getter
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_scale = max_scale
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def estimate(self, key, render, rows=None):
+        """
+        Estimate for the statement render() produces, cached under key (the query
+        shape) and the band of rows, the catalog's row estimate for its range,
+        and scaled to rows. Returns {'cost': total cost, 'rows': rows scanned,
+        'result_rows': rows returned} or None when Postgres can't be asked.
+        """
+        if key is not None and rows is not None:
+            key = (key, row_band(rows, self.max_scale))
+        entry = self._entries.get(key) if key is not None else None
+        if entry is not None and time.monotonic() - entry["loaded_at"] < self.ttl:
+            self._entries.move_to_end(key)
+            COST_ESTIMATES.labels(result="hit").inc()
+            return scale_estimate(entry, rows)
+        COST_ESTIMATES.labels(result="miss").inc()
+        if key is None:
+            return await self._explain(render())
+        pending = self._loading.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(key, render(), rows))
+            self._loading[key] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(key, None))
+        entry = await asyncio.shield(pending)
+        return scale_estimate(entry, rows) if entry is not None else None
+
+    def invalidate(self):
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    async def _load(self, key, sql, rows):
+        estimate = await self._explain(sql)
+        if estimate is None:
+            return None
+        entry = {"estimate": estimate, "rows": rows, "loaded_at": time.monotonic()}
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def _explain(self, sql):
+        pool = self._pool_getter()
+        if pool is None:
+            return None
+        try:
+            async with pool.acquire() as conn:
+                raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}")
+        except Exception as e:
+            COST_ESTIMATES.labels(result="error").inc()
+            log.warning("Error estimating cost: %s", e)
+            return None
+        root = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        return {"cost": root["Total Cost"], "rows": scan_rows(root), "result_rows": root["Plan Rows"]}
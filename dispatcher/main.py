@@ -1,44 +1,499 @@
 import os
+import json
+import logging
+import operator
+import math
+import heapq
+from collections import deque
+from itertools import chain, islice
+import asyncio
 import httpx
 import asyncpg
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlglot import parse_one, exp
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
 from prometheus_client import Counter, Histogram, Gauge, start_http_server
 import time
+from datetime import date, datetime
+from decimal import Decimal
+from catalog import StatsCatalog
+from plancache import PlanCache, normalize_sql
+from resultcache import ResultCache
+from partialcache import PartialCache
+from rollups import Rollup, RollupSet, ROLLUP_LOOKUPS, ROLLUP_REFRESHES, load_definitions
+from scheduler import WorkerScheduler
+from admission import AdmissionController, Overloaded, PRIORITIES
+from costmodel import CostEstimator
+import batch
+import columnar
+import rowformat
+import sampling
+import sketches
+import tracing
 
 app = FastAPI()
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG traces planning and merging per query
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json (one object per record, with trace_id)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # share of queries with spans and a logged stage breakdown
+tracing.configure_logging(LOG_LEVEL, LOG_FORMAT)
+log = logging.getLogger("dispatcher")
+
 # Prometheus metrics
 REQ_TOTAL = Counter("dispatcher_requests_total", "All incoming /query requests")
+RESULT_CACHE_LOOKUPS = Counter("dispatcher_result_cache_lookups_total", "Result cache lookups by outcome", ["result"])
+RESULT_CACHE_SIZE = Gauge("dispatcher_result_cache_bytes", "Approximate bytes of results held in the result cache")
+RESULT_CACHE_ENTRIES = Gauge("dispatcher_result_cache_entries", "Results held in the result cache")
 SPLIT_TOTAL = Counter("dispatcher_splits_total", "Number of sub-queries created")
 AGG_QUERIES = Counter("dispatcher_aggregate_queries_total", "Aggregate queries", ["agg_type"])
 DYNAMIC_SPLITS = Counter("dispatcher_dynamic_splits_total", "Queries split dynamically (no explicit BETWEEN)")
 QUERY_LATENCY = Histogram("dispatcher_query_duration_seconds", "Query latency", ["query_type"])
 WORKER_REQUESTS = Counter("dispatcher_worker_requests_total", "Total requests sent to workers")
+WORKER_CONNECTIONS = Counter("dispatcher_worker_connections_total", "Worker requests by pooled connection use", ["connection"])
+WORKER_POOL_WAIT = Histogram("dispatcher_worker_pool_wait_seconds", "Time a worker request waited for a pooled connection",
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
 ACTIVE_QUERIES = Gauge("dispatcher_active_queries", "Currently processing queries")
+ADMISSION_WAIT = Histogram("dispatcher_admission_wait_seconds", "Time queries waited for sub-query slots", ["priority"],
+                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+ADMISSION_SHED = Counter("dispatcher_admission_shed_total", "Queries rejected with 429 by admission control", ["priority", "reason"])
+ADMISSION_QUEUED = Gauge("dispatcher_admission_queued", "Queries waiting for sub-query slots")
+ADMISSION_SLOTS = Gauge("dispatcher_admission_inflight_slots", "Sub-query slots held by admitted queries")
 GROUP_BY_QUERIES = Counter("dispatcher_group_by_queries_total", "Queries with GROUP BY")
+SPLIT_DECISIONS = Counter("dispatcher_split_decisions_total", "Split decisions by reason", ["decision"])
+PARTITIONS_PRUNED = Counter("dispatcher_partitions_pruned_total", "Partitions skipped because no IN value falls in their range")
+PARTITION_COUNT = Histogram("dispatcher_partitions_per_query", "Degree of parallelism chosen per query",
+                            buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64))
+WORKER_INFLIGHT = Gauge("dispatcher_worker_inflight_requests", "Sub-queries currently running on workers")
+SUBQUERY_HEDGES = Counter("dispatcher_subquery_hedges_total", "Duplicate requests sent for sub-queries slower than the recent p95")
+SUBQUERY_RETRIES_TOTAL = Counter("dispatcher_subquery_retries_total", "Sub-query attempts retried after a worker error")
+SUBQUERY_TIMEOUTS = Counter("dispatcher_subquery_timeouts_total", "Sub-queries that missed SUBQUERY_TIMEOUT")
+SUBQUERY_RESPLITS = Counter("dispatcher_subquery_resplits_total", "Timed-out sub-queries re-split into smaller ranges")
+MERGE_PATH = Counter("dispatcher_merge_path_total", "Aggregate merges by implementation", ["path"])
+APPROXIMATE_QUERIES = Counter("dispatcher_approximate_queries_total", "Queries answered from a TABLESAMPLE sample", ["method"])
+SKETCH_AGGREGATES = Counter("dispatcher_sketch_aggregates_total", "Distinct counts and percentiles merged from per-partition summaries", ["func"])
+BATCH_STATEMENTS = Counter("dispatcher_batch_statements_total", "Statements received through /query/batch by how they ran", ["execution"])
 
 # Where workers live (Docker‑Compose service name)
 WORKER_URL = os.getenv("WORKER_URL", "http://worker-svc:8001/execute")
-MAX_PARTS = int(os.getenv("MAX_PARTS", "4"))   # how many parallel pieces per query
-DB_DSN = os.getenv("DB_DSN", "postgres://user:pw@postgres:5432/demo")
+MAX_PARTS = int(os.getenv("MAX_PARTS", "4"))   # upper bound on parallel pieces per query
+DB_DSN = os.getenv("DB_DSN", "postgres://user:pw@postgres:5432/demo")  # empty: run without the catalog database
+SQL_DIALECT = os.getenv("SQL_DIALECT", "postgres")  # dialect of incoming SQL and of the sub-queries workers run
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))  # distinct query shapes kept in the plan cache
+PARAM_PREFIX = "__p"  # placeholder names for re-bindable literals in cached plans
+SAMPLED_VARIANTS = 8  # approximate-mode variants kept per cached plan (one per fraction/method/seed)
+
+# Streaming mode ("stream": true): rows are forwarded as NDJSON while partitions run
+NDJSON_TYPE = "application/x-ndjson"
+STREAM_QUEUE_ROWS = int(os.getenv("STREAM_QUEUE_ROWS", "1000"))  # rows buffered before workers are paused
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "256"))  # max rows per chunk written to the client
+STREAM_DONE = object()  # end-of-partition marker on the stream queue
+
+def env_flag(name, default="false"):
+    """Read a boolean environment variable (1/true/yes/on)."""
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+# Adaptive degree of parallelism (MAX_PARTS is the upper clamp)
+ADAPTIVE_PARTS = env_flag("ADAPTIVE_PARTS", "true")  # false: always split MAX_PARTS ways
+MIN_PARTS = int(os.getenv("MIN_PARTS", "1"))
+ROWS_PER_PART = int(os.getenv("ROWS_PER_PART", "50000"))  # target rows scanned per sub-query
+# EXPLAIN-based split decision (cached per query shape); SPLIT_MIN_COST=0 skips EXPLAIN
+SPLIT_MIN_COST = float(os.getenv("SPLIT_MIN_COST", "1000"))  # cheaper statements run on one worker
+COST_PER_PART = float(os.getenv("COST_PER_PART", "5000"))  # planner cost units per sub-query
+COST_TTL = float(os.getenv("COST_TTL", "300"))
+COST_MAX_SCALE = float(os.getenv("COST_MAX_SCALE", "10"))  # cached estimates scale by at most this row ratio
+WORKER_SLOTS = int(os.getenv("WORKER_SLOTS", "2"))  # sub-queries one worker runs concurrently without queueing
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "4"))  # used when WORKER_DNS_NAME is unset or unresolvable
+WORKER_DNS_NAME = os.getenv("WORKER_DNS_NAME", "")  # headless service: one A record per worker pod
+WORKER_DNS_TTL = float(os.getenv("WORKER_DNS_TTL", "10"))
+# Worker-aware scheduling: sub-queries go straight to a pod instead of through the Service
+WORKER_ENDPOINTS = [u for u in os.getenv("WORKER_ENDPOINTS", "").replace(" ", "").split(",") if u]  # static list, overrides DNS
+SCHEDULER_STRATEGY = os.getenv("SCHEDULER_STRATEGY", "p2c")  # p2c | least (least outstanding estimated rows)
+
+# Shared worker HTTP client: pool limits, keep-alive and per-stage timeouts
+WORKER_MAX_CONNECTIONS = int(os.getenv("WORKER_MAX_CONNECTIONS", "100"))
+WORKER_MAX_KEEPALIVE = int(os.getenv("WORKER_MAX_KEEPALIVE", "20"))
+WORKER_KEEPALIVE_EXPIRY = float(os.getenv("WORKER_KEEPALIVE_EXPIRY", "30"))
+WORKER_HTTP2 = env_flag("WORKER_HTTP2")  # needs h2 and a TLS/h2c-capable worker endpoint
+WORKER_CONNECT_TIMEOUT = float(os.getenv("WORKER_CONNECT_TIMEOUT", "2"))
+WORKER_READ_TIMEOUT = float(os.getenv("WORKER_READ_TIMEOUT", "60"))
+WORKER_WRITE_TIMEOUT = float(os.getenv("WORKER_WRITE_TIMEOUT", "10"))
+WORKER_POOL_TIMEOUT = float(os.getenv("WORKER_POOL_TIMEOUT", "5"))
+WORKER_COMPACT_ROWS = env_flag("WORKER_COMPACT_ROWS", "true")  # ask workers for column names once + row arrays
+
+# Statistics catalog (cached table bounds instead of a MIN/MAX scan per query)
+STATS_TTL = float(os.getenv("STATS_TTL", "300"))
+STATS_MAX_ENTRIES = int(os.getenv("STATS_MAX_ENTRIES", "1024"))
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "60"))  # 0 disables background refresh
+STATS_SAMPLE_ROWS = int(os.getenv("STATS_SAMPLE_ROWS", "30000"))  # sample size for quantiles when pg_stats has no histogram
+STATS_NEGATIVE_TTL = float(os.getenv("STATS_NEGATIVE_TTL", "30"))  # how long "no statistics" answers are cached
+
+# Aggregate merge: partial rows at which the NumPy columnar merge takes over (0 disables it)
+COLUMNAR_MERGE_ROWS = int(os.getenv("COLUMNAR_MERGE_ROWS", "20000"))
+# COUNT(DISTINCT) across partitions: sketch (KMV, exact below DISTINCT_SKETCH_SIZE values) | exact (ships every value) | off (unsplit)
+DISTINCT_COUNT_MODE = os.getenv("DISTINCT_COUNT_MODE", "sketch").lower()
+DISTINCT_SKETCH_SIZE = int(os.getenv("DISTINCT_SKETCH_SIZE", "1024"))  # hashes per KMV sketch; ~1/sqrt(k) relative error
+PERCENTILE_SKETCH_SIZE = int(os.getenv("PERCENTILE_SKETCH_SIZE", "100"))  # quantiles per partition summary; rank error < 1/size
+
+# Result cache (0 bytes disables it)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+RESULT_CACHE_POLL_INTERVAL = float(os.getenv("RESULT_CACHE_POLL_INTERVAL", "1"))  # table version probe; 0 disables
+RESULT_CACHE_CHANNEL = os.getenv("RESULT_CACHE_CHANNEL", "")  # LISTEN channel whose NOTIFY payload names a changed table
+
+# Partial aggregate cache for append-only tables: "table:column,..." where column only grows
+PARTIAL_CACHE_TABLES = dict(item.split(":", 1) for item in os.getenv("PARTIAL_CACHE_TABLES", "").replace(" ", "").split(",") if ":" in item)
+PARTIAL_CACHE_MAX_BYTES = int(os.getenv("PARTIAL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+PARTIAL_CACHE_TTL = float(os.getenv("PARTIAL_CACHE_TTL", "3600"))
+
+# Rollups: declared aggregate queries kept pre-aggregated and answered without fan-out
+ROLLUPS_FILE = os.getenv("ROLLUPS_FILE", "")  # JSON list of {"name", "sql"}; empty disables rollups
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))
+
+# Admission control: sub-query slots reserved by running queries, waiting queries beyond that
+ADMISSION_MAX_SUBQUERIES = int(os.getenv("ADMISSION_MAX_SUBQUERIES", "64"))  # global limit; 0 = unlimited
+ADMISSION_CLIENT_SUBQUERIES = int(os.getenv("ADMISSION_CLIENT_SUBQUERIES", "0"))  # per payload "client"; 0 = unlimited
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))  # waiting queries before shedding with 429
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_BATCH_SHARE = float(os.getenv("ADMISSION_BATCH_SHARE", "0.5"))  # share of the global limit batch queries may fill
+
+# Joins: dimension tables every sub-query reads whole, fact tables are range-partitioned on a join key
+BROADCAST_TABLES = {t for t in os.getenv("BROADCAST_TABLES", "departments,products").replace(" ", "").split(",") if t}
+PARTITION_KEYS = dict(item.split(":", 1) for item in os.getenv("PARTITION_KEYS", "").replace(" ", "").split(",") if ":" in item)  # table:column
+
+# Stragglers: per-sub-query deadline, hedging after the recent p95, re-splitting on timeout
+BATCH_MAX_STATEMENTS = int(os.getenv("BATCH_MAX_STATEMENTS", "100"))  # statements accepted per /query/batch request
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "120"))  # whole query; outstanding sub-queries are cancelled
+SUBQUERY_TIMEOUT = float(os.getenv("SUBQUERY_TIMEOUT", "30"))
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))  # 0 disables hedged requests
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # latencies needed before hedging starts
+SUBQUERY_RETRIES = int(os.getenv("SUBQUERY_RETRIES", "1"))
+RESPLIT_WAYS = int(os.getenv("RESPLIT_WAYS", "4"))
+RESPLIT_DEPTH = int(os.getenv("RESPLIT_DEPTH", "1"))  # how often a range may be re-split
+
+class LatencyWindow:
+    """Completion times of recent sub-queries, for the hedging delay."""
+
+    def __init__(self, size=512):
+        self._samples = deque(maxlen=size)
+        self._sorted = None
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self._sorted = None
+
+    def quantile(self, q):
+        """q-quantile of the window, or None until HEDGE_MIN_SAMPLES were seen."""
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
 
 # Database connection pool (initialized on startup)
 db_pool = None
+# Long-lived worker HTTP client (initialized on startup)
+worker_client = None
+# Sub-queries sent to workers and not yet answered
+inflight_subqueries = 0
+# Worker pods (headless-service DNS or WORKER_ENDPOINTS) and the work outstanding on each
+worker_scheduler = WorkerScheduler(WORKER_URL, endpoints=WORKER_ENDPOINTS,
+                                   dns_name="" if WORKER_ENDPOINTS else WORKER_DNS_NAME,
+                                   dns_ttl=WORKER_DNS_TTL, strategy=SCHEDULER_STRATEGY)
+# Recent sub-query completion times (hedging threshold)
+subquery_latency = LatencyWindow()
+# Parsed/analyzed plans keyed by literal-normalized SQL
+plan_cache = PlanCache(max_entries=PLAN_CACHE_SIZE)
+# Cached per-(table, column) statistics used for partitioning
+stats_catalog = StatsCatalog(lambda: db_pool, ttl=STATS_TTL, max_entries=STATS_MAX_ENTRIES,
+                             refresh_interval=STATS_REFRESH_INTERVAL, sample_rows=STATS_SAMPLE_ROWS,
+                             negative_ttl=STATS_NEGATIVE_TTL)
+# Merged results keyed by normalized SQL, invalidated when their tables change
+result_cache = ResultCache(lambda: db_pool, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL,
+                           poll_interval=RESULT_CACHE_POLL_INTERVAL, channel=RESULT_CACHE_CHANNEL)
+# Partial states of closed ranges on append-only tables
+partial_cache = PartialCache(max_bytes=PARTIAL_CACHE_MAX_BYTES, ttl=PARTIAL_CACHE_TTL)
+# Pre-aggregated rollups (loaded at startup from ROLLUPS_FILE)
+rollup_set = RollupSet(refresh_interval=ROLLUP_REFRESH_INTERVAL)
+RESULT_CACHE_SIZE.set_function(lambda: result_cache.bytes)
+RESULT_CACHE_ENTRIES.set_function(lambda: len(result_cache))
+# EXPLAIN estimates per query shape
+cost_estimator = CostEstimator(lambda: db_pool, ttl=COST_TTL, max_entries=PLAN_CACHE_SIZE,
+                               max_scale=COST_MAX_SCALE)
+# Sub-query slots per query, globally and per client, with the interactive/batch wait queue
+admission = AdmissionController(max_inflight=ADMISSION_MAX_SUBQUERIES, per_client=ADMISSION_CLIENT_SUBQUERIES,
+                                queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                                batch_share=ADMISSION_BATCH_SHARE)
+ADMISSION_QUEUED.set_function(lambda: admission.queued)
+ADMISSION_SLOTS.set_function(lambda: admission.inflight)
 
-async def get_table_bounds(table_name: str, partition_col: str = "id"):
+def create_worker_client():
+    """Build the pooled keep-alive client shared by every /query call."""
+    limits = httpx.Limits(
+        max_connections=WORKER_MAX_CONNECTIONS,
+        max_keepalive_connections=WORKER_MAX_KEEPALIVE,
+        keepalive_expiry=WORKER_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=WORKER_CONNECT_TIMEOUT,
+        read=WORKER_READ_TIMEOUT,
+        write=WORKER_WRITE_TIMEOUT,
+        pool=WORKER_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=WORKER_HTTP2)
+
+def pool_trace():
     """
-    Query the database to find min/max values for dynamic splitting.
-    Returns: (min_val, max_val) or (None, None) if not found
+    httpx trace hook for one worker request. Records whether the request
+    opened a new connection or reused a pooled one, and how long it waited
+    for that connection.
+    """
+    started = time.perf_counter()
+    seen = []
+
+    async def trace(event, info):
+        if seen:
+            return
+        if event == "connection.connect_tcp.started":
+            seen.append("new")
+        elif event.endswith("send_request_headers.started"):
+            seen.append("reused")
+        else:
+            return
+        WORKER_CONNECTIONS.labels(connection=seen[0]).inc()
+        WORKER_POOL_WAIT.observe(time.perf_counter() - started)
+
+    return trace
+
+async def post_to_worker(sql, url=WORKER_URL):
+    """Send one sub-query to a worker over the shared client."""
+    global inflight_subqueries
+    inflight_subqueries += 1
+    WORKER_INFLIGHT.inc()
+    try:
+        headers = tracing.headers({"Accept": rowformat.ACCEPT} if WORKER_COMPACT_ROWS else None)
+        return await worker_client.post(url, json={"sql": sql}, headers=headers, extensions={"trace": pool_trace()})
+    finally:
+        inflight_subqueries -= 1
+        WORKER_INFLIGHT.dec()
+
+async def stream_from_worker(sql, queue):
+    """
+    Stream one sub-query's rows into queue as NDJSON lines while the worker
+    produces them. Workers that don't speak NDJSON are decoded whole and
+    re-encoded. A full queue blocks here, which stops reading from the worker
+    socket and so pushes back on the worker.
     """
+    global inflight_subqueries
+    inflight_subqueries += 1
+    WORKER_INFLIGHT.inc()
+    worker = worker_scheduler.acquire()
+    started = time.perf_counter()
+    elapsed = None
     try:
-        async with db_pool.acquire() as conn:
-            query = f"SELECT MIN({partition_col}), MAX({partition_col}) FROM {table_name}"
-            row = await conn.fetchrow(query)
-            if row and row[0] is not None and row[1] is not None:
-                return (row[0], row[1])
+        async with worker_client.stream("POST", worker.url, json={"sql": sql}, headers=tracing.headers({"Accept": NDJSON_TYPE}),
+                                        extensions={"trace": pool_trace()}) as r:
+            if r.status_code != 200:
+                body = await r.aread()
+                raise RuntimeError(f"Worker error: {body.decode(errors='replace')}")
+            if r.headers.get("content-type", "").startswith(NDJSON_TYPE):
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    if line.startswith('{"__error"'):
+                        raise RuntimeError(f"Worker error: {json.loads(line)['__error']}")
+                    await queue.put(line)
+            else:
+                for row in json.loads(await r.aread()).get("rows") or []:
+                    await queue.put(json.dumps(row))
+        elapsed = time.perf_counter() - started
+    finally:
+        worker_scheduler.release(worker, elapsed=elapsed)
+        inflight_subqueries -= 1
+        WORKER_INFLIGHT.dec()
+
+def start_partition_streams(subqueries, queues):
+    """
+    One producer task per sub-query, feeding queues[i] (or a shared queue).
+    Each producer ends with STREAM_DONE, or with the exception that stopped it.
+    """
+    async def produce(sql, queue):
+        try:
+            await stream_from_worker(sql, queue)
+            await queue.put(STREAM_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+
+    return [asyncio.create_task(produce(sql, queue)) for sql, queue in zip(subqueries, queues)]
+
+async def stream_partitions(subqueries, plan):
+    """
+    NDJSON body for a streamed query: rows are written in chunks as soon as any
+    partition produces them, up to OFFSET/LIMIT. A worker failure ends the
+    stream with an {"error": ...} line; a client disconnect or reaching LIMIT
+    cancels the outstanding partitions.
+    """
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_ROWS)
+    tasks = start_partition_streams(subqueries, [queue] * len(subqueries))
+    remaining = len(tasks)
+    skip = plan['offset']
+    left = plan['limit']
+    try:
+        while remaining and left != 0:
+            lines = []
+            item = await queue.get()
+            while True:
+                if item is STREAM_DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    if lines:
+                        yield "\n".join(lines) + "\n"
+                    yield json.dumps({"error": str(item)}) + "\n"
+                    return
+                elif skip:
+                    skip -= 1
+                else:
+                    lines.append(item)
+                    if left is not None:
+                        left -= 1
+                if left == 0 or len(lines) >= STREAM_CHUNK_ROWS or queue.empty():
+                    break
+                item = queue.get_nowait()
+            if lines:
+                yield "\n".join(lines) + "\n"
+    finally:
+        for t in tasks:
+            t.cancel()
+
+async def stream_sorted_partitions(subqueries, plan):
+    """
+    NDJSON body for a streamed ORDER BY query: a heap-based k-way merge over
+    the partition streams (each already sorted by its worker) that stops and
+    cancels the partitions once OFFSET + LIMIT rows have been merged.
+    """
+    key = order_key(plan['order'])
+    per_part = max(1, STREAM_QUEUE_ROWS // max(1, len(subqueries)))
+    queues = [asyncio.Queue(maxsize=per_part) for _ in subqueries]
+    tasks = start_partition_streams(subqueries, queues)
+    skip = plan['offset']
+    left = plan['limit']
+
+    async def pull(i):
+        item = await queues[i].get()
+        if isinstance(item, Exception):
+            raise item
+        return None if item is STREAM_DONE else json.loads(item)
+
+    try:
+        heap = []
+        for i in range(len(queues)):
+            row = await pull(i)
+            if row is not None:
+                heap.append((key(row), i, row))
+        heapq.heapify(heap)
+        lines = []
+        while heap and left != 0:
+            _, i, row = heap[0]
+            nxt = await pull(i)
+            if nxt is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (key(nxt), i, nxt))
+            if skip:
+                skip -= 1
+                continue
+            for name in plan['hidden']:
+                row.pop(name, None)
+            lines.append(json.dumps(row))
+            if left is not None:
+                left -= 1
+            if len(lines) >= STREAM_CHUNK_ROWS:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
     except Exception as e:
-        print(f"Error querying bounds: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        for t in tasks:
+            t.cancel()
+
+async def stream_result_rows(rows):
+    """NDJSON body for a result that was already merged in the dispatcher."""
+    for i in range(0, len(rows), STREAM_CHUNK_ROWS):
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows[i:i + STREAM_CHUNK_ROWS])
+
+class StreamedResponse(StreamingResponse):
+    """
+    NDJSON response that calls on_done once it has ended, however it ends: body
+    finished, client gone, or a send that failed before the body ever started
+    (a body generator that never runs never reaches its finally).
+    """
+
+    def __init__(self, body, on_done, headers=None):
+        super().__init__(body, media_type=NDJSON_TYPE, headers=headers)
+        self.on_done = on_done
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_done()
+
+async def current_worker_count():
+    """Number of worker pods known to the scheduler (headless-service DNS or WORKER_ENDPOINTS)."""
+    await worker_scheduler.refresh()
+    return worker_scheduler.discovered or WORKER_COUNT
+
+async def choose_partition_count(estimated_rows, estimated_cost=None):
+    """
+    Pick the degree of parallelism for one query.
+    Small scans are not split at all, large ones get one part per COST_PER_PART
+    of planner cost (or per ROWS_PER_PART rows without an EXPLAIN estimate),
+    and the total is capped by the worker slots that are free right now.
+    """
+    if not ADAPTIVE_PARTS:
+        return MAX_PARTS
+    workers = await current_worker_count()
+    if estimated_cost is not None:
+        wanted = math.ceil(estimated_cost / COST_PER_PART)
+    elif estimated_rows is None:
+        wanted = workers
+    else:
+        wanted = math.ceil(estimated_rows / ROWS_PER_PART)
+    free_slots = workers * WORKER_SLOTS - inflight_subqueries
+    return max(MIN_PARTS, min(MAX_PARTS, wanted, max(free_slots, 1)))
+
+def estimate_rows(stats, low, high):
+    """Rows of the table expected inside [low, high], from the catalog's row count and histogram."""
+    if not stats or stats.get("row_estimate") is None:
+        return None
+    total = stats["row_estimate"]
+    histogram = stats.get("histogram")
+    try:
+        if histogram and len(histogram) > 1:
+            inside = sum(1 for v in histogram if low <= v <= high)
+            return total * max(inside, 1) / len(histogram)
+        if stats["high"] > stats["low"]:
+            fraction = (min(high, stats["high"]) - max(low, stats["low"])) / (stats["high"] - stats["low"])
+            return total * min(max(fraction, 0.0), 1.0)
+    except TypeError:
+        pass
+    return total
+
+async def get_table_bounds(table_name: str, partition_col: str = "id"):
+    """
+    Look up min/max values for dynamic splitting in the statistics catalog.
+    Bounds from pg_stats are approximate, so callers must leave the outer
+    partitions open-ended.
+    Returns: (min_val, max_val) or (None, None) if not found
+    """
+    stats = await stats_catalog.get(table_name, partition_col)
+    if stats:
+        return (stats["low"], stats["high"])
     return (None, None)
 
 def extract_table_name(parsed):
@@ -46,116 +501,912 @@ def extract_table_name(parsed):
     if not isinstance(parsed, exp.Select):
         return None
     
-    # Find the FROM clause
-    from_clause = parsed.args.get("from")
+    # Find the FROM clause (newer sqlglot releases store it as "from_")
+    from_clause = parsed.args.get("from") or parsed.args.get("from_")
     if from_clause:
         # Get the first table
         for table in from_clause.find_all(exp.Table):
             return table.name
     return None
 
+def referenced_tables(parsed):
+    """Names of the tables a statement reads (CTE names excluded), for cache invalidation."""
+    ctes = {cte.alias_or_name for cte in parsed.find_all(exp.CTE)}
+    return sorted({exp.table_name(t) for t in parsed.find_all(exp.Table)} - ctes)
+
+def join_partitioning(select):
+    """
+    Partitioning for a SELECT with JOINs: (table, column, qualified columns the
+    range applies to), or None when it shouldn't be split.
+    Broadcast tables are read whole by every sub-query. The range goes on one
+    fact table's column: its PARTITION_KEYS entry, else the key of the latest
+    equi-join between two fact tables, else its own WHERE or join column. A
+    range on one column of the joined rows always partitions them, whatever
+    the join type; with inner joins only, it is repeated on the fact tables
+    equi-joined on that key so each of them is scanned for the range alone.
+    """
+    from_clause = select.args.get("from") or select.args.get("from_")
+    sources = [from_clause.this if from_clause else None] + [join.this for join in select.args.get("joins") or []]
+    if not all(isinstance(source, exp.Table) for source in sources):
+        return None
+    tables = {source.alias_or_name: source.name for source in sources}
+    facts = [alias for alias, name in tables.items() if name not in BROADCAST_TABLES]
+    if not facts:
+        return None
+
+    # Equi-join edges between qualified columns: (alias, column) pairs
+    edges = []
+    for join in select.args.get("joins") or []:
+        on = join.args.get("on")
+        for eq in (on.find_all(exp.EQ) if on is not None else []):
+            left, right = eq.this, eq.expression
+            if isinstance(left, exp.Column) and isinstance(right, exp.Column) and left.table in tables and right.table in tables:
+                edges.append(((left.table, left.name), (right.table, right.name)))
+    fact_edges = [(a, b) for a, b in edges if a[0] in facts and b[0] in facts and a[0] != b[0]]
+
+    key = next(((alias, PARTITION_KEYS[tables[alias]]) for alias in facts if tables[alias] in PARTITION_KEYS), None)
+    if key is None and fact_edges:
+        # The table joined last is usually the largest (orders -> order_items)
+        key = fact_edges[-1][1]
+    if key is None:
+        alias = facts[-1]
+        where = select.args.get("where")
+        own = [c.name for c in (where.find_all(exp.Column) if where else []) if c.table == alias]
+        joined = [col for a, b in edges for (t, col) in (a, b) if t == alias]
+        if not own and not joined:
+            return None
+        key = (alias, (own or joined)[-1])
+
+    columns = [key]
+    if all(not join.side and join.kind in ("", "INNER") for join in select.args.get("joins") or []):
+        for a, b in fact_edges:
+            for this, other in ((a, b), (b, a)):
+                if this == key and other not in columns:
+                    columns.append(other)
+    return tables[key[0]], key[1], [exp.column(col, table=alias) for alias, col in columns]
+
 def can_split(parsed):
     """Determine if a query can be split. Now supports queries without explicit BETWEEN."""
     if not isinstance(parsed, exp.Select):
         return False
+    if parsed.args.get("distinct"):
+        # Partitions can return the same row: only one sub-query sees every duplicate
+        return False
     
     # We can split any SELECT query that has a table
     table_name = extract_table_name(parsed)
     return table_name is not None
 
-async def make_subqueries(sql, n_parts=MAX_PARTS):
-    """Intelligent range partition using dynamic database bounds."""
-    parsed = parse_one(sql)
-    
-    # Remove HAVING clause from subqueries (it must be applied globally after merge)
-    if parsed.args.get("having"):
-        print(f"DEBUG: Removing HAVING clause from worker queries")
-        parsed.set("having", None)
+def literal_value(node):
+    """
+    Convert a SQL literal into a Python value usable as a partition bound.
+    Handles numbers, ISO date/timestamp strings and CAST('...' AS DATE/TIMESTAMP).
+    Uncast strings stay strings: only the column type tells whether '2024-01-01'
+    is a date (see temporal_value()). Returns None for anything that is not an
+    orderable constant.
+    """
+    if isinstance(node, exp.Cast) and isinstance(node.this, exp.Literal) and node.this.is_string:
+        value = temporal_value(node.this.this, node.to.sql(dialect=SQL_DIALECT).lower())
+        return value if isinstance(value, date) else literal_value(node.this)
+    if not isinstance(node, exp.Literal):
+        return None
+    if node.is_int:
+        return int(node.this)
+    if node.is_number:
+        return float(node.this)
+    value = temporal_value(node.this, "timestamp")
+    return node.this if isinstance(value, datetime) else None
+
+def temporal_value(value, col_type):
+    """
+    value as a date/datetime when col_type (a Postgres type name, e.g. from
+    the statistics catalog) is date or timestamp and value is an ISO string;
+    otherwise value unchanged.
+    """
+    if not isinstance(value, str) or not col_type:
+        return value
+    if col_type == "date":
+        parse = date.fromisoformat
+    elif col_type.startswith("timestamp"):
+        parse = datetime.fromisoformat
+    else:
+        return value
+    try:
+        return parse(value)
+    except ValueError:
+        return value
+
+def sql_value(value):
+    """Render a partition bound as a SQL expression of the matching type."""
+    if isinstance(value, datetime):
+        return exp.cast(exp.Literal.string(value.isoformat(sep=" ")),
+                        "TIMESTAMPTZ" if value.tzinfo else "TIMESTAMP")
+    if isinstance(value, date):
+        return exp.cast(exp.Literal.string(value.isoformat()), "DATE")
+    if isinstance(value, (int, float, Decimal)):
+        return exp.Literal.number(value)
+    return exp.Literal.string(str(value))
+
+def interpolate_bounds(low, high, n_parts):
+    """Equal-width split points for numeric and date/time ranges."""
+    if isinstance(low, bool) or isinstance(high, bool):
+        return []
+    if isinstance(low, int) and isinstance(high, int):
+        step = (high - low + 1) // n_parts
+        return [low + i * step for i in range(1, n_parts)] if step > 0 else []
+    try:
+        return [low + (high - low) * i / n_parts for i in range(1, n_parts)]
+    except TypeError:
+        # Strings and other types without arithmetic can only use a histogram
+        return []
+
+def choose_split_points(low, high, histogram, n_parts):
+    """
+    Pick n_parts - 1 interior split points so each partition covers about the
+    same number of rows. Equi-depth histogram bounds (pg_stats or sampled
+    quantiles) are used when they are fine enough, otherwise equal width.
+    """
+    if n_parts < 2 or low is None or high is None:
+        return []
+    try:
+        if not low < high:
+            return []
+    except TypeError:
+        return []
+
+    points = []
+    if histogram:
+        try:
+            inner = [v for v in histogram if low < v < high]
+        except TypeError:
+            inner = []
+        if len(inner) >= n_parts - 1:
+            # Consecutive histogram bounds hold roughly equal row counts
+            quantiles = [low] + inner + [high]
+            points = [quantiles[round(i * (len(quantiles) - 1) / n_parts)] for i in range(1, n_parts)]
+    if not points:
+        points = interpolate_bounds(low, high, n_parts)
+
+    # Skewed data can repeat the same bound; keep them strictly increasing
+    split_points = []
+    for p in points:
+        if low < p <= high and (not split_points or p > split_points[-1]):
+            split_points.append(p)
+    return split_points
+
+def partition_condition(col, lower, upper, include_nulls=False):
+    """
+    Half-open range predicate `lower <= col < upper` for one partition.
+    A missing bound leaves that side open so the partitions cover every value.
+    col is a column name or a (table-qualified) Column node.
+    """
+    column = col.copy() if isinstance(col, exp.Column) else exp.column(col)
+    conds = []
+    if lower is not None:
+        conds.append(exp.GTE(this=column.copy(), expression=sql_value(lower)))
+    if upper is not None:
+        conds.append(exp.LT(this=column.copy(), expression=sql_value(upper)))
+    cond = exp.and_(*conds) if conds else None
+    if include_nulls:
+        is_null = exp.Is(this=column.copy(), expression=exp.Null())
+        cond = exp.or_(cond, is_null) if cond is not None else is_null
+    return cond
+
+# Column-vs-constant comparisons and the operator seen from the column's side
+RANGE_OPS = {exp.GT: '>', exp.GTE: '>=', exp.LT: '<', exp.LTE: '<=', exp.EQ: '='}
+FLIPPED_OPS = {'>': '<', '>=': '<=', '<': '>', '<=': '>=', '=': '='}
+
+def range_predicates(where):
+    """
+    (column node, op, value) for each top-level AND term of where that bounds a
+    column by constants: >, >=, <, <=, =, BETWEEN and IN lists ('in' with a list).
+    Terms under OR/NOT and comparisons between columns are ignored.
+    """
+    if where is None:
+        return []
+    where = where.unnest()
+    terms = where.flatten() if isinstance(where, exp.And) else [where]
+    found = []
+    for term in terms:
+        term = term.unnest()
+        op = RANGE_OPS.get(type(term))
+        if op:
+            column, value = term.this, literal_value(term.expression)
+            if not isinstance(column, exp.Column):
+                column, value, op = term.expression, literal_value(term.this), FLIPPED_OPS[op]
+            if isinstance(column, exp.Column) and value is not None:
+                found.append((column, op, value))
+        elif isinstance(term, exp.Between) and isinstance(term.this, exp.Column):
+            low, high = literal_value(term.args.get("low")), literal_value(term.args.get("high"))
+            if low is not None and high is not None:
+                found.extend([(term.this, '>=', low), (term.this, '<=', high)])
+        elif isinstance(term, exp.In) and isinstance(term.this, exp.Column) and not term.args.get("query"):
+            values = [literal_value(v) for v in term.expressions]
+            if values and None not in values:
+                found.append((term.this, 'in', values))
+    return found
+
+def intersect_range(predicates):
+    """
+    Tightest interval allowed by (op, value) predicates on one column:
+    {'low', 'high', 'values'} (None = unbounded, values = IN/= candidates),
+    'empty' when they contradict each other, or None when there is no usable bound.
+    Exclusive bounds stay in WHERE, so the interval is closed.
+    """
+    low = high = values = None
+    try:
+        for op, value in predicates:
+            if op == 'in' or op == '=':
+                listed = set(value) if op == 'in' else {value}
+                values = listed if values is None else values & listed
+            elif op in ('>', '>='):
+                low = value if low is None else max(low, value)
+            else:
+                high = value if high is None else min(high, value)
+        if values is not None:
+            values = sorted(v for v in values if (low is None or v >= low) and (high is None or v <= high))
+            if not values:
+                return 'empty'
+            low, high = values[0], values[-1]
+        if low is not None and high is not None and low > high:
+            return 'empty'
+    except TypeError:
+        # Constants of a different type than each other (the column can't match both)
+        return None
+    if low is None and high is None:
+        return None
+    return {'low': low, 'high': high, 'values': values}
+
+async def choose_partition_column(plan, where):
+    """
+    Partition column for one execution plus the tightest range WHERE allows on it.
+    Joins and PARTITION_KEYS fix the column; otherwise the first indexed column
+    (primary key first) that WHERE bounds wins, then the primary key, then a
+    bounded column, then the plan's guess from the WHERE clause.
+    """
+    predicates = {}
+    qualifiers = {c.table for c in plan['partition_columns'] if isinstance(c, exp.Column)}
+    for column, op, value in range_predicates(where):
+        if plan['joins'] and column.table not in qualifiers:
+            continue
+        predicates.setdefault(column.name, []).append((op, value))
+
+    col = plan['partition_col']
+    if not plan['joins'] and plan['table'] not in PARTITION_KEYS:
+        keys = await stats_catalog.key_columns(plan['table'])
+        bounded = [k for k in keys if k in predicates]
+        if bounded or keys:
+            col = (bounded or keys)[0]
+        elif predicates and col not in predicates:
+            # No index information: at least split on a column WHERE bounds
+            col = next(iter(predicates))
+    return col, intersect_range(predicates.get(col, []))
+
+def literal_node(token):
+    """Rebuild the literal expression for a NUMBER/STRING token."""
+    if token.token_type == TokenType.NUMBER:
+        return exp.Literal.number(token.text)
+    return exp.Literal.string(token.text)
+
+def bind_placeholders(node, literals):
+    """Replace plan placeholders (:__pN) in a copy of node with this request's literal values."""
+    if node is None:
+        return None
+    def bind(n):
+        if isinstance(n, exp.Placeholder) and str(n.this).startswith(PARAM_PREFIX):
+            return literal_node(literals[int(str(n.this)[len(PARAM_PREFIX):])])
+        return n
+    return node.copy().transform(bind)
+
+def parameterize(sql, literals):
+    """
+    Parse sql with every literal swapped for a named placeholder.
+    Literals inside WHERE stay placeholders (plan parameters); the others are
+    bound back in place and become fixed parts of the cache key.
+    Returns (parsed, param_slots, fixed_slots) or None if sql can't be parameterized.
+    """
+    pieces, pos = [], 0
+    for i, token in enumerate(literals):
+        pieces.append(sql[pos:token.start])
+        pieces.append(f":{PARAM_PREFIX}{i}")
+        pos = token.end + 1
+    pieces.append(sql[pos:])
+    parsed = parse_one("".join(pieces), read=SQL_DIALECT)
+
+    placeholders = [p for p in parsed.find_all(exp.Placeholder) if str(p.this).startswith(PARAM_PREFIX)]
+    if len(placeholders) != len(literals):
+        return None
+    where = parsed.args.get("where")
+    param_slots = sorted(int(str(p.this)[len(PARAM_PREFIX):]) for p in placeholders
+                         if where is not None and p.find_ancestor(exp.Where) is where)
+    params = set(param_slots)
+    fixed_slots = tuple(i for i in range(len(literals)) if i not in params)
+    for p in placeholders:
+        slot = int(str(p.this)[len(PARAM_PREFIX):])
+        if slot in fixed_slots:
+            p.replace(literal_node(literals[slot]))
+    return parsed, tuple(param_slots), fixed_slots
+
+def identifier_name(identifier):
+    """Name Postgres reports for an identifier (unquoted names fold to lower case)."""
+    if isinstance(identifier, exp.Identifier):
+        return identifier.this if identifier.quoted else identifier.this.lower()
+    return str(identifier).lower()
+
+def output_name(expression):
+    """Column name Postgres gives a SELECT list item in the result rows."""
+    if isinstance(expression, exp.Alias):
+        return identifier_name(expression.args["alias"])
+    if isinstance(expression, exp.Column):
+        return identifier_name(expression.this)
+    if isinstance(expression, exp.Cast):
+        return output_name(expression.this)
+    if isinstance(expression, exp.Anonymous):
+        return expression.name.lower()
+    if isinstance(expression, exp.Func):
+        return expression.sql_name().lower()
+    return "?column?"
+
+def resolve_output_column(select, node):
+    """
+    Map an ORDER BY expression to the result column holding its value:
+    an output alias, a position (ORDER BY 2), an expression repeated from
+    the SELECT list, or a plain column under SELECT *. None if unresolvable.
+    """
+    items = select.expressions
+    names = [output_name(e) for e in items]
+    if isinstance(node, exp.Literal) and node.is_int:
+        idx = int(node.this) - 1
+        if 0 <= idx < len(items) and not isinstance(items[idx], exp.Star):
+            return names[idx]
+        return None
+    if isinstance(node, exp.Column) and not node.table and identifier_name(node.this) in names:
+        return identifier_name(node.this)
+    node_sql = node.sql(dialect=SQL_DIALECT)
+    for item, name in zip(items, names):
+        inner = item.this if isinstance(item, exp.Alias) else item
+        if inner.sql(dialect=SQL_DIALECT) == node_sql:
+            return name
+    has_star = any(isinstance(e, exp.Star) or (isinstance(e, exp.Column) and isinstance(e.this, exp.Star))
+                   for e in items)
+    if isinstance(node, exp.Column) and has_star:
+        return identifier_name(node.this)
+    return None
+
+def literal_int(node):
+    if isinstance(node, exp.Literal) and node.is_int:
+        return int(node.this)
+    return None
+
+def sort_columns(select):
+    """
+    Names of the columns ORDER BY compares values of (directly, inside an
+    expression, through an output alias or MIN/MAX). Counts, sums and other
+    aggregates are numbers whatever they read. See ordered_by_text().
+    """
+    order = select.args.get("order")
+    aliases = {e.alias: e.this for e in select.expressions if isinstance(e, exp.Alias)}
+    names = []
+    for ordered in order.expressions if order else []:
+        node = ordered.this
+        if isinstance(node, exp.Column) and not node.table:
+            node = aliases.get(node.name, node)
+        if isinstance(node, exp.AggFunc) and not isinstance(node, (exp.Min, exp.Max)):
+            continue
+        names.extend(c.name for c in node.find_all(exp.Column) if c.name not in names)
+    return names
+
+def plan_order_and_limit(template, merge, aggregates=()):
+    """
+    Decide where ORDER BY / LIMIT / OFFSET run for a distributed query.
+    Row queries push ORDER BY and LIMIT (+OFFSET) down to every partition and
+    k-way merge the sorted partitions; aggregate queries drop them from the
+    partitions (a partial group can't be limited) and sort the merged output.
+    aggregates: the plan's aggregate list, so ORDER BY COUNT(*) can use a
+    hidden aggregate output when the SELECT list doesn't carry it.
+    Returns (order, limit, offset, hidden columns), or None when the ordering
+    can't be evaluated on merged rows. Only mutates template on success.
+    """
+    if not isinstance(template, exp.Select):
+        return None if template.args.get("order") or template.args.get("limit") else (None, None, 0, [])
+    order_node = template.args.get("order")
+    limit_node = template.args.get("limit")
+    offset_node = template.args.get("offset")
+    limit = literal_int(limit_node.expression) if limit_node else None
+    offset = literal_int(offset_node.expression) if offset_node else 0
+    if (limit_node and limit is None) or (offset_node and offset is None):
+        return None
+
+    order, hidden = [], []
+    for i, ordered in enumerate(order_node.expressions if order_node else []):
+        key = resolve_output_column(template, ordered.this)
+        if key is None and aggregates:
+            node_sql = ordered.this.sql(dialect=SQL_DIALECT)
+            key = next((agg['output'] for agg in aggregates if agg['sql'] == node_sql), None)
+        if key is None:
+            # Row queries can carry the sort value as an extra column
+            if merge != "concat":
+                return None
+            key = f"__order{i}"
+            hidden.append((key, ordered.this))
+        desc = bool(ordered.args.get("desc"))
+        nulls_first = ordered.args.get("nulls_first")
+        order.append({'key': key, 'desc': desc, 'nulls_first': desc if nulls_first is None else bool(nulls_first)})
+
+    for key, node in hidden:
+        template.append("expressions", exp.alias_(node.copy(), key))
+    if merge == "concat":
+        if limit is not None:
+            template.set("limit", exp.Limit(expression=exp.Literal.number(limit + offset)))
+        template.set("offset", None)
+    else:
+        for arg in ("order", "limit", "offset"):
+            template.set(arg, None)
+    return order or None, limit, offset, [key for key, _ in hidden]
+
+def build_plan(sql, literals):
+    """
+    Parse and analyze a statement once and describe how to execute it:
+    the HAVING-free template sub-queries are built from, the analysis result,
+    the partition column and the merge strategy.
+    """
+    with tracing.stage("parse"):
+        original = parse_one(sql, read=SQL_DIALECT)
+        param_slots, fixed_slots = (), tuple(range(len(literals)))
+        parsed = original.copy()
+        try:
+            parameterized = parameterize(sql, literals) if literals else None
+            # Only trust the placeholder form if it renders back to exactly the same statement
+            if parameterized and bind_placeholders(parameterized[0], literals).sql(dialect=SQL_DIALECT) == original.sql(dialect=SQL_DIALECT):
+                parsed, param_slots, fixed_slots = parameterized
+        except Exception:
+            pass
+
+    with tracing.stage("analyze"):
+        return describe_plan(original, parsed, param_slots, fixed_slots)
+
+def describe_plan(original, parsed, param_slots, fixed_slots):
+    """Analysis half of build_plan(): the execution description of a parsed statement."""
+    analysis = analyze_query(original)
+    template = parsed.copy()
+    having = template.args.get("having")
+
+    # Partition column: last column referenced in WHERE, else id (PARTITION_KEYS overrides)
+    table = extract_table_name(template)
+    col = "id"
+    where = template.args.get("where")
+    if where:
+        for node in where.find_all(exp.Column):
+            col = node.name
+    col = PARTITION_KEYS.get(table, col)
+    partition_columns = [col]
+    joins = bool(template.args.get("joins"))
+    if joins:
+        # Joins: co-partition the fact tables on a join key, broadcast the dimension tables
+        partitioning = join_partitioning(template)
+        if partitioning is None:
+            table = None
+        else:
+            table, col, partition_columns = partitioning
+
+    if analysis['group_by']:
+        merge = "grouped"
+    elif analysis['is_agg']:
+        merge = "aggregate"
+    else:
+        merge = "concat"
+
+    splittable = can_split(template) and table is not None and (merge == "concat" or analysis['distributable'])
+    merge_spec = None
+    having_filter = None
+    ordering = None
+    if splittable:
+        partial = template.copy()
+        if merge != "concat":
+            # Aggregates HAVING / ORDER BY need must travel as (hidden) states too
+            if having is not None:
+                try:
+                    having_filter = compile_predicate(having.this, having_resolver(partial, analysis['aggregates']))
+                except ValueError as e:
+                    log.debug("HAVING not evaluable after merge, running unsplit: %s", e)
+                    splittable = False
+            order_node = partial.args.get("order")
+            for ordered in (order_node.expressions if order_node else []):
+                if isinstance(ordered.this, (exp.AggFunc, exp.WithinGroup)) and resolve_output_column(partial, ordered.this) is None:
+                    register_aggregate(analysis['aggregates'], ordered.this)
+        ordering = plan_order_and_limit(partial, merge, analysis['aggregates']) if splittable else None
+
+    if ordering is None:
+        # Not mergeable from partitions: one worker runs the whole statement
+        # (HAVING, ORDER BY and LIMIT included) and its rows are returned as-is
+        splittable = False
+        merge = "concat"
+        order, limit, offset, hidden = None, None, 0, []
+        having_filter = None
+    else:
+        template = partial
+        # HAVING must be applied globally after merge, never on a partition
+        template.set("having", None)
+        order, limit, offset, hidden = ordering
+        if merge != "concat":
+            merge_spec = rewrite_partial_aggregates(template, analysis)
+            hidden = hidden + [agg['output'] for agg in analysis['aggregates'] if agg['hidden']]
+
+    plan = {
+        'template': template,
+        'param_slots': param_slots,
+        'fixed_slots': fixed_slots,
+        'analysis': analysis,
+        'having_filter': having_filter,
+        'table': table,
+        'tables': referenced_tables(template),
+        'joins': joins,
+        'partition_col': col,
+        'partition_columns': partition_columns,
+        'splittable': splittable,
+        'merge': merge,
+        'merge_spec': merge_spec,
+        'order': order,
+        'limit': limit,
+        'offset': offset,
+        'hidden': hidden,
+        'query_type': f"{analysis['agg_type']}_aggregate" if analysis['is_agg'] else "select",
+        'sample': None,
+        'sketches': [agg['func'] for agg in analysis['aggregates'] if agg['func'] in SKETCH_FUNCS] if merge_spec else [],
+        # Visible columns whose merged values come from approximate summaries
+        'sketched': [name for name, func, _ in merge_spec['finals']
+                     if func in APPROXIMATE_SKETCHES and name not in hidden] if merge_spec else [],
+        'sort_columns': sort_columns(parsed) if order else [],
+        'unsplit': None,
+    }
+    if (any(func in APPROXIMATE_SKETCHES for func in plan['sketches']) and not parsed.find(exp.ApproxDistinct)
+            or plan['sort_columns']):
+        # Run as one sub-query, the original statement answers exactly (see exact_unsplit(), collated_plan())
+        plan['unsplit'] = dict(plan, template=parsed.copy(), splittable=False, merge="concat", merge_spec=None,
+                               having_filter=None, order=None, limit=None, offset=0, hidden=[],
+                               sketches=[], sketched=[], sort_columns=[])
+    return plan
+
+def plan_query(sql):
+    """
+    Planning stage: tokenize, look the shape up in the plan cache and only
+    parse/analyze on a miss. Returns (plan, literals of this request, result
+    cache key: the shape plus every literal value).
+    """
+    shape, literals = normalize_sql(sql, SQL_DIALECT)
+    plan = plan_cache.get(shape, literals)
+    if plan is None:
+        plan = build_plan(sql, literals)
+        # Cost estimates are cached per shape (and fixed literal values, like the plan)
+        plan['shape'] = (shape, tuple(literals[i].text for i in plan['fixed_slots']))
+        plan_cache.put(shape, literals, plan)
+    return plan, literals, (shape, tuple(t.text for t in literals))
+
+def sampled_plan(plan, options):
+    """
+    Approximate-mode variant of an aggregate plan: its table is read through
+    TABLESAMPLE and every SUM/AVG argument gets a SUM(x * x) state for the
+    confidence intervals. Variants are cached on the plan per fraction/method/seed.
+    """
+    if not plan['splittable'] or plan['merge'] not in ("grouped", "aggregate"):
+        raise HTTPException(status_code=400, detail="Approximate answers need an aggregate query the dispatcher can split")
+    if any(func in ('approx_distinct', 'count_distinct') for func in plan['sketches']):
+        raise HTTPException(status_code=400, detail="COUNT(DISTINCT) can't be estimated from a sample")
+    key = (options['fraction'], options['method'], options['seed'])
+    variants = plan.setdefault('sampled', {})
+    variant = variants.get(key)
+    if variant is None:
+        template = plan['template'].copy()
+        if not sampling.apply_sample(template, plan['table'], options):
+            raise HTTPException(status_code=400, detail=f"Can't sample {plan['table']} in this query")
+        spec = plan['merge_spec']
+        items, states, squares, by_arg = list(template.expressions), list(spec['states']), {}, {}
+        for k, agg in enumerate(plan['analysis']['aggregates']):
+            if agg['func'] in ('sum', 'avg') and agg['arg'] is not None:
+                arg_sql = agg['arg'].sql(dialect=SQL_DIALECT)
+                if arg_sql not in by_arg:
+                    alias = f"__a{k}_sq"
+                    items.append(exp.alias_(sampling.squares_state(agg['arg']), alias))
+                    by_arg[arg_sql] = len(states)
+                    states.append((alias, 'add'))
+                squares[k] = by_arg[arg_sql]
+        template.set("expressions", items)
+        hidden = set(plan['hidden'])
+        intervals = [k for k, (name, _, _) in enumerate(spec['finals']) if name not in hidden]
+        variant = dict(plan, template=template, shape=(plan.get('shape'), 'sample') + key,
+                       merge_spec=dict(spec, states=states, squares=squares, intervals=intervals), unsplit=None)
+        variant.pop('sampled', None)
+        if len(variants) >= SAMPLED_VARIANTS:
+            variants.pop(next(iter(variants)))
+        variants[key] = variant
+    return dict(variant, sample=options)
+
+def bound_where(plan, literals):
+    """This request's WHERE condition (the plan template's WHERE with literals bound), or None."""
+    where = plan['template'].args.get("where")
+    if where is None:
+        return None
+    return bind_placeholders(where.this, literals) if plan['param_slots'] else where.this.copy()
+
+def render_query(plan, condition):
+    """Render the plan template with condition as its WHERE clause."""
+    query = plan['template'].copy()
+    query.set("where", exp.Where(this=condition) if condition is not None else None)
+    return query.sql(dialect=SQL_DIALECT)
+
+def whole_query(plan, where, cost=1.0):
+    """The unsplit statement as a single partition."""
+    return {'sql': render_query(plan, where), 'col': None, 'cost': cost}
+
+def make_partition(plan, where, col, lower, upper, include_nulls, low=None, high=None, query=None, cost=1.0):
+    """
+    One range partition: the plan template restricted to lower <= col < upper.
+    low/high are the overall bounds, kept so open-ended partitions can be re-split.
+    cost (estimated rows) weighs the partition when the scheduler picks a worker.
+    """
+    query = query if query is not None else plan['template'].copy()
+    # A join range is repeated on every co-partitioned fact table column
+    columns = plan['partition_columns'] if col == plan['partition_col'] else [col]
+    new_cond = exp.and_(*[partition_condition(c, lower, upper, include_nulls=include_nulls) for c in columns])
+    # Combine with existing WHERE clause using AND
+    combined = exp.and_(where, new_cond) if where is not None else new_cond
+    query.set("where", exp.Where(this=combined))
+    return {'sql': query.sql(dialect=SQL_DIALECT), 'col': col, 'lower': lower, 'upper': upper,
+            'nulls': include_nulls, 'low': low, 'high': high, 'cost': cost}
+
+async def estimate_cost(plan, where, rows=None):
+    """
+    EXPLAIN estimate of the unsplit statement, or None when disabled/unavailable.
+    Cached per shape and scaled to rows (the catalog's row estimate for the
+    request's range); without rows the bound WHERE is part of the cache key.
+    """
+    if SPLIT_MIN_COST <= 0:
+        return None
+    key = plan.get('shape')
+    if key is not None and rows is None:
+        key = (key, where.sql(dialect=SQL_DIALECT) if where is not None else None)
+    with tracing.stage("cost_estimate"):
+        return await cost_estimator.estimate(key, lambda: render_query(plan, where), rows)
+
+async def partition_range(plan, where):
+    """
+    What a split of this request would cover: (column, bounds WHERE allows on it
+    or 'empty', catalog stats, low, high), low/high being those bounds clamped
+    to the catalog's (None when unknown).
+    """
+    with tracing.stage("bounds"):
+        col, bounds = await choose_partition_column(plan, where)
+        if bounds == 'empty':
+            return col, bounds, None, None, None
+        bounds = bounds or {'low': None, 'high': None, 'values': None}
         
-    table_name = extract_table_name(parsed)
+        # The catalog supplies the distribution (and the bounds WHERE leaves open).
+        # Its bounds may lag behind the table, which is fine: the outer partitions are open-ended.
+        stats = await stats_catalog.get(plan['table'], col)
+    if stats and stats.get("type"):
+        # String constants on a date/timestamp column compare as dates
+        typed = lambda v: temporal_value(v, stats["type"])
+        bounds = {'low': typed(bounds['low']), 'high': typed(bounds['high']),
+                  'values': None if bounds['values'] is None else [typed(v) for v in bounds['values']]}
+    low, high = bounds['low'], bounds['high']
+    if stats:
+        try:
+            low = stats["low"] if low is None else max(low, stats["low"])
+            high = stats["high"] if high is None else min(high, stats["high"])
+        except TypeError:
+            pass
+    return col, bounds, stats, low, high
+
+async def make_subqueries(plan, where, n_parts=None, max_parts=None):
+    """
+    Range partition on equi-depth split points taken from the data distribution.
+    `where` is the request's bound WHERE condition; sub-queries are built as AST
+    nodes from the plan template without re-parsing.
+    n_parts=None chooses the degree of parallelism from the estimated cost
+    (statements cheaper than SPLIT_MIN_COST aren't split) or row count;
+    max_parts caps it (the slots admission control grants one query).
+    Returns partition dicts ('sql' plus the range it covers).
+    """
+    table_name = plan['table']
     
     if not table_name:
-        return [parsed.sql()]
+        return [whole_query(plan, where)]
     
-    # Try to extract explicit bounds from WHERE clause first
-    where = parsed.args.get("where")
-    col = "id"  # Default partition column
-    low, high = None, None
+    # Range predicates on the partition column narrow the split to what WHERE can match
+    col, bounds, stats, low, high = await partition_range(plan, where)
+    if bounds == 'empty':
+        # Contradictory predicates: nothing matches, one sub-query answers that cheaply
+        return [whole_query(plan, where)]
+    estimated_rows = estimate_rows(stats, low, high)
     
-    if where:
-        # Extract column name and bounds from BETWEEN clause
-        for node in where.find_all(exp.Column):
-            col = node.name
-        literals = [int(l.this) for l in where.find_all(exp.Literal) if l.this.isdigit()]
-        if len(literals) >= 2:
-            low, high = literals[0], literals[1]
+    estimate = await estimate_cost(plan, where, estimated_rows) if n_parts is None else None
+    if estimate is not None and estimate['cost'] < SPLIT_MIN_COST:
+        # Point lookups and tiny scans: fan-out and merge would cost more than they save
+        SPLIT_DECISIONS.labels(decision="below_min_cost").inc()
+        return [whole_query(plan, where, estimate['rows'] or 1.0)]
     
-    # If no explicit bounds, query the database
     if low is None or high is None:
-        low, high = await get_table_bounds(table_name, col)
-        if low is None or high is None:
-            # Can't determine bounds, don't split
-            return [parsed.sql()]
+        # Can't determine bounds, don't split
+        return [whole_query(plan, where)]
+    histogram = stats["histogram"] if stats else None
+    if bounds['values'] is not None:
+        # IN list: split between the listed values themselves
+        histogram = bounds['values']
     
-    # Create n_parts sub-queries
-    step = (high - low + 1) // n_parts
+    if n_parts is None:
+        n_parts = await choose_partition_count(estimated_rows, estimate['cost'] if estimate else None)
+    if max_parts is not None:
+        n_parts = min(n_parts, max_parts)
+    split_points = choose_split_points(low, high, histogram, n_parts)
+    if not split_points:
+        SPLIT_DECISIONS.labels(decision="single_range").inc()
+        return [whole_query(plan, where, estimated_rows or 1.0)]
+    SPLIT_DECISIONS.labels(decision="split").inc()
+    
+    # Create one sub-query per range between consecutive split points.
+    # NULLs only need a home when WHERE doesn't already exclude them with a range on col.
+    edges = [None] + split_points + [None]
+    query = plan['template'].copy()
     subs = []
-    for i in range(n_parts):
-        start = low + i * step
-        end = low + (i + 1) * step - 1 if i < n_parts - 1 else high
-        
-        # Create new WHERE condition
-        new_cond = parse_one(f"{col} BETWEEN {start} AND {end}")
-        
-        sub_sql = parsed.copy()
-        
-        if where:
-            # Combine with existing WHERE clause using AND
-            combined = exp.And(this=where.this, expression=new_cond)
-            sub_sql.set("where", exp.Where(this=combined))
-        else:
-            # No existing WHERE, just add the BETWEEN
-            sub_sql.set("where", exp.Where(this=new_cond))
-        
-        query_str = sub_sql.sql()
-        print(f"DEBUG: Subquery {i}: {query_str}")
-        subs.append(query_str)
+    for i in range(len(edges) - 1):
+        lower, upper = edges[i], edges[i + 1]
+        if bounds['values'] is not None and not any((lower is None or lower <= v) and (upper is None or v < upper)
+                                                    for v in bounds['values']):
+            PARTITIONS_PRUNED.inc()
+            continue
+        # Equi-depth ranges (or the histogram's share of a range) hold about this many rows
+        cost = estimate_rows(stats, lower if i else low, upper if i < len(edges) - 2 else high)
+        include_nulls = i == len(edges) - 2 and bounds['low'] is None and bounds['high'] is None
+        part = make_partition(plan, where, col, lower, upper, include_nulls, low, high, query, cost=cost or 1.0)
+        log.debug("Subquery %d: %s", i, part['sql'])
+        subs.append(part)
     return subs
 
+def resplit_partition(part, plan, where):
+    """Cut a partition into RESPLIT_WAYS smaller ranges (open ends stay open); [] if it can't be split."""
+    if part['col'] is None:
+        return []
+    lo = part['lower'] if part['lower'] is not None else part['low']
+    hi = part['upper'] if part['upper'] is not None else part['high']
+    try:
+        points = [p for p in interpolate_bounds(lo, hi, RESPLIT_WAYS) if lo < p < hi] if lo is not None and hi is not None else []
+    except TypeError:
+        points = []
+    if not points:
+        return []
+    edges = [part['lower']] + points + [part['upper']]
+    return [make_partition(plan, where, part['col'], edges[i], edges[i + 1], part['nulls'] and i == len(edges) - 2,
+                           part['low'], part['high'], cost=part['cost'] / (len(edges) - 1))
+            for i in range(len(edges) - 1)]
+
+# Aggregates the dispatcher can merge from per-partition states
+AGG_FUNCS = {exp.Count: 'count', exp.Sum: 'sum', exp.Avg: 'avg', exp.Min: 'min', exp.Max: 'max'}
+# Partial states each aggregate is rewritten into on the workers
+AGG_STATES = {
+    'count': (('count', exp.Count),),
+    'sum': (('sum', exp.Sum),),
+    'min': (('min', exp.Min),),
+    'max': (('max', exp.Max),),
+    'avg': (('sum', exp.Sum), ('count', exp.Count)),
+}
+# Aggregates merged from per-partition summaries instead (see sketches.py)
+PERCENTILE_FUNCS = {exp.PercentileCont: 'percentile_cont', exp.PercentileDisc: 'percentile_disc'}
+SKETCH_FUNCS = ('count_distinct', 'approx_distinct', 'percentile_cont', 'percentile_disc')
+# ... of which these merge into estimates (count_distinct unions every value)
+APPROXIMATE_SKETCHES = ('approx_distinct', 'percentile_cont', 'percentile_disc')
+
+def aggregate_spec(node):
+    """Describe one aggregate call, or None if it can't be merged from partial states."""
+    if type(node) in PERCENTILE_FUNCS and isinstance(node.parent, exp.WithinGroup):
+        node = node.parent
+    if isinstance(node, exp.WithinGroup):
+        return percentile_spec(node)
+    if isinstance(node, exp.ApproxDistinct):
+        func, arg = 'approx_distinct', node.this
+    elif isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct):
+        # COUNT(DISTINCT x): a KMV sketch per partition, or every distinct value in exact mode
+        args = node.this.expressions
+        if DISTINCT_COUNT_MODE not in ("sketch", "exact") or len(args) != 1:
+            return None
+        func, arg = ('count_distinct' if DISTINCT_COUNT_MODE == "exact" else 'approx_distinct'), args[0]
+    else:
+        func = AGG_FUNCS.get(type(node))
+        if func is None or isinstance(node.this, exp.Distinct):
+            return None
+        arg = None if isinstance(node.this, exp.Star) else node.this
+    return {'func': func, 'arg': arg, 'sql': node.sql(dialect=SQL_DIALECT), 'output': None, 'hidden': False}
+
+def percentile_spec(node):
+    """aggregate_spec() of PERCENTILE_CONT/PERCENTILE_DISC(fraction) WITHIN GROUP (ORDER BY x)."""
+    func = PERCENTILE_FUNCS.get(type(node.this))
+    fraction = node.this.this
+    order = node.expression.expressions if isinstance(node.expression, exp.Order) else []
+    if func is None or not isinstance(fraction, exp.Literal) or not fraction.is_number or len(order) != 1:
+        return None
+    value = float(fraction.this)
+    if not 0 <= value <= 1:
+        return None
+    if order[0].args.get("desc"):
+        if func == 'percentile_disc':
+            return None
+        # Descending PERCENTILE_CONT(p) is ascending PERCENTILE_CONT(1 - p)
+        value = 1 - value
+    return {'func': func, 'arg': order[0].this, 'fraction': value, 'sql': node.sql(dialect=SQL_DIALECT),
+            'output': None, 'hidden': False}
+
+def partial_states(agg):
+    """(state name, partial aggregate, merge op) per state column one aggregate is rewritten into."""
+    arg = agg['arg'].copy() if agg['arg'] is not None else exp.Star()
+    if agg['func'] == 'approx_distinct':
+        return [('kmv', sketches.kmv_state(arg, DISTINCT_SKETCH_SIZE), 'kmv')]
+    if agg['func'] == 'count_distinct':
+        return [('values', sketches.values_state(arg), 'union')]
+    if agg['func'] in PERCENTILE_FUNCS.values():
+        # Summaries only merge together with their row counts: keep one of each per partition
+        return [('quantiles', sketches.quantiles_state(agg['func'], arg, PERCENTILE_SKETCH_SIZE), 'collect'),
+                ('n', exp.Count(this=arg.copy()), 'collect')]
+    return [(state, func(this=arg.copy()), state if state in ('min', 'max') else 'add')
+            for state, func in AGG_STATES[agg['func']]]
+
+def register_aggregate(aggregates, node):
+    """Find the aggregate for node among aggregates, adding it as a hidden output if new."""
+    spec = aggregate_spec(node)
+    if spec is None:
+        return None
+    for agg in aggregates:
+        if agg['sql'] == spec['sql']:
+            return agg
+    spec['output'] = f"__agg{len(aggregates)}"
+    spec['hidden'] = True
+    aggregates.append(spec)
+    return spec
+
 def analyze_query(parsed):
     """
     Analyze query for aggregation, grouping, and having.
+    Every SELECT item is classified as a group column or an aggregate;
+    'distributable' is False when some item can't be merged from partial
+    states (COUNT(DISTINCT), aggregates inside expressions, window functions, ...).
     """
     if not isinstance(parsed, exp.Select):
-        return {'is_agg': False, 'group_by': [], 'having': None}
+        return {'is_agg': False, 'group_by': [], 'having': None, 'aggregates': [], 'columns': [], 'distributable': False}
     
     # Check for aggregates
     agg_type = None
     agg_col = None
     agg_alias = None
     is_agg = False
+    distributable = True
+    aggregates = []
+    columns = []
     
-    # Find the aggregate function and its alias
     for expression in parsed.expressions:
-        # Search inside the expression for aggregate functions
-        found_agg = False
-        for node in expression.find_all((exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max)):
-            is_agg = True
-            found_agg = True
-            if isinstance(node, exp.Count): agg_type = 'count'
-            elif isinstance(node, exp.Sum): agg_type = 'sum'
-            elif isinstance(node, exp.Avg): agg_type = 'avg'
-            elif isinstance(node, exp.Min): agg_type = 'min'
-            elif isinstance(node, exp.Max): agg_type = 'max'
-            
-            # Try to find the column being aggregated
-            if isinstance(node.this, exp.Column):
-                agg_col = node.this.name
-            break
+        inner = expression.this if isinstance(expression, exp.Alias) else expression
+        name = output_name(expression)
+        found = list(expression.find_all(exp.AggFunc))
+        if expression.find(exp.Window):
+            distributable = False
+        if not found:
+            columns.append({'kind': 'group', 'name': name, 'node': expression})
+            continue
         
-        if found_agg:
+        is_agg = True
+        if agg_type is None:
+            # First aggregate in the SELECT list (metrics label / query type)
+            first = found[0]
+            agg_type = AGG_FUNCS.get(type(first), type(first).__name__.lower())
+            if isinstance(first.this, exp.Column):
+                agg_col = first.this.name
             agg_alias = expression.alias_or_name
-            break
+        
+        spec = aggregate_spec(inner) if len(found) == 1 else None
+        if spec is None:
+            distributable = False
+            columns.append({'kind': 'expr', 'name': name, 'node': expression})
+            continue
+        spec['output'] = name
+        aggregates.append(spec)
+        columns.append({'kind': 'agg', 'name': name, 'node': expression, 'agg': len(aggregates) - 1})
             
     # Check for Group By
     group_by = []
@@ -168,6 +1419,10 @@ def analyze_query(parsed):
                 group_by.append(str(expr.this))
             else:
                 group_by.append(expr.alias_or_name)
+        if any(group.args.get(k) for k in ("rollup", "cube", "grouping_sets")):
+            distributable = False
+    if is_agg and parsed.args.get("distinct"):
+        distributable = False
 
     # Check for Having
     having = parsed.args.get("having")
@@ -178,256 +1433,1234 @@ def analyze_query(parsed):
         'agg_col': agg_col,
         'agg_alias': agg_alias,
         'group_by': group_by,
-        'having': having
+        'having': having,
+        'aggregates': aggregates,
+        'columns': columns,
+        'distributable': distributable,
     }
 
-def evaluate_condition(node, row):
-    """Recursively evaluate a HAVING condition against a result row."""
-    import sys
-    
+def rewrite_partial_aggregates(template, analysis):
+    """
+    Turn an aggregate query into its per-partition form: group columns plus one
+    mergeable state column per aggregate (AVG becomes SUM + COUNT, COUNT(DISTINCT)
+    and percentiles become summaries, see partial_states()).
+    Returns the merge spec merge_partial_states() needs.
+    """
+    items = template.expressions
+    group = template.args.get("group")
+    if group:
+        # Positional GROUP BY refers to the original SELECT list, which is about to change
+        for expr in group.expressions:
+            pos = literal_int(expr)
+            if pos is not None and 0 < pos <= len(items):
+                item = items[pos - 1]
+                expr.replace((item.this if isinstance(item, exp.Alias) else item).copy())
+
+    new_items, group_cols, states = [], [], []
+    for i, col in enumerate(analysis['columns']):
+        if col['kind'] != 'group':
+            continue
+        node = col['node'].copy()
+        partial_name = col['name']
+        if partial_name == "?column?":
+            partial_name = f"__g{i}"
+            node = exp.alias_(node, partial_name)
+        new_items.append(node)
+        group_cols.append((partial_name, col['name']))
+
+    # GROUP BY keys missing from the SELECT list still separate groups across partitions
+    selected = {(c['node'].this if isinstance(c['node'], exp.Alias) else c['node']).sql(dialect=SQL_DIALECT)
+                for c in analysis['columns'] if c['kind'] == 'group'}
+    for i, expr in enumerate(group.expressions if group else []):
+        if expr.sql(dialect=SQL_DIALECT) not in selected:
+            partial_name = f"__k{i}"
+            new_items.append(exp.alias_(expr.copy(), partial_name))
+            group_cols.append((partial_name, None))
+
+    finals, fractions = [], {}
+    for k, agg in enumerate(analysis['aggregates']):
+        slots = []
+        for state, node, op in partial_states(agg):
+            alias = f"__a{k}_{state}"
+            new_items.append(exp.alias_(node, alias))
+            slots.append(len(states))
+            states.append((alias, op))
+        finals.append((agg['output'], agg['func'], slots))
+        if 'fraction' in agg:
+            fractions[k] = agg['fraction']
+    template.set("expressions", new_items)
+
+    # Final row layout: SELECT order, hidden aggregates (HAVING/ORDER BY only) last
+    outputs = []
+    group_index = 0
+    for col in analysis['columns']:
+        if col['kind'] == 'group':
+            outputs.append(('group', group_index))
+            group_index += 1
+        else:
+            outputs.append(('agg', col['agg']))
+    outputs.extend(('agg', k) for k, agg in enumerate(analysis['aggregates']) if agg['hidden'])
+    return {'group_cols': group_cols, 'states': states, 'finals': finals, 'outputs': outputs, 'fractions': fractions}
+
+COMPARISONS = {exp.GT: operator.gt, exp.GTE: operator.ge, exp.LT: operator.lt,
+               exp.LTE: operator.le, exp.EQ: operator.eq, exp.NEQ: operator.ne}
+
+def sql_divide(a, b):
+    """Postgres division: integers truncate toward zero, x / 0 is an error."""
+    if isinstance(a, int) and isinstance(b, int):
+        q = abs(a) // abs(b)
+        return q if (a < 0) == (b < 0) else -q
+    return a / b
+
+ARITHMETIC = {exp.Add: operator.add, exp.Sub: operator.sub, exp.Mul: operator.mul, exp.Div: sql_divide}
+
+def compile_predicate(node, resolve):
+    """
+    Compile a HAVING condition once into a function row -> True/False/None
+    (SQL three-valued logic). resolve(node) maps a column or aggregate to the
+    merged-row key holding its value, so nothing is looked up per row.
+    Raises ValueError for expressions the dispatcher can't evaluate.
+    """
+    if isinstance(node, exp.Paren):
+        return compile_predicate(node.this, resolve)
+    if isinstance(node, (exp.Column, exp.AggFunc, exp.WithinGroup)):
+        key = resolve(node)
+        if key is None:
+            raise ValueError(f"cannot resolve {node.sql(dialect=SQL_DIALECT)} in merged rows")
+        return operator.itemgetter(key)
+    if isinstance(node, exp.Null):
+        return lambda row: None
+    if isinstance(node, exp.Boolean):
+        value = bool(node.this)
+        return lambda row: value
     if isinstance(node, exp.Literal):
-        if node.is_int: return int(node.this)
-        if node.is_number: return float(node.this)
-        return node.this
-    
-    if isinstance(node, exp.Column):
-        # Match column name or alias (case-insensitive)
-        col_name = node.name
-        val = row.get(col_name)
-        
-        # Try case-insensitive match if not found
-        if val is None:
-            for key in row.keys():
-                if key.lower() == col_name.lower():
-                    val = row[key]
-                    break
-        
-        sys.stderr.write(f"DEBUG evaluate_condition: Column '{col_name}' -> {val} (row keys: {list(row.keys())})\n")
-        sys.stderr.flush()
-        return val
-        
-    # Handle aggregates in HAVING (e.g. COUNT(*) > 5)
-    # We map them to the aggregate alias in the row
-    if isinstance(node, (exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max)):
-        # We assume the row contains the result of this aggregate
-        # Heuristic: return the value of the aggregate column
-        for key, val in row.items():
-            if isinstance(val, (int, float)): # Candidate for aggregate result
-                sys.stderr.write(f"DEBUG evaluate_condition: Aggregate -> {val}\n")
-                sys.stderr.flush()
-                return val
+        value = int(node.this) if node.is_int else float(node.this) if node.is_number else node.this
+        return lambda row: value
+
+    op = COMPARISONS.get(type(node)) or ARITHMETIC.get(type(node))
+    if op is not None:
+        left, right = compile_predicate(node.this, resolve), compile_predicate(node.expression, resolve)
+        def binary(row):
+            a = left(row)
+            if a is None:
+                return None
+            b = right(row)
+            return None if b is None else op(a, b)
+        return binary
+    if isinstance(node, exp.And):
+        left, right = compile_predicate(node.this, resolve), compile_predicate(node.expression, resolve)
+        def conjunction(row):
+            a = left(row)
+            if a is False:
+                return False
+            b = right(row)
+            if b is False:
+                return False
+            return None if a is None or b is None else True
+        return conjunction
+    if isinstance(node, exp.Or):
+        left, right = compile_predicate(node.this, resolve), compile_predicate(node.expression, resolve)
+        def disjunction(row):
+            a = left(row)
+            if a is True:
+                return True
+            b = right(row)
+            if b is True:
+                return True
+            return None if a is None or b is None else False
+        return disjunction
+    if isinstance(node, exp.Not):
+        inner = compile_predicate(node.this, resolve)
+        def negation(row):
+            v = inner(row)
+            return None if v is None else not v
+        return negation
+    if isinstance(node, exp.Neg):
+        inner = compile_predicate(node.this, resolve)
+        def minus(row):
+            v = inner(row)
+            return None if v is None else -v
+        return minus
+    if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+        inner = compile_predicate(node.this, resolve)
+        return lambda row: inner(row) is None
+    if isinstance(node, exp.Between):
+        inner = compile_predicate(node.this, resolve)
+        low = compile_predicate(node.args["low"], resolve)
+        high = compile_predicate(node.args["high"], resolve)
+        def between(row):
+            v, lo, hi = inner(row), low(row), high(row)
+            if v is None or lo is None or hi is None:
+                return None
+            return lo <= v <= hi
+        return between
+    if isinstance(node, exp.In) and not node.args.get("query"):
+        inner = compile_predicate(node.this, resolve)
+        options = [compile_predicate(e, resolve) for e in node.expressions]
+        def member(row):
+            v = inner(row)
+            if v is None:
+                return None
+            values = [f(row) for f in options]
+            if v in values:
+                return True
+            return None if None in values else False
+        return member
+    raise ValueError(f"unsupported HAVING expression: {node.sql(dialect=SQL_DIALECT)}")
+
+def having_resolver(select, aggregates):
+    """Map HAVING operands to merged-row keys: aggregates to their (possibly hidden) output, columns to their SELECT item."""
+    names = [output_name(e) for e in select.expressions]
+    def resolve(node):
+        if isinstance(node, (exp.AggFunc, exp.WithinGroup)):
+            spec = register_aggregate(aggregates, node)
+            return spec['output'] if spec else None
+        key = resolve_output_column(select, node)
+        if key is None and isinstance(node, exp.Column) and not node.table:
+            # Lenient alias match, as the old row evaluator did
+            key = next((n for n in names if n.lower() == node.name.lower()), None)
+        return key
+    return resolve
+
+def merge_partial_states(parts, spec):
+    """
+    Combine per-partition aggregate states in a single pass.
+    parts: row lists (or RowBatches) from the workers; memory is one accumulator list per group.
+    'collect' states keep one entry per partition row, NULLs included, so
+    parallel collected states (a quantile summary and its count) stay aligned.
+    """
+    n_keys = len(spec['group_cols'])
+    names = [name for name, _ in spec['group_cols']] + [col for col, _ in spec['states']]
+    combine = [(i, n_keys + i, op) for i, (_, op) in enumerate(spec['states'])]
+    collected = [i for i, (_, op) in enumerate(spec['states']) if op == 'collect']
+    groups = {}
+    for rows in parts:
+        for record in rowformat.records(rows, names):
+            key = record[:n_keys]
+            acc = groups.get(key)
+            if acc is None:
+                acc = groups[key] = list(record[n_keys:])
+                for i in collected:
+                    acc[i] = [acc[i]]
+                continue
+            for i, pos, op in combine:
+                value = record[pos]
+                if op == 'collect':
+                    acc[i].append(value)
+                    continue
+                if value is None:
+                    continue
+                current = acc[i]
+                if current is None:
+                    acc[i] = value
+                elif op == 'add':
+                    acc[i] = current + value
+                elif op == 'min':
+                    if value < current:
+                        acc[i] = value
+                elif op == 'max':
+                    if value > current:
+                        acc[i] = value
+                elif op == 'kmv':
+                    acc[i] = sketches.merge_kmv(current, value, DISTINCT_SKETCH_SIZE)
+                else:
+                    acc[i] = sketches.merge_values(current, value)
+    return groups
+
+def finalize_aggregate(func, acc, slots, fraction=None):
+    """Final value of one aggregate from its merged states (fraction: the percentile's)."""
+    if func == 'avg':
+        total, count = acc[slots[0]], acc[slots[1]]
+        return total / count if count and total is not None else None
+    if func == 'approx_distinct':
+        return sketches.count_distinct(acc[slots[0]], DISTINCT_SKETCH_SIZE)
+    if func == 'count_distinct':
+        return sketches.count_distinct(acc[slots[0]])
+    if func in ('percentile_cont', 'percentile_disc'):
+        # Scalar plans with no partition rows start from bare NULL states
+        summaries, counts = acc[slots[0]], acc[slots[1]]
+        return sketches.percentile(func, fraction, summaries or [], counts or [])
+    value = acc[slots[0]]
+    if func == 'count' and value is None:
         return 0
+    return value
 
-    if isinstance(node, exp.GT): 
-        left = evaluate_condition(node.this, row)
-        right = evaluate_condition(node.expression, row)
-        result = left > right if (left is not None and right is not None) else False
-        sys.stderr.write(f"DEBUG evaluate_condition: {left} > {right} = {result}\n")
-        sys.stderr.flush()
-        return result
-    if isinstance(node, exp.LT): return evaluate_condition(node.this, row) < evaluate_condition(node.expression, row)
-    if isinstance(node, exp.GTE): return evaluate_condition(node.this, row) >= evaluate_condition(node.expression, row)
-    if isinstance(node, exp.LTE): return evaluate_condition(node.this, row) <= evaluate_condition(node.expression, row)
-    if isinstance(node, exp.EQ): return evaluate_condition(node.this, row) == evaluate_condition(node.expression, row)
-    if isinstance(node, exp.NEQ): return evaluate_condition(node.this, row) != evaluate_condition(node.expression, row)
-    if isinstance(node, exp.And): return evaluate_condition(node.this, row) and evaluate_condition(node.expression, row)
-    if isinstance(node, exp.Or): return evaluate_condition(node.this, row) or evaluate_condition(node.expression, row)
-    
-    return False
+def build_result_rows(groups, spec):
+    """Merged groups -> result rows named and ordered like the original SELECT list."""
+    names = [name for _, name in spec['group_cols']]
+    finals, fractions = spec['finals'], spec.get('fractions', {})
+    layout = []
+    for kind, idx in spec['outputs']:
+        if kind == 'group':
+            layout.append((names[idx], 'group', idx, None, None, None))
+        else:
+            name, func, slots = finals[idx]
+            layout.append((name, 'agg', None, func, slots, fractions.get(idx)))
+    rows = []
+    for key, acc in groups.items():
+        row = {}
+        for name, kind, idx, func, slots, fraction in layout:
+            row[name] = key[idx] if kind == 'group' else finalize_aggregate(func, acc, slots, fraction)
+        rows.append(row)
+    return rows
 
-def merge_grouped_results(responses, agg_type, agg_alias):
-    """Merge results from workers for GROUP BY queries."""
-    grouped_data = {}
-    
-    for r in responses:
-        if r.status_code != 200:
-            print(f"DEBUG: Worker failed: {r.status_code} {r.text}")
-            continue
-            
-        data = r.json()
-        rows = data.get("rows", [])
-        print(f"DEBUG: Worker returned {len(rows)} rows")
-        
-        for row in rows:
-            # Extract aggregate value
-            agg_val = row.get(agg_alias)
-            if agg_val is None:
-                # Fallback: assume 'count' or similar common names
-                if 'count' in row: agg_val = row['count']
-                elif 'sum' in row: agg_val = row['sum']
-                elif 'min' in row: agg_val = row['min']
-                elif 'max' in row: agg_val = row['max']
-                elif 'avg' in row: agg_val = row['avg']
-                else: agg_val = list(row.values())[-1] # Last resort
-            
-            # Extract group keys
-            if agg_alias and agg_alias in row:
-                group_items = tuple((k, v) for k, v in row.items() if k != agg_alias)
+def build_sampled_rows(groups, spec, sample):
+    """build_result_rows() for a sampled plan: scaled estimates, plus "<name>_ci": [low, high] per visible aggregate."""
+    names = [name for _, name in spec['group_cols']]
+    finals, squares, intervals = spec['finals'], spec['squares'], set(spec['intervals'])
+    rows = []
+    for key, acc in groups.items():
+        row = {}
+        for kind, idx in spec['outputs']:
+            if kind == 'group':
+                row[names[idx]] = key[idx]
+                continue
+            name, func, slots = finals[idx]
+            if func in SKETCH_FUNCS:
+                # Percentiles of the sampled rows estimate the table's as they are
+                value, interval = finalize_aggregate(func, acc, slots, spec['fractions'].get(idx)), None
             else:
-                # Fallback: exclude the value we identified as aggregate (risky but necessary if no alias)
-                # We try to exclude only the specific key that held the value if possible
-                # But here we iterate all items.
-                group_items = tuple((k, v) for k, v in row.items() if v != agg_val)
-            
-            if group_items not in grouped_data:
-                grouped_data[group_items] = []
-            grouped_data[group_items].append(agg_val)
-            
-    final_rows = []
-    for group_items, values in grouped_data.items():
-        if agg_type in ('count', 'sum'):
-            res = sum(values)
-        elif agg_type == 'min':
-            res = min(values)
-        elif agg_type == 'max':
-            res = max(values)
-        elif agg_type == 'avg':
-            res = sum(values) / len(values)
+                value, interval = sampling.estimate(func, acc, slots, squares.get(idx), sample)
+            row[name] = value
+            if idx in intervals:
+                row[f"{name}_ci"] = interval
+        rows.append(row)
+    return rows
+
+def merge_result_rows(parts, spec, sample=None):
+    """Merged result rows: columnar merge for large inputs when NumPy is available, dict merge otherwise."""
+    if sample is not None:
+        # Sampled partial results are small; the estimates need the raw states
+        MERGE_PATH.labels(path="sampled").inc()
+        return build_sampled_rows(merge_partial_states(parts, spec), spec, sample)
+    if COLUMNAR_MERGE_ROWS > 0 and columnar.available() and sum(map(len, parts)) >= COLUMNAR_MERGE_ROWS:
+        rows = columnar.merge_result_rows(parts, spec)
+        if rows is not None:
+            MERGE_PATH.labels(path="columnar").inc()
+            return rows
+    MERGE_PATH.labels(path="dict").inc()
+    return build_result_rows(merge_partial_states(parts, spec), spec)
+
+def merge_grouped_results(parts, spec, sample=None):
+    """Merge partial aggregate states from workers for GROUP BY queries (scaled estimates when sampled)."""
+    return {"rows": merge_result_rows(parts, spec, sample)}
+
+def merge_aggregates(parts, spec, sample=None):
+    """Merge partial aggregate states for scalar aggregates (always exactly one row)."""
+    rows = merge_result_rows(parts, spec, sample)
+    if not rows:
+        empty = {(): [None] * len(spec['states'])}
+        rows = build_sampled_rows(empty, spec, sample) if sample is not None else build_result_rows(empty, spec)
+    return {"rows": rows}
+
+class Descending:
+    """Sort-key wrapper that inverts the order of the wrapped value."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+def order_key(order):
+    """
+    Key function that sorts result rows like Postgres would under ORDER BY,
+    including mixed ASC/DESC terms and NULLS FIRST/LAST placement.
+    """
+    terms = [(t['key'], t['desc'], 1 if t['nulls_first'] == t['desc'] else -1) for t in order]
+
+    def key(row):
+        parts = []
+        for name, desc, null_rank in terms:
+            value = row.get(name)
+            part = (null_rank, 0) if value is None else (0, value)
+            parts.append(Descending(part) if desc else part)
+        return tuple(parts)
+
+    return key
+
+def apply_order_and_limit(rows, plan, presorted_parts=None):
+    """
+    Final ORDER BY / OFFSET / LIMIT in the dispatcher.
+    presorted_parts: per-partition row lists already sorted by the workers,
+    merged lazily so only offset+limit rows are ever touched.
+    """
+    if presorted_parts is not None:
+        if plan['order']:
+            rows = heapq.merge(*presorted_parts, key=order_key(plan['order']))
         else:
-            res = values[0]
-            
-        new_row = dict(group_items)
-        # Add aggregate result
-        key_name = agg_alias if agg_alias else 'result'
-        new_row[key_name] = res
-        final_rows.append(new_row)
-        
-    return {"rows": final_rows}
-
-def merge_aggregates(responses, agg_type):
-    """Legacy merger for scalar aggregates."""
-    all_values = []
-    for r in responses:
-        if r.status_code != 200: continue
-        rows = r.json()["rows"]
-        if len(rows) > 0:
-            first_key = list(rows[0].keys())[0]
-            value = rows[0][first_key]
-            if value is not None:
-                all_values.append(value)
+            rows = chain.from_iterable(presorted_parts)
+    elif plan['order']:
+        rows = sorted(rows, key=order_key(plan['order']))
+    stop = plan['offset'] + plan['limit'] if plan['limit'] is not None else None
+    rows = list(islice(rows, plan['offset'], stop))
+    for row in rows:
+        for name in plan['hidden']:
+            row.pop(name, None)
+    return rows
+
+async def build_subqueries(plan, where, max_parts=None):
+    """Sub-queries for one execution of plan (at most max_parts), with the split metrics recorded."""
+    if where is None or not list(where.find_all(exp.Literal)):
+        DYNAMIC_SPLITS.inc()
     
-    if not all_values: return {"rows": [{"result": 0}]}
+    log.debug("dispatch: can_split=%s", plan['splittable'])
     
-    if agg_type in ('count', 'sum'): result = sum(all_values)
-    elif agg_type == 'avg': result = sum(all_values) / len(all_values)
-    elif agg_type == 'min': result = min(all_values)
-    elif agg_type == 'max': result = max(all_values)
-    else: result = all_values[0]
+    if plan['splittable']:
+        subqueries = await make_subqueries(plan, where, max_parts=max_parts)
+    else:
+        # The template already has HAVING removed (applied after merging results)
+        subqueries = [whole_query(plan, where)]
+        
+    log.debug("dispatch: generated %d subqueries", len(subqueries))
+    SPLIT_TOTAL.inc(len(subqueries))
+    PARTITION_COUNT.observe(len(subqueries))
+    WORKER_REQUESTS.inc(len(subqueries))
+    return subqueries
+
+def append_only_column(plan):
+    """The ever-growing column of plan's table when its partial states may be cached, else None."""
+    if not plan['splittable'] or plan['joins'] or plan['sample'] or plan['merge'] not in ("grouped", "aggregate") or PARTIAL_CACHE_MAX_BYTES <= 0:
+        return None
+    return PARTIAL_CACHE_TABLES.get(plan['table'])
+
+async def incremental_subqueries(plan, where, col):
+    """
+    Partition an append-only table on ranges of col aligned to a power-of-two
+    width, so the same closed ranges come back on every call. Closed ranges
+    (below the block holding the newest value) are answered from the partial
+    cache; only missing ones and the open top range are run. When the table's
+    version can't be probed, nothing is read from or offered to the cache.
+    Returns (cached partial row lists, partitions to run, {index: (cache key, version)}
+    for fresh closed ranges worth caching).
+    """
+    with tracing.stage("bounds"):
+        stats = await stats_catalog.get(plan['table'], col)
+    if not stats or not all(isinstance(stats[k], int) and not isinstance(stats[k], bool) for k in ("low", "high")):
+        return [], await build_subqueries(plan, where), {}
+    low, high = stats["low"], stats["high"]
+    # The width only changes when the span crosses a power of two
+    width = 1 << max(0, math.ceil(math.log2(max(1.0, (high - low + 1) / MAX_PARTS))))
+    first, last = low // width, high // width
+    probe = (await result_cache.current_versions([plan['table']]))[plan['table']]
+    # Inserts don't invalidate closed ranges; updates, deletes and TRUNCATE do
+    version = probe[1:] if probe else None
+    # Without a version nothing proves a cached range is still current
+    cacheable = version is not None
+
+    query = plan['template'].copy()
+    cached, subqueries, fresh = [], [], {}
+    for k in range(first, last + 1):
+        lower = k * width if k > first else None
+        upper = (k + 1) * width if k < last else None
+        if first == last:
+            # A single open range: nothing to add
+            part = whole_query(plan, where)
+        else:
+            part = make_partition(plan, where, col, lower, upper, k == last, low, high, query)
+        closed = cacheable and upper is not None
+        rows = partial_cache.get(part['sql'], version) if closed else None
+        if rows is not None:
+            cached.append(rows)
+            continue
+        if closed:
+            fresh[len(subqueries)] = (part['sql'], version)
+        subqueries.append(part)
+
+    log.debug("incremental: %d cached ranges, %d sub-queries", len(cached), len(subqueries))
+    SPLIT_TOTAL.inc(len(subqueries))
+    PARTITION_COUNT.observe(len(subqueries))
+    WORKER_REQUESTS.inc(len(subqueries))
+    return cached, subqueries, fresh
+
+async def fetch_partition(sql, worker, cost=1.0):
+    """One attempt at a sub-query on a worker taken from the scheduler; raises instead of returning an error response."""
+    started = time.perf_counter()
+    elapsed = None
+    try:
+        with tracing.stage("worker"):
+            r = await post_to_worker(sql, worker.url)
+        if r.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"Worker error: {r.text}")
+        elapsed = time.perf_counter() - started
+        with tracing.stage("decode"):
+            rows = rowformat.decode_rows(r.headers.get("content-type", ""), r.content)
+        return rows
+    finally:
+        worker_scheduler.release(worker, cost, elapsed)
+
+async def run_partition(part, plan, where, deadline, depth=0, avoid=frozenset(), grant=None):
+    """
+    Run one partition and return its rows as a list of row lists (several once re-split).
+    A duplicate request is hedged once the partition outlives the recent HEDGE_QUANTILE
+    latency, failed attempts are retried SUBQUERY_RETRIES times, and a partition that
+    misses SUBQUERY_TIMEOUT is cut into smaller ranges run in parallel. Hedges, retries
+    and re-split ranges go to other workers than the ones that were slow (avoid: worker URLs).
+    The partition runs in one slot of the query's admission grant; a hedge or more than
+    one re-split range at a time needs extra slots that are free right now (borrow_slots()).
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    timeout_at = min(started + SUBQUERY_TIMEOUT, deadline)
+    delay = subquery_latency.quantile(HEDGE_QUANTILE) if HEDGE_QUANTILE > 0 else None
+    hedge_at = started + delay if delay is not None else None
+
+    cost = part.get('cost', 1.0)
+    used = set(avoid)
+
+    def attempt():
+        worker = worker_scheduler.acquire(cost, avoid=used)
+        used.add(worker.url)
+        task = asyncio.ensure_future(fetch_partition(part['sql'], worker, cost))
+        # Losing or abandoned attempts may still fail; nobody else will look at them
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    attempts = {attempt()}
+    retries = SUBQUERY_RETRIES
+    error = None
+    borrowed = []
+    try:
+        while attempts:
+            wake = min(timeout_at, hedge_at) if hedge_at is not None else timeout_at
+            done, _ = await asyncio.wait(attempts, timeout=max(0.0, wake - loop.time()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempts.discard(task)
+                if task.exception() is None:
+                    subquery_latency.add(loop.time() - started)
+                    return [task.result()]
+                error = task.exception()
+                log.warning("Sub-query attempt failed: %s", error)
+                if retries > 0:
+                    retries -= 1
+                    SUBQUERY_RETRIES_TOTAL.inc()
+                    attempts.add(attempt())
+            now = loop.time()
+            if now >= timeout_at:
+                break
+            if attempts and hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                extra = borrow_slots(grant, 1)
+                if grant is not None and extra is None:
+                    log.debug("No free admission slot for a hedged request")
+                else:
+                    borrowed.extend([extra] if extra is not None else [])
+                    SUBQUERY_HEDGES.inc()
+                    attempts.add(attempt())
+    finally:
+        for task in attempts:
+            task.cancel()
+        for extra in borrowed:
+            admission.release(extra)
+
+    if not attempts:
+        # Every attempt failed: the partition's rows are missing, so the query fails
+        if isinstance(error, HTTPException):
+            raise error
+        raise HTTPException(status_code=502, detail=f"Worker error: {error}")
+
+    if loop.time() >= deadline:
+        raise HTTPException(status_code=504, detail=f"Query timed out after {QUERY_TIMEOUT:g}s")
+    SUBQUERY_TIMEOUTS.inc()
+    pieces = resplit_partition(part, plan, where) if depth < RESPLIT_DEPTH else []
+    if not pieces:
+        raise HTTPException(status_code=504, detail=f"Sub-query timed out after {SUBQUERY_TIMEOUT:g}s")
+    log.warning("Sub-query missed its %gs deadline, re-splitting into %d ranges", SUBQUERY_TIMEOUT, len(pieces))
+    SUBQUERY_RESPLITS.inc()
+    WORKER_REQUESTS.inc(len(pieces))
+    # The ranges share the partition's own slot and whatever extra slots are free
+    extra = borrow_slots(grant, len(pieces) - 1)
+    slots = 1 + (extra.slots if extra is not None else 0) if grant is not None else None
+    try:
+        results = await gather_partitions(pieces, plan, where, deadline, depth + 1, frozenset(used), grant, slots)
+    finally:
+        if extra is not None:
+            admission.release(extra)
+    return [rows for piece in results for rows in piece]
+
+async def gather_partitions(partitions, plan, where, deadline, depth=0, avoid=frozenset(), grant=None, slots=None):
+    """Run partitions concurrently, at most slots at a time (all at once for None); the first failure cancels the rest."""
+    limit = asyncio.Semaphore(slots) if slots is not None and slots < len(partitions) else None
+
+    async def run(part):
+        if limit is None:
+            return await run_partition(part, plan, where, deadline, depth, avoid, grant)
+        async with limit:
+            return await run_partition(part, plan, where, deadline, depth, avoid, grant)
+
+    tasks = [asyncio.ensure_future(run(p)) for p in partitions]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def borrow_slots(grant, slots):
+    """Up to slots extra slots for an admitted query, taken only if free right now; None otherwise."""
+    if grant is None or slots < 1:
+        return None
+    return admission.try_acquire(grant.client, grant.priority, slots)
+
+async def admit(client, priority, slots):
+    """Reserve slots for one query's sub-queries (maybe fewer, see admission.py); a shed request fails with 429."""
+    started = time.perf_counter()
+    try:
+        grant = await admission.acquire(client, priority, slots)
+    except Overloaded as e:
+        ADMISSION_SHED.labels(priority=priority, reason=e.reason).inc()
+        raise HTTPException(status_code=429, detail=f"Too many queries in flight ({e.reason}), retry later",
+                            headers={"Retry-After": "1"})
+    ADMISSION_WAIT.labels(priority=priority).observe(time.perf_counter() - started)
+    return grant
+
+def load_rollups(path):
+    """Plan the rollups declared in path; definitions the dispatcher can't maintain are logged and skipped."""
+    rollups = []
+    for definition in load_definitions(path):
+        try:
+            plan = build_plan(definition['sql'], [])
+            if plan['merge_spec'] is None:
+                raise ValueError("not an aggregate query the dispatcher can split")
+            if plan['template'].args.get("where") or plan['analysis']['having'] or plan['order'] or plan['limit'] is not None or plan['offset']:
+                raise ValueError("rollups can't have WHERE, HAVING, ORDER BY or LIMIT")
+            if any(op == 'collect' for _, op in plan['merge_spec']['states']):
+                raise ValueError("percentile summaries can't be merged again from a rollup")
+            rollups.append(Rollup(definition['name'], definition['sql'], plan, SQL_DIALECT))
+        except Exception as e:
+            log.warning("Skipping rollup %s: %s", definition['name'], e)
+    return rollups
+
+def rollup_groups(parts, spec):
+    """Merged partial states as rows named like the partial rows they came from."""
+    names = [name for name, _ in spec['group_cols']] + [alias for alias, _ in spec['states']]
+    return [dict(zip(names, key + tuple(acc))) for key, acc in merge_partial_states(parts, spec).items()]
+
+async def refresh_rollup(rollup):
+    """
+    Bring one rollup up to date with its tables. Only inserts into an
+    append-only partition table re-run the blocks from the previous top block
+    upwards; any other change re-runs every block. Returns the refresh kind:
+    unchanged, incremental or full.
+    """
+    plan = rollup.plan
+    table, col = plan['table'], plan['partition_col']
+    async with rollup.lock:
+        # Versions are taken before the blocks are read: a write during the refresh triggers the next one
+        versions = await result_cache.probe(plan['tables'])
+        old = rollup.versions
+        if rollup.ready and versions == old and None not in versions.values():
+            return "unchanged"
+
+        stats = await stats_catalog.get(table, col)
+        bounds = (None, None, None, None, None)
+        if stats and all(isinstance(stats[k], int) and not isinstance(stats[k], bool) for k in ("low", "high")):
+            low, high = stats["low"], stats["high"]
+            # Same blocks as incremental_subqueries()
+            width = 1 << max(0, math.ceil(math.log2(max(1.0, (high - low + 1) / MAX_PARTS))))
+            bounds = (width, low // width, high // width, low, high)
+        width, first, last = bounds[:3]
+
+        incremental = (rollup.ready and width is not None and (width, first) == (rollup.width, rollup.first)
+                       and PARTIAL_CACHE_TABLES.get(table) == col and old is not None
+                       and versions[table] is not None and old.get(table) is not None and versions[table][1:] == old[table][1:]
+                       and all(versions[t] == old.get(t) for t in plan['tables'] if t != table))
+        if incremental:
+            # The statistics may lag behind the previous refresh
+            last = max(last, rollup.last)
+            bounds = (width, first, last, min(bounds[3], rollup.low), max(bounds[4], rollup.high))
+            blocks = {k: rows for k, rows in rollup.blocks.items() if k < rollup.last}
+            run = list(range(rollup.last, last + 1))
+        else:
+            blocks = {}
+            run = list(range(first, last + 1)) if width is not None else [None]
+
+        partitions = []
+        for k in run:
+            if k is None or first == last:
+                partitions.append(whole_query(plan, None))
+            else:
+                lower = k * width if k > first else None
+                upper = (k + 1) * width if k < last else None
+                partitions.append(make_partition(plan, None, col, lower, upper, k == last, bounds[3], bounds[4]))
+        WORKER_REQUESTS.inc(len(partitions))
+        results = await run_partitions(partitions, plan, None, "rollups", "batch")
+
+        for k, pieces in zip(run, results):
+            blocks[k] = list(chain.from_iterable(pieces))
+        spec = plan['merge_spec']
+        closed = rollup_groups([rows for k, rows in blocks.items() if k is not None and k < last], spec)
+        rows = rollup_groups(list(blocks.values()), spec)
+        rollup.publish(blocks, rows, closed, versions, bounds)
+        log.info("Rollup %s refreshed (%s): %d blocks read, %d groups", rollup.name,
+                 "incremental" if incremental else "full", len(run), len(rows))
+        return "incremental" if incremental else "full"
+
+def rollup_predicate(rollup, mapping, where):
+    """
+    WHERE as a predicate over the rollup's rows (None without WHERE). Raises
+    ValueError when it can't be evaluated there the way Postgres would: dates
+    and timestamps arrive as strings, and text only compares equal reliably
+    (ordering depends on the collation).
+    """
+    if where is None:
+        return None
+    ordering = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+    def resolve(node):
+        column = mapping['filters'].get(node.sql(dialect=SQL_DIALECT)) if isinstance(node, exp.Column) else None
+        kind = rollup.kinds.get(column)
+        if kind == 'other' or kind == 'text' and isinstance(node.parent, ordering):
+            return None
+        return column
+    return compile_predicate(where, resolve)
+
+def rollup_tail(rollup, plan, where, changed, versions):
+    """
+    The open top range of the rollup's partition table as a partition of plan,
+    when only inserts into that append-only table happened since the refresh
+    (the closed blocks are still exact); else None.
+    """
+    table, col = rollup.plan['table'], rollup.plan['partition_col']
+    old = rollup.versions.get(table)
+    if (changed != [table] or rollup.width is None or PARTIAL_CACHE_TABLES.get(table) != col or old is None
+            or versions[table][1:] != old[1:] or plan['table'] != table or plan['joins'] and plan['partition_col'] != col):
+        return None
+    lower = rollup.last * rollup.width if rollup.last > rollup.first else None
+    return make_partition(plan, where, col, lower, None, True, rollup.low, rollup.high)
+
+def rollup_matches(plan):
+    """[(rollup, mapping)] for the rollups that can answer plan."""
+    if not len(rollup_set) or plan['merge_spec'] is None or plan['sample']:
+        return []
+    matches = plan.get('rollups')
+    if matches is None:
+        # Rollups are fixed at startup, so the match is cached with the plan
+        matches = plan['rollups'] = rollup_set.match(plan, SQL_DIALECT)
+    return matches
+
+async def rollup_subqueries(plan, where):
+    """
+    Answer plan from the smallest ready rollup that matches it: (partial row
+    lists, partitions still to run), or None when the query has to fan out.
+    """
+    matches = rollup_matches(plan)
+    if not matches:
+        return None
+    versions = await result_cache.current_versions(plan['tables'])
+    for rollup, mapping in sorted(matches, key=lambda match: len(match[0].rows)):
+        parts, partitions, outcome = None, [], "not_ready"
+        if rollup.ready:
+            changed = [t for t in plan['tables'] if versions.get(t) is not None and versions[t] != rollup.versions.get(t)]
+            tail = rollup_tail(rollup, plan, where, changed, versions) if changed else None
+            try:
+                predicate = rollup_predicate(rollup, mapping, where)
+                if not changed:
+                    parts, outcome = [rollup.partial_rows(mapping, predicate)], "hit"
+                elif tail is not None:
+                    parts, partitions, outcome = [rollup.partial_rows(mapping, predicate, closed=True)], [tail], "tail"
+                else:
+                    outcome = "stale"
+                    rollup_set.wake()
+            except (ValueError, TypeError) as e:
+                log.debug("Rollup %s can't filter this query: %s", rollup.name, e)
+                outcome = "filter"
+        ROLLUP_LOOKUPS.labels(rollup=rollup.name, result=outcome).inc()
+        if parts is not None:
+            log.debug("rollup: %s answered from %s (%d groups)", outcome, rollup.name, len(parts[0]))
+            SPLIT_TOTAL.inc(len(partitions))
+            WORKER_REQUESTS.inc(len(partitions))
+            return parts, partitions
+    return None
+
+def exact_unsplit(plan, where, partitions):
+    """
+    (plan, partitions) to run. Sketched aggregates (COUNT(DISTINCT) as KMV,
+    percentiles) are only estimates and merged rows are sorted in Python; when
+    the whole query runs as a single sub-query anyway, the original statement
+    answers exactly instead.
+    """
+    if plan.get('unsplit') and len(partitions) == 1 and partitions[0]['col'] is None:
+        unsplit = plan['unsplit']
+        return unsplit, [whole_query(unsplit, where, partitions[0]['cost'])]
+    return plan, partitions
+
+def is_text_type(col_type):
+    """Whether a Postgres type name (format_type()) is a character type."""
+    return bool(col_type) and (col_type in ("text", "citext", "name") or col_type.startswith("character"))
+
+async def ordered_by_text(plan):
+    """
+    Whether plan's ORDER BY compares a column the catalog reports as text.
+    Postgres sorts text under the database collation, which merging partitions
+    with Python comparisons (order_key()) doesn't reproduce.
+    """
+    for col in plan.get('sort_columns', ()):
+        for table in plan['tables']:
+            stats = await stats_catalog.get(table, col)
+            if stats and is_text_type(stats.get("type")):
+                return True
+    return False
+
+async def collated_plan(plan):
+    """plan, or its unsplit form when the merged order would compare text (see ordered_by_text())."""
+    if plan.get('unsplit') and await ordered_by_text(plan):
+        log.debug("ORDER BY compares text, running unsplit")
+        return plan['unsplit']
+    return plan
+
+def result_body(plan, rows):
+    """Response body of plan's final rows, naming the columns estimated from sketches."""
+    if plan['sketched']:
+        return {"rows": rows, "approximate": {"sketched": plan['sketched']}}
+    return {"rows": rows}
+
+async def execute_query(plan, where, client="anonymous", priority="interactive"):
+    """
+    Fan a query out to the workers (or read it from a rollup) and merge the
+    answers into the response body: {"rows": final rows}, see result_body().
+    """
+    cached, fresh = [], {}
+    plan = await collated_plan(plan)
+    col = append_only_column(plan)
+    with tracing.stage("subqueries"):
+        rolled = await rollup_subqueries(plan, where)
+        if rolled is not None:
+            cached, partitions = rolled
+        elif col:
+            cached, partitions, fresh = await incremental_subqueries(plan, where, col)
+        else:
+            plan, partitions = exact_unsplit(plan, where, await build_subqueries(plan, where, admission.cap(priority)))
+    results = await run_partitions(partitions, plan, where, client, priority)
+
+    if plan['merge'] not in ("grouped", "aggregate"):
+        # Row queries: k-way merge of the sorted partitions, stopping at LIMIT
+        parts = [rows for pieces in results for rows in pieces]
+        with tracing.stage("merge"):
+            return {"rows": apply_order_and_limit(None, plan, presorted_parts=parts)}
+    parts = list(cached)
+    for i, pieces in enumerate(results):
+        if i in fresh:
+            partial_cache.put(*fresh[i], list(chain.from_iterable(pieces)))
+        parts.extend(pieces)
+    return result_body(plan, finish_aggregate(plan, parts))
+
+async def execute_shared(plans, where, client="anonymous", priority="interactive"):
+    """
+    Run aggregate plans that differ only in their aggregates (see batch.share_key())
+    as one set of sub-queries; returns the response body of each plan.
+    """
+    if any([await ordered_by_text(plan) for plan in plans]):
+        return await asyncio.gather(*(execute_query(plan, where, client, priority) for plan in plans))
+    combined, specs = batch.combine_plans(plans, SQL_DIALECT)
+    with tracing.stage("subqueries"):
+        partitions = await build_subqueries(combined, where, admission.cap(priority))
+    if any(exact_unsplit(plan, where, partitions)[0] is not plan for plan in plans):
+        # A single sub-query: plans with sketches run their original statements for exact answers
+        return await asyncio.gather(*(execute_query(plan, where, client, priority) for plan in plans))
+    results = await run_partitions(partitions, combined, where, client, priority)
+    parts = [rows for pieces in results for rows in pieces]
+    return [result_body(plan, finish_aggregate(plan, parts, spec)) for plan, spec in zip(plans, specs)]
+
+async def run_partitions(partitions, plan, where, client, priority):
+    """
+    Run partitions under admission control and QUERY_TIMEOUT; row lists per partition.
+    No more partitions run at once than the query was granted slots.
+    """
+    grant = await admit(client, priority, len(partitions)) if partitions else None
+    deadline = asyncio.get_running_loop().time() + QUERY_TIMEOUT
+    try:
+        return await asyncio.wait_for(gather_partitions(partitions, plan, where, deadline, grant=grant,
+                                                        slots=grant.slots if grant else None), QUERY_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Query timed out after {QUERY_TIMEOUT:g}s")
+    finally:
+        if grant is not None:
+            admission.release(grant)
+
+def finish_aggregate(plan, parts, spec=None):
+    """Final rows of an aggregate plan from its partial rows: merge, HAVING, then ORDER BY / LIMIT."""
+    merge = merge_grouped_results if plan['merge'] == "grouped" else merge_aggregates
+    with tracing.stage("merge"):
+        rows = merge(parts, spec or plan['merge_spec'], plan['sample'])["rows"]
+
+    # Apply HAVING clause if present (compiled once per plan)
+    having_filter = plan['having_filter']
+    if having_filter and rows:
+        before = len(rows)
+        with tracing.stage("having"):
+            rows = [row for row in rows if having_filter(row) is True]
+        log.debug("HAVING kept %d of %d groups", len(rows), before)
     
-    return {"rows": [{"result": result}]}
+    # ORDER BY / LIMIT over the merged groups (after HAVING); drops hidden columns
+    with tracing.stage("order"):
+        return apply_order_and_limit(rows, plan)
+
+def admission_options(payload):
+    """(client, priority) of a request; an unknown priority is a 400."""
+    # Admission: slots are limited per "client"; "batch" queries yield to interactive ones
+    client = str(payload.get("client") or "anonymous")
+    priority = payload.get("priority") or "interactive"
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority {priority!r} (interactive or batch)")
+    return client, priority
+
+def http_error(error):
+    """
+    The HTTPException a failed statement answers with, the same for every
+    endpoint: its own, 400 for SQL that can't be parsed, None for anything
+    else (an internal error, 500).
+    """
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, SqlglotError):
+        return HTTPException(status_code=400, detail=str(error))
+    return None
 
 @app.post("/query")
-async def dispatch(payload: dict):
+async def dispatch(payload: dict, request: Request, response: Response):
     start_time = time.time()
     ACTIVE_QUERIES.inc()
+    streaming = False
+    grant = None
+    # Trace ID for logs and worker requests; sampled queries also record spans and a stage breakdown
+    trace = tracing.start(request.headers.get("traceparent"), TRACE_SAMPLE_RATE)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    status = 200
+    query_type = None
     
     try:
         REQ_TOTAL.inc()
         sql = payload.get("sql")
         if not sql:
             raise HTTPException(status_code=400, detail="Missing `sql` field")
+        client, priority = admission_options(payload)
+        # "approximate": {"fraction": 0.01}: aggregates estimated from a TABLESAMPLE sample
+        try:
+            sample = sampling.parse_options(payload.get("approximate"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        parsed = parse_one(sql)
-        
-        # Analyze query structure
-        analysis = analyze_query(parsed)
+        # Parse once (or reuse the cached plan for this query shape)
+        plan, literals, cache_key = plan_query(sql)
+        if sample is not None:
+            plan = sampled_plan(plan, sample)
+            cache_key = (cache_key, sample['fraction'], sample['method'], sample['seed'], sample['confidence'])
+            APPROXIMATE_QUERIES.labels(method=sample['method']).inc()
+        query_type = plan['query_type']
+        analysis = plan['analysis']
         is_agg = analysis['is_agg']
         agg_type = analysis['agg_type']
         group_by = analysis['group_by']
-        having = analysis['having']
         
-        print(f"DEBUG dispatch: is_agg={is_agg}, agg_type={agg_type}, group_by={group_by}, having={having is not None}")
+        log.debug("dispatch: is_agg=%s agg_type=%s group_by=%s having=%s merge=%s",
+                  is_agg, agg_type, group_by, plan['having_filter'] is not None, plan['merge'])
         
         if is_agg:
             AGG_QUERIES.labels(agg_type=agg_type).inc()
+        for func in plan['sketches']:
+            SKETCH_AGGREGATES.labels(func=func).inc()
         if group_by:
             GROUP_BY_QUERIES.inc()
         
-        # Check if splitting will be dynamic
-        where = parsed.args.get("where")
-        if not where or not list(where.find_all(exp.Literal)):
-            DYNAMIC_SPLITS.inc()
-        
-        can_split_query = can_split(parsed)
-        print(f"DEBUG dispatch: can_split={can_split_query}")
-        
-        if can_split_query:
-            subqueries = await make_subqueries(sql)
-        else:
-            # Even if we don't split, we need to remove HAVING clause
-            # because it must be applied after merging results
-            parsed_no_having = parse_one(sql)
-            if parsed_no_having.args.get("having"):
-                print(f"DEBUG dispatch: Removing HAVING from non-split query")
-                parsed_no_having.set("having", None)
-            subqueries = [parsed_no_having.sql()]
-            
-        print(f"DEBUG dispatch: Generated {len(subqueries)} subqueries")
-        SPLIT_TOTAL.inc(len(subqueries))
-        WORKER_REQUESTS.inc(len(subqueries))
+        where = bound_where(plan, literals)
 
-        import asyncio
-        async with httpx.AsyncClient() as client:
-            tasks = [client.post(WORKER_URL, json={"sql": q}) for q in subqueries]
-            responses = await asyncio.gather(*tasks)
+        def finish_stream():
+            if grant is not None:
+                admission.release(grant)
+            ACTIVE_QUERIES.dec()
+            QUERY_LATENCY.labels(query_type=plan['query_type']).observe(time.time() - start_time)
+            tracing.finish(trace, query_type=query_type, streamed=True)
 
-        # Merge results
-        if group_by:
-            result = merge_grouped_results(responses, agg_type, analysis['agg_alias'])
-        elif is_agg:
-            result = merge_aggregates(responses, agg_type)
+        # Streaming mode: forward partition rows as they arrive instead of buffering them all
+        stream = bool(payload.get("stream"))
+        if stream and plan['merge'] == "concat":
+            plan = await collated_plan(plan)
+            with tracing.stage("subqueries"):
+                subqueries = [part['sql'] for part in await build_subqueries(plan, where, admission.cap(priority))]
+            grant = await admit(client, priority, len(subqueries))
+            streaming = True
+            body = stream_sorted_partitions if plan['order'] else stream_partitions
+            return StreamedResponse(body(subqueries, plan), finish_stream, headers={"X-Trace-Id": trace.trace_id})
+
+        # Identical statements share cached (or in-flight) results; "cache": false forces execution
+        if RESULT_CACHE_MAX_BYTES > 0 and payload.get("cache", True):
+            body, outcome = await result_cache.get_or_run(cache_key, plan['tables'], lambda: execute_query(plan, where, client, priority))
+            RESULT_CACHE_LOOKUPS.labels(result=outcome).inc()
         else:
-            # Standard row concatenation for non-aggregate queries
-            merged = []
-            for r in responses:
-                if r.status_code != 200:
-                    raise HTTPException(status_code=502, detail=f"Worker error: {r.text}")
-                merged.extend(r.json()["rows"])
-            result = {"rows": merged}
-            
-        # Apply HAVING clause if present
-        if having and result["rows"]:
-            print(f"DEBUG dispatch: Applying HAVING filter to {len(result['rows'])} rows")
-            print(f"DEBUG dispatch: HAVING node type: {type(having)}")
-            print(f"DEBUG dispatch: HAVING node: {having}")
-            
-            # Extract the actual condition from the Having node
-            having_condition = having.this if hasattr(having, 'this') else having
-            print(f"DEBUG dispatch: HAVING condition: {having_condition}")
-            print(f"DEBUG dispatch: Sample row: {result['rows'][0] if result['rows'] else 'none'}")
-            
-            filtered_rows = []
-            for row in result["rows"]:
-                try:
-                    passes = evaluate_condition(having_condition, row)
-                    print(f"DEBUG dispatch: Row {row} -> passes={passes}")
-                    if passes:
-                        filtered_rows.append(row)
-                except Exception as e:
-                    print(f"DEBUG dispatch: Error evaluating row {row}: {e}")
-            print(f"DEBUG dispatch: After HAVING filter: {len(filtered_rows)} rows")
-            result["rows"] = filtered_rows
+            body = await execute_query(plan, where, client, priority)
+        
+        if stream:
+            # Merged results are small; stream them too so clients see one format
+            streaming = True
+            headers = {"X-Trace-Id": trace.trace_id}
+            if "approximate" in body:
+                headers["X-Sketched-Columns"] = ",".join(body["approximate"]["sketched"])
+            return StreamedResponse(stream_result_rows(body["rows"]), finish_stream, headers=headers)
         
         # Record latency
-        query_type = f"{agg_type}_aggregate" if is_agg else "select"
-        QUERY_LATENCY.labels(query_type=query_type).observe(time.time() - start_time)
+        QUERY_LATENCY.labels(query_type=plan['query_type']).observe(time.time() - start_time)
         
-        return result
+        if sample is not None:
+            # Cached bodies are shared: answer with a copy
+            approximate = {key: sample[key] for key in ("fraction", "method", "confidence")}
+            return dict(body, approximate={**approximate, **body.get("approximate", {})})
+        return body
+    except Exception as e:
+        error = http_error(e)
+        status = error.status_code if error is not None else 500
+        if error is None or error is e:
+            raise
+        raise error from e
+    finally:
+        # Streamed responses release their slots when the response ends (StreamedResponse)
+        if not streaming:
+            ACTIVE_QUERIES.dec()
+            tracing.finish(trace, status, query_type=query_type)
+
+def batch_error(error):
+    """Result entry of a failed /query/batch statement (mapped like /query, see http_error())."""
+    mapped = http_error(error)
+    if mapped is None:
+        log.error("Batch statement failed", exc_info=error)
+        return {"error": str(error), "status": 500}
+    return {"error": mapped.detail, "status": mapped.status_code}
+
+@app.post("/query/batch")
+async def dispatch_batch(payload: dict, request: Request, response: Response):
+    """
+    Run several statements together: `queries` holds SQL strings or {"sql": ...}
+    objects. Statements are planned and their tables' statistics loaded once
+    for the whole batch, identical statements run once, and aggregates that
+    differ only in their SELECT list share one set of sub-queries (batch.py).
+    Returns {"results": [...]} in statement order, each a /query response body
+    or {"error": ..., "status": ...}; a failing statement doesn't fail the others.
+    """
+    start_time = time.time()
+    ACTIVE_QUERIES.inc()
+    trace = tracing.start(request.headers.get("traceparent"), TRACE_SAMPLE_RATE)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    status = 200
+    try:
+        statements = payload.get("queries")
+        if not isinstance(statements, list) or not statements:
+            raise HTTPException(status_code=400, detail="Missing `queries` list")
+        if len(statements) > BATCH_MAX_STATEMENTS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_STATEMENTS} statements per batch")
+        client, priority = admission_options(payload)
+        use_cache = RESULT_CACHE_MAX_BYTES > 0 and payload.get("cache", True)
+
+        results = [None] * len(statements)
+        planned = {}  # result cache key -> (plan, where, statement indexes)
+        for i, statement in enumerate(statements):
+            sql = statement.get("sql") if isinstance(statement, dict) else statement
+            try:
+                if not sql or not isinstance(sql, str):
+                    raise HTTPException(status_code=400, detail="Missing `sql` field")
+                plan, literals, cache_key = plan_query(sql)
+                where = bound_where(plan, literals)
+            except Exception as e:
+                BATCH_STATEMENTS.labels(execution="error").inc()
+                results[i] = batch_error(e)
+                continue
+            if cache_key in planned:
+                BATCH_STATEMENTS.labels(execution="duplicate").inc()
+                planned[cache_key][2].append(i)
+            else:
+                planned[cache_key] = (plan, where, [i])
+
+        # One statistics lookup per partitioned table and column, all at once
+        with tracing.stage("bounds"):
+            await asyncio.gather(*(stats_catalog.get(table, col) for table, col in
+                                   {(plan['table'], plan['partition_col']) for plan, _, _ in planned.values()
+                                    if plan['splittable'] and plan['table']}))
+
+        # Aggregates over the same rows and groups share sub-queries; rollups and
+        # the partial cache answer theirs better alone
+        groups = {}
+        for cache_key, (plan, where, _) in planned.items():
+            share = batch.share_key(plan, where, SQL_DIALECT)
+            if share is None or append_only_column(plan) or rollup_matches(plan):
+                share = cache_key
+            groups.setdefault(share, []).append(cache_key)
+
+        async def run_group(keys):
+            members = [planned[key] for key in keys]
+            BATCH_STATEMENTS.labels(execution="shared" if len(keys) > 1 else "alone").inc(len(keys))
+            if len(keys) == 1:
+                plan, where, _ = members[0]
+                run = lambda: execute_query(plan, where, client, priority)
+                if not use_cache:
+                    return [await run()]
+                body, outcome = await result_cache.get_or_run(keys[0], plan['tables'], run)
+                RESULT_CACHE_LOOKUPS.labels(result=outcome).inc()
+                return [body]
+            shared = None
+            def run_shared():
+                # Started by the first statement the result cache can't answer
+                nonlocal shared
+                if shared is None:
+                    shared = asyncio.ensure_future(execute_shared([plan for plan, _, _ in members], members[0][1], client, priority))
+                return shared
+            async def member(k):
+                return (await run_shared())[k]
+            if not use_cache:
+                return await run_shared()
+            lookups = await asyncio.gather(*(result_cache.get_or_run(key, plan['tables'], lambda k=k: member(k))
+                                             for k, (key, (plan, _, _)) in enumerate(zip(keys, members))),
+                                           return_exceptions=True)
+            bodies = []
+            for lookup in lookups:
+                if isinstance(lookup, Exception):
+                    # Statements answered from the cache keep their rows
+                    bodies.append(lookup)
+                    continue
+                RESULT_CACHE_LOOKUPS.labels(result=lookup[1]).inc()
+                bodies.append(lookup[0])
+            return bodies
+
+        outcomes = await asyncio.gather(*(run_group(keys) for keys in groups.values()), return_exceptions=True)
+        for keys, outcome in zip(groups.values(), outcomes):
+            for k, key in enumerate(keys):
+                body = outcome if isinstance(outcome, Exception) else outcome[k]
+                entry = batch_error(body) if isinstance(body, Exception) else body
+                for i in planned[key][2]:
+                    results[i] = entry
+
+        QUERY_LATENCY.labels(query_type="batch").observe(time.time() - start_time)
+        return {"results": results}
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except Exception:
+        status = 500
+        raise
     finally:
         ACTIVE_QUERIES.dec()
+        tracing.finish(trace, status, query_type="batch")
+
+@app.post("/explain")
+async def explain(payload: dict):
+    """
+    The distributed plan the dispatcher would run for `sql`, without running it:
+    partitions, merge strategy and the cost/row estimates behind the split.
+    """
+    sql = (payload or {}).get("sql")
+    if not sql:
+        raise HTTPException(status_code=400, detail="Missing `sql` field")
+    try:
+        sample = sampling.parse_options(payload.get("approximate"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        plan, literals, _ = plan_query(sql)
+    except SqlglotError as e:
+        raise http_error(e) from e
+    if sample is not None:
+        plan = sampled_plan(plan, sample)
+    where = bound_where(plan, literals)
+    plan = await collated_plan(plan)
+    estimate = None
+    if plan['splittable']:
+        _, bounds, stats, low, high = await partition_range(plan, where)
+        if bounds != 'empty':
+            estimate = await estimate_cost(plan, where, estimate_rows(stats, low, high))
+    partitions = await make_subqueries(plan, where) if plan['splittable'] else [whole_query(plan, where)]
+    plan, partitions = exact_unsplit(plan, where, partitions)
+    return {
+        "splittable": plan['splittable'],
+        "merge": plan['merge'],
+        "table": plan['table'],
+        "tables": plan['tables'],
+        "partition_column": partitions[0]['col'],
+        "estimate": estimate,
+        "split_min_cost": SPLIT_MIN_COST,
+        "order": plan['order'],
+        "limit": plan['limit'],
+        "offset": plan['offset'],
+        "having_after_merge": plan['having_filter'] is not None,
+        "sketched": plan['sketched'],
+        "rollups": [rollup.name for rollup, _ in rollup_matches(plan)],
+        "partitions": [{"sql": p['sql'], "lower": p.get('lower'), "upper": p.get('upper'),
+                        "estimated_rows": p['cost']} for p in partitions],
+    }
+
+@app.post("/stats/refresh")
+async def refresh_stats(payload: dict = None):
+    """Reload cached statistics now, e.g. after a bulk load (optional `table`/`column`)."""
+    payload = payload or {}
+    keys = await stats_catalog.refresh(payload.get("table"), payload.get("column"))
+    return {"refreshed": [f"{t}.{c}" for t, c in keys]}
+
+@app.post("/stats/invalidate")
+async def invalidate_stats(payload: dict = None):
+    """Drop cached statistics so the next query reloads them (optional `table`/`column`)."""
+    payload = payload or {}
+    # Cost estimates were made from the same statistics
+    cost_estimator.invalidate()
+    return {"invalidated": stats_catalog.invalidate(payload.get("table"), payload.get("column"))}
+
+@app.post("/cache/invalidate")
+async def invalidate_results(payload: dict = None):
+    """Drop cached query results, e.g. after a write the version probe hasn't seen yet (optional `table`)."""
+    payload = payload or {}
+    return {"invalidated": result_cache.invalidate(payload.get("table"))}
+
+@app.get("/rollups")
+async def list_rollups():
+    """Declared rollups and how fresh they are."""
+    return {"rollups": [rollup.status() for rollup in rollup_set]}
+
+@app.post("/rollups/refresh")
+async def refresh_rollups(payload: dict = None):
+    """Refresh rollups now instead of waiting for ROLLUP_REFRESH_INTERVAL (optional `name`)."""
+    name = (payload or {}).get("name")
+    rollups = [rollup_set.get(name)] if name else list(rollup_set)
+    if None in rollups:
+        raise HTTPException(status_code=404, detail=f"Unknown rollup {name!r}")
+    refreshed = []
+    for rollup in rollups:
+        kind = await refresh_rollup(rollup)
+        ROLLUP_REFRESHES.labels(rollup=rollup.name, kind=kind).inc()
+        refreshed.append({"name": rollup.name, "kind": kind})
+    return {"refreshed": refreshed}
 
 @app.on_event("startup")
 async def startup():
-    global db_pool
-    db_pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10)
-    print(f"Database pool created: {DB_DSN}")
+    global db_pool, worker_client
+    if DB_DSN:
+        db_pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10)
+        log.info("Database pool created: %s", DB_DSN)
+    else:
+        # e.g. bench.run against mock workers: no statistics, EXPLAIN costs or table versions
+        log.warning("DB_DSN is empty: planning without catalog statistics")
+    worker_client = create_worker_client()
+    log.info("Worker client created: %s (max_connections=%d, http2=%s)", WORKER_URL, WORKER_MAX_CONNECTIONS, WORKER_HTTP2)
+    await worker_scheduler.refresh()
+    log.info("Scheduling sub-queries over %d worker endpoint(s) (%s)", len(worker_scheduler), SCHEDULER_STRATEGY)
+    stats_catalog.start()
+    result_cache.start()
+    if ROLLUPS_FILE:
+        rollup_set.rollups = load_rollups(ROLLUPS_FILE)
+        log.info("Maintaining %d rollup(s) from %s", len(rollup_set), ROLLUPS_FILE)
+        rollup_set.start(refresh_rollup)
 
 @app.on_event("shutdown")
 async def shutdown():
-    global db_pool
+    global db_pool, worker_client
+    await stats_catalog.stop()
+    await result_cache.stop()
+    await rollup_set.stop()
+    if worker_client:
+        await worker_client.aclose()
+        worker_client = None
+        log.info("Worker client closed")
     if db_pool:
         await db_pool.close()
-        print("Database pool closed")
+        log.info("Database pool closed")
 
 if __name__ == "__main__":
     # expose Prometheus metrics on :8002
@@ -0,0 +1,68 @@
+"""
+Per-partition partial aggregate cache for append-only tables.
+
+On a table that only grows at the top of its id range, a sub-query over a
+closed range (entirely below the newest id) returns the same partial
+aggregate states every time. The dispatcher partitions such tables on
+block-aligned ranges that line up across calls, keeps the partial states of
+the closed ranges here, and only re-runs the open range at the top.
+
+Entries are keyed by the rendered sub-query, which already contains the
+range, the request's WHERE and the partial SELECT list. Each entry carries
+the table's non-insert version (updates, deletes, relation filenode) and is
+ignored once that changes: an UPDATE/DELETE/TRUNCATE anywhere in the table
+means cached ranges can no longer be trusted.
+"""
+import json
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+PARTIAL_CACHE_LOOKUPS = Counter("dispatcher_partial_cache_lookups_total", "Partial aggregate cache lookups", ["result"])
+PARTIAL_CACHE_BYTES = Gauge("dispatcher_partial_cache_bytes", "Approximate bytes of partial states held")
+
+
+class PartialCache:
+    """LRU of partial aggregate rows per closed partition range, bounded by bytes and a TTL."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            PARTIAL_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+        if entry["version"] != version or time.monotonic() - entry["stored_at"] >= self.ttl:
+            self._drop(key)
+            PARTIAL_CACHE_LOOKUPS.labels(result="stale").inc()
+            return None
+        self._entries.move_to_end(key)
+        PARTIAL_CACHE_LOOKUPS.labels(result="hit").inc()
+        return entry["rows"]
+
+    def put(self, key, version, rows):
+        size = len(json.dumps(rows, default=str)) + len(key)
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = {"rows": rows, "version": version, "size": size, "stored_at": time.monotonic()}
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+        PARTIAL_CACHE_BYTES.set(self.bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+        PARTIAL_CACHE_BYTES.set(0)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
+            PARTIAL_CACHE_BYTES.set(self.bytes)
@@ -0,0 +1,79 @@
+"""
+Plan cache for the dispatcher.
+
+Dashboards send the same query shapes thousands of times with different
+literal values. normalize_sql() reduces a statement to a literal-free shape
+key using only the tokenizer, so a repeated shape reuses its cached plan and
+skips parsing and analysis entirely.
+
+Literals that change the meaning of a plan (GROUP BY 1, LIMIT 10, ...) are
+"fixed": their values become part of the key. Only literals the plan can
+re-bind per request (those in WHERE) are treated as parameters.
+"""
+from collections import OrderedDict
+
+from prometheus_client import Counter
+from sqlglot import Dialect
+from sqlglot.tokens import TokenType
+
+PLAN_CACHE_LOOKUPS = Counter("dispatcher_plan_cache_lookups_total", "Plan cache lookups", ["result"])
+
+LITERAL_TOKENS = {TokenType.NUMBER: "?n", TokenType.STRING: "?s"}
+MAX_VARIANTS_PER_SHAPE = 32
+
+
+def normalize_sql(sql, dialect):
+    """
+    Tokenize sql into (shape, literals).
+    shape: hashable key with every number/string literal replaced by a typed marker
+    literals: the literal tokens in source order (token_type, text, start, end)
+    """
+    shape, literals = [], []
+    for token in Dialect.get_or_raise(dialect).tokenize(sql):
+        marker = LITERAL_TOKENS.get(token.token_type)
+        if marker:
+            shape.append(marker)
+            literals.append(token)
+        elif token.token_type == TokenType.IDENTIFIER:
+            # Quoted identifiers are case-sensitive
+            shape.append(f'"{token.text}"')
+        else:
+            shape.append(token.text.upper())
+    return "\x1f".join(shape), literals
+
+
+class PlanCache:
+    """LRU of plans keyed by query shape, then by the values of the shape's fixed literals."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._shapes = OrderedDict()
+
+    def get(self, shape, literals):
+        entry = self._shapes.get(shape)
+        plan = None
+        if entry is not None:
+            plan = entry["variants"].get(tuple(literals[i].text for i in entry["fixed_slots"]))
+        if plan is None:
+            PLAN_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+        self._shapes.move_to_end(shape)
+        PLAN_CACHE_LOOKUPS.labels(result="hit").inc()
+        return plan
+
+    def put(self, shape, literals, plan):
+        fixed_slots = plan["fixed_slots"]
+        entry = self._shapes.get(shape)
+        if entry is None or entry["fixed_slots"] != fixed_slots:
+            entry = {"fixed_slots": fixed_slots, "variants": OrderedDict()}
+            self._shapes[shape] = entry
+        variants = entry["variants"]
+        variants[tuple(literals[i].text for i in fixed_slots)] = plan
+        while len(variants) > MAX_VARIANTS_PER_SHAPE:
+            variants.popitem(last=False)
+        self._shapes.move_to_end(shape)
+        while len(self._shapes) > self.max_entries:
+            self._shapes.popitem(last=False)
+
+    def clear(self):
+        self._shapes.clear()
@@ -0,0 +1,194 @@
+"""
+Result cache for the dispatcher.
+
+Dashboards send the same statement over and over; a hit returns the merged
+rows without fanning out to the workers again. Entries are keyed by
+normalized SQL (query shape plus literal values), held in an LRU bounded by
+an approximate byte budget, and expire after a TTL.
+
+Every entry remembers the version of the tables it read, taken before the
+query ran. Versions come from a cheap probe of pg_stat_user_tables (tuple
+counters plus the relation filenode, which changes on TRUNCATE) polled in the
+background, and optionally from a LISTEN/NOTIFY channel whose payload is a
+table name. A lookup whose tables moved on is a miss, so staleness is bounded
+by the poll interval (and by how quickly Postgres publishes its statistics).
+Identical requests that arrive while the first one is still executing share
+its result.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("dispatcher.resultcache")
+
+VERSION_SQL = """
+SELECT t.name, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, pg_relation_filenode(s.relid)
+FROM unnest($1::text[]) AS t(name)
+JOIN pg_stat_user_tables s ON s.relid = to_regclass(t.name)
+"""
+
+
+class ResultCache:
+    """LRU/TTL cache of query results with table-version invalidation and request coalescing."""
+
+    def __init__(self, pool_getter, max_bytes=64 * 1024 * 1024, ttl=30.0, poll_interval=1.0, channel=""):
+        self._pool_getter = pool_getter
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.channel = channel
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._versions = {}   # table -> probe tuple, None when the table can't be probed
+        self._epochs = {}     # table -> NOTIFY count
+        self._task = None
+        self._listen_conn = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_run(self, key, tables, run):
+        """
+        Return (result, outcome) for key, calling run() on a miss.
+        outcome: hit, miss, expired, stale or coalesced (joined an identical in-flight request).
+        """
+        entry = self._entries.get(key)
+        outcome = "miss"
+        if entry is not None:
+            if time.monotonic() - entry["stored_at"] >= self.ttl:
+                outcome = "expired"
+            elif entry["versions"] != self._snapshot(entry["versions"]):
+                outcome = "stale"
+            else:
+                self._entries.move_to_end(key)
+                return entry["result"], "hit"
+            self._drop(key)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending), "coalesced"
+
+        await self._ensure_versions(tables)
+        versions = self._snapshot(tables)
+        pending = asyncio.ensure_future(run())
+        self._inflight[key] = pending
+        pending.add_done_callback(lambda done: self._finish(key, done, versions))
+        return await asyncio.shield(pending), outcome
+
+    async def current_versions(self, tables):
+        """Latest probed version tuple per table (n_tup_ins, n_tup_upd, n_tup_del, filenode), None if unknown."""
+        await self._ensure_versions(tables)
+        return {t: self._versions.get(t) for t in tables}
+
+    async def probe(self, tables):
+        """Re-read the versions of tables now (dropping results of changed ones) and return them like current_versions()."""
+        for table in await self._probe(list(tables)):
+            self.invalidate(table)
+        return {t: self._versions.get(t) for t in tables}
+
+    def invalidate(self, table=None):
+        """Drop entries that read table (or everything). Returns the count dropped."""
+        keys = [k for k, e in self._entries.items() if table is None or table in e["versions"]]
+        for key in keys:
+            self._drop(key)
+        return len(keys)
+
+    def start(self):
+        """Start version polling and, when a channel is configured, LISTEN for change notifications."""
+        if self._task is None and (self.poll_interval > 0 or self.channel):
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listen_conn is not None:
+            pool = self._pool_getter()
+            try:
+                await self._listen_conn.remove_listener(self.channel, self._on_notify)
+            finally:
+                if pool is not None:
+                    await pool.release(self._listen_conn)
+                self._listen_conn = None
+
+    def _snapshot(self, tables):
+        return {t: (self._versions.get(t), self._epochs.get(t, 0)) for t in tables}
+
+    def _finish(self, key, done, versions):
+        self._inflight.pop(key, None)
+        if done.cancelled() or done.exception() is not None:
+            return
+        # Tables changed while the query ran: the result may already be stale
+        if versions != self._snapshot(versions):
+            return
+        result = done.result()
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = {"result": result, "versions": versions, "size": size, "stored_at": time.monotonic()}
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
+
+    async def _ensure_versions(self, tables):
+        """Probe tables seen for the first time so their entries start from a real version."""
+        missing = [t for t in tables if t not in self._versions]
+        if missing:
+            await self._probe(missing)
+
+    async def _probe(self, tables):
+        """Read current versions for tables. Returns the tables whose version changed."""
+        pool = self._pool_getter()
+        if pool is None or not tables:
+            return []
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(VERSION_SQL, list(tables))
+        except Exception as e:
+            log.warning("Error probing table versions: %s", e)
+            return []
+        current = {t: None for t in tables}
+        current.update({r[0]: tuple(r[1:]) for r in rows})
+        changed = [t for t, v in current.items() if t in self._versions and self._versions[t] != v]
+        self._versions.update(current)
+        return changed
+
+    async def _watch(self):
+        if self.channel:
+            await self._listen()
+        if self.poll_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for table in await self._probe(sorted(self._versions)):
+                self.invalidate(table)
+
+    async def _listen(self):
+        pool = self._pool_getter()
+        if pool is None:
+            return
+        try:
+            self._listen_conn = await pool.acquire()
+            await self._listen_conn.add_listener(self.channel, self._on_notify)
+        except Exception as e:
+            log.warning("Error listening on %s: %s", self.channel, e)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        """NOTIFY payload: the changed table's name, or empty for all tables."""
+        tables = [payload] if payload else list(set(self._versions) | set(self._epochs))
+        for table in tables:
+            self._epochs[table] = self._epochs.get(table, 0) + 1
+            self.invalidate(table)
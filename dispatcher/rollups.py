@@ -0,0 +1,283 @@
+"""
+Declared rollups: pre-aggregated partial states that answer matching queries
+without fanning out over the base tables.
+
+A rollup is declared as an aggregate query over the tables it covers, e.g.
+
+    {"name": "sales_by_category",
+     "sql": "SELECT p.category, o.status, SUM(oi.quantity), SUM(oi.unit_price * oi.quantity), COUNT(*)
+             FROM order_items oi JOIN products p ON p.product_id = oi.product_id
+             JOIN orders o ON o.order_id = oi.order_id GROUP BY p.category, o.status"}
+
+The dispatcher plans it like a query and keeps, per block of the partition
+column, the partial aggregate states the workers return (AVG as SUM + COUNT,
+COUNT(DISTINCT) as a sketch), plus their merge over all blocks. Blocks are
+refreshed in the background: when only the partition table changed and it is
+declared append-only (PARTIAL_CACHE_TABLES), just the blocks from the
+previous top block upwards are re-run; any other change rebuilds the rollup.
+
+An aggregate query matches a rollup when it reads the same tables with the
+same joins, groups by rollup dimensions only, needs only partial states the
+rollup keeps and filters (WHERE) on dimensions only. Its partial rows are
+then read from the rollup's merged states and merged again into the query's
+coarser groups; HAVING, ORDER BY and LIMIT apply as usual. When only inserts
+reached the append-only partition table since the last refresh, the closed
+blocks come from the rollup and the open top range is read live, so answers
+stay exact between refreshes; other changes make the rollup stale until its
+next refresh and queries fan out meanwhile.
+
+Dimensions are matched as expressions, so a date bucket such as
+DATE_TRUNC('month', o.order_date) matches when the rollup groups by the same
+expression. Table aliases don't matter: columns are compared by table name.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+from prometheus_client import Counter, Gauge
+from sqlglot import exp
+
+log = logging.getLogger("dispatcher.rollups")
+
+ROLLUP_LOOKUPS = Counter("dispatcher_rollup_lookups_total", "Aggregate queries matching a rollup, by outcome", ["rollup", "result"])
+ROLLUP_REFRESHES = Counter("dispatcher_rollup_refreshes_total", "Background rollup refreshes", ["rollup", "kind"])
+ROLLUP_ROWS = Gauge("dispatcher_rollup_rows", "Merged groups held per rollup", ["rollup"])
+
+
+def load_definitions(path):
+    """[{'name', 'sql'}] from a JSON file (a list of objects, or {"rollups": [...]})."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("rollups", [])
+    definitions = []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict) or not item.get("sql"):
+            raise ValueError(f"rollup #{i} needs a \"sql\" field")
+        definitions.append({'name': str(item.get("name") or f"rollup{i}"), 'sql': item["sql"]})
+    return definitions
+
+
+def sources(select):
+    """Alias -> table name of the FROM and JOIN tables, or None unless they are distinct plain tables."""
+    from_clause = select.args.get("from") or select.args.get("from_")
+    tables = [from_clause.this if from_clause else None] + [join.this for join in select.args.get("joins") or []]
+    if not all(isinstance(t, exp.Table) and not t.args.get("sample") for t in tables):
+        return None
+    aliases = {t.alias_or_name: t.name for t in tables}
+    if len(set(aliases.values())) != len(tables):
+        # Self-joins: columns can't be told apart by table name
+        return None
+    return aliases
+
+
+def canonical(node, aliases, dialect):
+    """
+    SQL of node with every column qualified by its table's name instead of an
+    alias (unqualified columns too when a single table is read), and the
+    sides of column = column comparisons in a fixed order.
+    """
+    only = next(iter(aliases.values())) if len(aliases) == 1 else None
+
+    def qualify(n):
+        if isinstance(n, exp.Column) and not isinstance(n.this, exp.Star):
+            table = aliases.get(n.table) if n.table else only
+            name = n.this.this if n.this.quoted else n.name.lower()
+            return exp.column(exp.to_identifier(name, quoted=n.this.quoted), table=table)
+        return n
+
+    def order_sides(n):
+        if isinstance(n, exp.EQ) and isinstance(n.this, exp.Column) and isinstance(n.expression, exp.Column):
+            left, right = sorted((n.this, n.expression), key=lambda c: c.sql(dialect=dialect))
+            return exp.EQ(this=left.copy(), expression=right.copy())
+        return n
+
+    return node.copy().transform(qualify).transform(order_sides).sql(dialect=dialect)
+
+
+def source_key(select, aliases, dialect):
+    """What a query reads and how it joins, independent of table aliases."""
+    from_clause = select.args.get("from") or select.args.get("from_")
+    joins = tuple((join.side, join.kind, join.this.name,
+                   canonical(join.args["on"], aliases, dialect) if join.args.get("on") is not None else None,
+                   tuple(canonical(c, aliases, dialect) for c in join.args.get("using") or ()))
+                  for join in select.args.get("joins") or [])
+    return from_clause.this.name, joins
+
+
+def split_template(plan):
+    """(group expressions, partial state expressions) of a plan's rewritten template, in merge spec order."""
+    spec = plan['merge_spec']
+    items = [e.this if isinstance(e, exp.Alias) else e for e in plan['template'].expressions]
+    n_groups = len(spec['group_cols'])
+    return items[:n_groups], items[n_groups:n_groups + len(spec['states'])]
+
+
+def value_kind(values):
+    """'number', 'text' or 'other' for the values of one dimension (dates and timestamps are 'other')."""
+    values = [v for v in values if v is not None]
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return 'number'
+    if all(isinstance(v, str) for v in values):
+        for v in values:
+            try:
+                datetime.fromisoformat(v.replace("Z", "+00:00"))
+                return 'other'
+            except ValueError:
+                pass
+        return 'text'
+    return 'other'
+
+
+class Rollup:
+    """One declared rollup: its plan, per-block partial rows and their merged groups."""
+
+    def __init__(self, name, sql, plan, dialect):
+        self.name = name
+        self.sql = sql
+        self.plan = plan
+        template = plan['template']
+        self.aliases = sources(template)
+        if self.aliases is None:
+            raise ValueError("rollups must read plain tables (no sub-queries or self-joins)")
+        self.source = source_key(template, self.aliases, dialect)
+        spec = plan['merge_spec']
+        groups, states = split_template(plan)
+        self.dimensions = {canonical(node, self.aliases, dialect): name
+                           for node, (name, _) in zip(groups, spec['group_cols'])}
+        self.states = {(canonical(node, self.aliases, dialect), op): alias
+                       for node, (alias, op) in zip(states, spec['states'])}
+        self.blocks = {}       # block number -> partial rows (one block: the whole table)
+        self.width = None      # block width on the partition column, None for a single block
+        self.first = self.last = self.low = self.high = None
+        self.versions = None   # table -> version the blocks were read at
+        self.rows = []         # merged states over all blocks, named like the rollup's partial rows
+        self.closed = []       # merged states over the blocks below the open top block
+        self.kinds = {}        # dimension column -> value_kind()
+        self.refreshed_at = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def ready(self):
+        return self.refreshed_at is not None
+
+    def match(self, plan, dialect):
+        """
+        How plan's partial rows are read from this rollup: {'groups': [(query column, rollup column)],
+        'states': [...], 'filters': {WHERE column as written: rollup column}}, or None when it doesn't match.
+        """
+        template = plan['template']
+        aliases = sources(template)
+        if aliases is None or source_key(template, aliases, dialect) != self.source:
+            return None
+        spec = plan['merge_spec']
+        groups, states = split_template(plan)
+        mapping = {'groups': [], 'states': [], 'filters': {}}
+        for node, (name, _) in zip(groups, spec['group_cols']):
+            column = self.dimensions.get(canonical(node, aliases, dialect))
+            if column is None:
+                return None
+            mapping['groups'].append((name, column))
+        for node, (alias, op) in zip(states, spec['states']):
+            column = self.states.get((canonical(node, aliases, dialect), op))
+            if column is None:
+                return None
+            mapping['states'].append((alias, column))
+        where = template.args.get("where")
+        for node in (where.find_all(exp.Column) if where is not None else []):
+            key = canonical(node, aliases, dialect)
+            if key not in self.dimensions:
+                return None
+            mapping['filters'][node.sql(dialect=dialect)] = self.dimensions[key]
+        if where is not None and (where.find(exp.Select) or where.find(exp.AggFunc)):
+            return None
+        return mapping
+
+    def partial_rows(self, mapping, predicate=None, closed=False):
+        """
+        The rollup's merged groups (only those of the closed blocks when closed)
+        as partial rows of the matched query, filtered by predicate(row).
+        """
+        pairs = mapping['groups'] + mapping['states']
+        rows = self.closed if closed else self.rows
+        if predicate is not None:
+            rows = [row for row in rows if predicate(row) is True]
+        return [{name: row[column] for name, column in pairs} for row in rows]
+
+    def publish(self, blocks, rows, closed, versions, bounds):
+        """Swap in a refreshed state; bounds: (width, first block, last block, low, high) or all None."""
+        self.blocks, self.rows, self.closed, self.versions = blocks, rows, closed, versions
+        self.width, self.first, self.last, self.low, self.high = bounds
+        self.kinds = {column: value_kind([row[column] for row in rows]) for column in self.dimensions.values()}
+        self.refreshed_at = time.time()
+        ROLLUP_ROWS.labels(rollup=self.name).set(len(rows))
+
+    def status(self):
+        return {"name": self.name, "ready": self.ready, "table": self.plan['table'],
+                "partition_column": self.plan['partition_col'] if self.width else None,
+                "blocks": len(self.blocks), "block_width": self.width, "groups": len(self.rows),
+                "refreshed_at": self.refreshed_at, "dimensions": sorted(self.dimensions),
+                "states": sorted(sql for sql, _ in self.states)}
+
+
+class RollupSet:
+    """The declared rollups and the background task refreshing them."""
+
+    def __init__(self, rollups=(), refresh_interval=60.0):
+        self.rollups = list(rollups)
+        self.refresh_interval = refresh_interval
+        self._task = None
+        self._wake = asyncio.Event()
+
+    def __len__(self):
+        return len(self.rollups)
+
+    def __iter__(self):
+        return iter(self.rollups)
+
+    def get(self, name):
+        return next((r for r in self.rollups if r.name == name), None)
+
+    def match(self, plan, dialect):
+        """[(rollup, mapping)] for every rollup that can answer plan."""
+        matches = []
+        for rollup in self.rollups:
+            mapping = rollup.match(plan, dialect)
+            if mapping is not None:
+                matches.append((rollup, mapping))
+        return matches
+
+    def wake(self):
+        """Refresh now instead of at the next interval (a lookup found a rollup stale)."""
+        self._wake.set()
+
+    def start(self, refresh):
+        """Run refresh(rollup) for every rollup now and then every refresh_interval."""
+        if self.rollups and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(refresh))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self, refresh):
+        while True:
+            self._wake.clear()
+            for rollup in self.rollups:
+                try:
+                    kind = await refresh(rollup)
+                except Exception as e:
+                    kind = "error"
+                    log.warning("Error refreshing rollup %s: %s", rollup.name, e)
+                ROLLUP_REFRESHES.labels(rollup=rollup.name, kind=kind).inc()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,101 @@
+"""
+Compact worker result format.
+
+The JSON format, {"rows": [{col: val, ...}, ...]}, repeats every column name
+on every row, and decoding it builds one dict per row. When the dispatcher
+asks for COMPACT_TYPE in its Accept header, the worker answers with
+{"columns": [...], "rows": [[...], ...]}: names once, then one value array per
+row. Those arrays are kept as they came off the wire in a RowBatch; the merge
+functions read columns from it by position, and dicts are only built for the
+rows the dispatcher actually returns (e.g. after ORDER BY/LIMIT).
+
+Workers that don't know the compact format keep answering plain JSON, which
+decodes to a list of dicts as before. Merge code accepts either through
+column() and records(). orjson is used for decoding when installed.
+"""
+import json
+from collections.abc import Sequence
+from itertools import repeat
+from operator import itemgetter
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+COMPACT_TYPE = "application/x-parallax-rows+json"
+ACCEPT = f"{COMPACT_TYPE}, application/json;q=0.5"
+
+
+class RowBatch(Sequence):
+    """One worker response in compact form: column names plus a value list per row."""
+
+    __slots__ = ("columns", "values", "index")
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+        self.index = {name: i for i, name in enumerate(columns)}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [dict(zip(self.columns, row)) for row in self.values[i]]
+        return dict(zip(self.columns, self.values[i]))
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.values:
+            yield dict(zip(columns, row))
+
+    def column(self, name):
+        i = self.index.get(name)
+        if i is None:
+            return [None] * len(self.values)
+        return list(map(itemgetter(i), self.values))
+
+    def records(self, names):
+        """Iterator of value tuples for names, one per row (None for missing columns)."""
+        positions = [self.index.get(name) for name in names]
+        if None in positions:
+            return (tuple([row[i] if i is not None else None for i in positions]) for row in self.values)
+        if len(positions) == 1:
+            i = positions[0]
+            return ((row[i],) for row in self.values)
+        if not positions:
+            return repeat((), len(self.values))
+        return map(itemgetter(*positions), self.values)
+
+
+def loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def decode_rows(content_type, body):
+    """Rows of one worker response: a RowBatch for the compact format, a list of dicts for JSON."""
+    payload = loads(body)
+    if content_type.startswith(COMPACT_TYPE):
+        return RowBatch(payload["columns"], payload["rows"] or [])
+    return payload["rows"] or []
+
+
+def column(rows, name):
+    """One column of a row list or RowBatch as a list."""
+    if isinstance(rows, RowBatch):
+        return rows.column(name)
+    try:
+        return list(map(itemgetter(name), rows))
+    except KeyError:
+        return [row.get(name) for row in rows]
+
+
+def records(rows, names):
+    """Value tuples for names, one per row, from a row list or RowBatch."""
+    if isinstance(rows, RowBatch):
+        return rows.records(names)
+    if len(names) > 1 and rows and all(name in rows[0] for name in names):
+        # Worker rows all have the same keys
+        return map(itemgetter(*names), rows)
+    return (tuple([row.get(name) for name in names]) for row in rows)
@@ -0,0 +1,108 @@
+"""
+Approximate aggregates from a sample of the partitioned table.
+
+With "approximate": {"fraction": 0.01} every sub-query reads the
+partitioned table through TABLESAMPLE, so workers and Postgres touch a
+fraction of the rows. Merged COUNT and SUM are scaled by 1/fraction
+(Horvitz-Thompson estimates); AVG is the ratio of the scaled SUM and COUNT
+and needs no scaling. MIN and MAX come from the sampled rows as they are.
+
+Each estimated COUNT, SUM and AVG is returned with a normal-approximation
+confidence interval. The variance comes from the merged partial states plus
+a SUM(x * x) state per SUM/AVG argument. The formulas assume every row was
+sampled independently, which is what BERNOULLI does. SYSTEM samples whole
+pages: it is cheaper (unsampled pages are never read), but when values
+cluster by page its real error is wider than the interval says. The same
+applies to joins in which each sampled row of the partitioned table brings
+several joined rows.
+"""
+from statistics import NormalDist
+
+from sqlglot import exp
+
+METHODS = ("bernoulli", "system")
+
+
+def parse_options(value):
+    """
+    Validate the payload's "approximate" option.
+    Returns {'fraction', 'method', 'confidence', 'seed', 'z'}, or None for an exact answer
+    (option absent or fraction 1). Raises ValueError with a message for the client.
+    """
+    if value is None or value is False:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError('"approximate" must be an object like {"fraction": 0.01}')
+    try:
+        fraction = float(value["fraction"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('"approximate" needs a numeric "fraction" between 0 and 1') from None
+    if not 0 < fraction <= 1:
+        raise ValueError('"approximate.fraction" must be greater than 0 and at most 1')
+    method = str(value.get("method", "bernoulli")).lower()
+    if method not in METHODS:
+        raise ValueError(f'"approximate.method" must be one of {", ".join(METHODS)}')
+    try:
+        confidence = float(value.get("confidence", 0.95))
+    except (TypeError, ValueError):
+        confidence = None
+    if confidence is None or not 0 < confidence < 1:
+        raise ValueError('"approximate.confidence" must be between 0 and 1')
+    seed = value.get("seed")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+        raise ValueError('"approximate.seed" must be an integer')
+    if fraction == 1:
+        return None
+    return {'fraction': fraction, 'method': method, 'confidence': confidence, 'seed': seed,
+            'z': NormalDist().inv_cdf(0.5 + confidence / 2)}
+
+
+def apply_sample(select, table, options):
+    """Read the first reference to table in select through TABLESAMPLE. Returns False if there is none."""
+    for node in select.find_all(exp.Table):
+        if node.name == table and node.find_ancestor(exp.Select) is select:
+            node.set("sample", exp.TableSample(
+                method=exp.var(options['method'].upper()),
+                percent=exp.Literal.number(f"{options['fraction'] * 100:.10g}"),
+                seed=exp.Literal.number(options['seed']) if options['seed'] is not None else None,
+            ))
+            return True
+    return False
+
+
+def squares_state(arg):
+    """SUM(x * x) in double precision, so integer columns can't overflow."""
+    value = exp.Cast(this=arg.copy(), to=exp.DataType.build("double"))
+    return exp.Sum(this=exp.Mul(this=value, expression=value.copy()))
+
+
+def estimate(func, acc, slots, square_slot, options):
+    """(estimate, [low, high] or None) for one aggregate of a merged sampled group."""
+    f, z = options['fraction'], options['z']
+    if func == 'min' or func == 'max':
+        return acc[slots[0]], None
+    try:
+        if func == 'count':
+            n = acc[slots[0]] or 0
+            half = z * ((1 - f) * n) ** 0.5 / f
+            value = round(n / f)
+            return value, [max(0.0, value - half), value + half]
+        if func == 'sum':
+            total, squares = acc[slots[0]], acc[square_slot]
+            if total is None:
+                return None, None
+            value = float(total) / f
+            half = z * ((1 - f) * float(squares)) ** 0.5 / f
+            return value, [value - half, value + half]
+        # avg: ratio of the two scaled states; linearized variance of the ratio
+        total, count, squares = acc[slots[0]], acc[slots[1]], acc[square_slot]
+        if not count or total is None:
+            return None, None
+        total, squares = float(total), float(squares)
+        value = total / count
+        spread = max(0.0, squares - 2 * value * total + value * value * count)
+        half = z * ((1 - f) * spread) ** 0.5 / count
+        return value, [value - half, value + half]
+    except (TypeError, ValueError):
+        # Non-numeric states (e.g. strings from a worker): no interval
+        return acc[slots[0]], None
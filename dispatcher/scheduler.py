@@ -0,0 +1,120 @@
+"""
+Worker-aware scheduling of sub-queries.
+
+Posting every sub-query to one Service URL lets kube-proxy spread them
+without knowing how big each partition is or how busy each pod already is.
+The scheduler keeps its own view of the worker pods (the A records of a
+headless Service, or a static list of URLs) and picks a worker per
+sub-query. A worker's load is the estimated cost (rows to scan) of the
+sub-queries it is running; the pick is least-outstanding-work or
+power-of-two-choices over that load, the same strategies as the Go
+balancer's least_load.go and p2c.go, with a latency EWMA as tie breaker.
+"""
+import asyncio
+import logging
+import random
+import socket
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from prometheus_client import Gauge, Histogram
+
+log = logging.getLogger("dispatcher.scheduler")
+
+WORKER_OUTSTANDING = Gauge("dispatcher_worker_outstanding_subqueries", "Sub-queries running on each worker", ["worker"])
+WORKER_OUTSTANDING_COST = Gauge("dispatcher_worker_outstanding_cost", "Estimated rows being scanned on each worker", ["worker"])
+WORKER_LATENCY = Histogram("dispatcher_worker_subquery_seconds", "Sub-query latency per worker", ["worker"])
+
+LATENCY_EWMA_WEIGHT = 0.2
+
+
+class Worker:
+    """One worker endpoint and the work the dispatcher currently has on it."""
+
+    __slots__ = ("url", "outstanding", "cost", "latency")
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.cost = 0.0
+        self.latency = None
+
+
+class WorkerScheduler:
+    """Picks a worker per sub-query by outstanding estimated cost ("p2c" or "least")."""
+
+    def __init__(self, service_url, endpoints=(), dns_name="", dns_ttl=10.0, strategy="p2c"):
+        self.service_url = service_url
+        self.dns_name = dns_name
+        self.dns_ttl = dns_ttl
+        self.strategy = strategy
+        self.workers = {url: Worker(url) for url in (endpoints or [service_url])}
+        self._resolved_at = float("-inf")
+
+    def __len__(self):
+        return len(self.workers)
+
+    @property
+    def discovered(self):
+        """Number of individually addressable workers (0 while only the Service URL is known)."""
+        return 0 if list(self.workers) == [self.service_url] else len(self.workers)
+
+    async def refresh(self):
+        """Re-resolve the headless Service when its records are older than dns_ttl."""
+        now = time.monotonic()
+        if not self.dns_name or now - self._resolved_at < self.dns_ttl:
+            return
+        self._resolved_at = now
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(self.dns_name, None, type=socket.SOCK_STREAM)
+        except OSError as e:
+            log.warning("Error resolving %s: %s", self.dns_name, e)
+            return
+        urls = {self._pod_url(info[4][0]) for info in infos}
+        if not urls:
+            return
+        for url in urls - set(self.workers):
+            self.workers[url] = Worker(url)
+        for url in set(self.workers) - urls:
+            # Sub-queries already running there still release the Worker object they hold
+            del self.workers[url]
+            for metric in (WORKER_OUTSTANDING, WORKER_OUTSTANDING_COST):
+                try:
+                    metric.remove(url)
+                except KeyError:
+                    pass
+
+    def acquire(self, cost=1.0, avoid=()):
+        """Pick a worker for a sub-query of the given cost, preferring workers not in avoid."""
+        candidates = [w for w in self.workers.values() if w.url not in avoid] or list(self.workers.values())
+        if self.strategy == "least" or len(candidates) <= 2:
+            worker = min(candidates, key=self._load)
+        else:
+            worker = min(random.sample(candidates, 2), key=self._load)
+        worker.outstanding += 1
+        worker.cost += cost
+        WORKER_OUTSTANDING.labels(worker=worker.url).set(worker.outstanding)
+        WORKER_OUTSTANDING_COST.labels(worker=worker.url).set(worker.cost)
+        return worker
+
+    def release(self, worker, cost=1.0, elapsed=None):
+        """Return a sub-query's slot; elapsed (seconds) updates the latency estimate when it succeeded."""
+        worker.outstanding -= 1
+        worker.cost = max(0.0, worker.cost - cost)
+        if elapsed is not None:
+            worker.latency = elapsed if worker.latency is None else \
+                (1 - LATENCY_EWMA_WEIGHT) * worker.latency + LATENCY_EWMA_WEIGHT * elapsed
+            WORKER_LATENCY.labels(worker=worker.url).observe(elapsed)
+        if worker.url in self.workers:
+            WORKER_OUTSTANDING.labels(worker=worker.url).set(worker.outstanding)
+            WORKER_OUTSTANDING_COST.labels(worker=worker.url).set(worker.cost)
+
+    @staticmethod
+    def _load(worker):
+        return worker.cost, worker.latency or 0.0
+
+    def _pod_url(self, ip):
+        parts = urlsplit(self.service_url)
+        host = f"[{ip}]" if ":" in ip else ip
+        netloc = f"{host}:{parts.port}" if parts.port else host
+        return urlunsplit((parts.scheme, netloc, parts.path, parts.query, ""))
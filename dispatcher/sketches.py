@@ -0,0 +1,141 @@
+"""
+Mergeable per-partition summaries for COUNT(DISTINCT x) and percentiles.
+
+Distinct counts can't be added across partitions: a value seen in two
+partitions would count twice. Each partition instead returns a KMV ("k
+minimum values") sketch, the k smallest distinct 64-bit hashes of x, which
+plain Postgres computes with array_agg; the union of the partition sketches
+cut back to the k smallest is the sketch of the whole table. Below k
+distinct values the count is exact, above it the estimate (k - 1) / h_k
+(h_k: the k-th smallest hash scaled to (0, 1]) has a relative standard
+error of about 1 / sqrt(k - 2), 3% for k = 1024. The exact alternative
+ships every distinct value (array_agg(DISTINCT x)) and counts their union;
+it is only sensible for small cardinalities.
+
+PERCENTILE_CONT and PERCENTILE_DISC WITHIN GROUP (ORDER BY x) become an
+equi-depth summary per partition, the q + 1 quantiles at 0, 1/q, ..., 1
+(one percentile_cont/percentile_disc call with an array of fractions), plus
+count(x). The merged answer is read off the sum of the partitions'
+piecewise-linear rank functions; its rank error is below 1/q of the rows.
+Answers at a multiple of 1/q from a single partition are exact.
+
+A query that runs as a single sub-query needs no merge, so the dispatcher
+sends its original aggregates then. Merged estimates are named in the
+response ("approximate": {"sketched": [...]}).
+"""
+import math
+from bisect import bisect_left, bisect_right
+
+from sqlglot import exp
+
+HASH_SPACE = 2 ** 64
+
+
+def kmv_state(arg, size):
+    """The size smallest distinct hashes of arg, ascending: (array_agg(DISTINCT h ORDER BY h))[1:size]."""
+    digest = exp.Anonymous(this="hashtextextended", expressions=[
+        exp.Cast(this=arg.copy(), to=exp.DataType.build("text")), exp.Literal.number(0)])
+    hashes = exp.ArrayAgg(this=exp.Order(this=exp.Distinct(expressions=[digest]),
+                                         expressions=[exp.Ordered(this=digest.copy(), nulls_first=False)]))
+    return exp.Bracket(this=exp.Paren(this=hashes),
+                       expressions=[exp.Slice(this=exp.Literal.number(1), expression=exp.Literal.number(size))])
+
+
+def values_state(arg):
+    """Every distinct value of arg: array_agg(DISTINCT arg)."""
+    return exp.ArrayAgg(this=exp.Distinct(expressions=[arg.copy()]))
+
+
+def quantiles_state(func, arg, resolution):
+    """percentile_cont/percentile_disc(ARRAY[0, 1/q, ..., 1]) WITHIN GROUP (ORDER BY arg), q = resolution."""
+    fractions = exp.Array(expressions=[exp.Literal.number(f"{j / resolution:.10g}") for j in range(resolution + 1)])
+    node = exp.PercentileCont if func == 'percentile_cont' else exp.PercentileDisc
+    return exp.WithinGroup(this=node(this=fractions),
+                           expression=exp.Order(expressions=[exp.Ordered(this=arg.copy(), nulls_first=False)]))
+
+
+def merge_kmv(current, value, size):
+    """Union of two KMV sketches, cut back to the size smallest hashes."""
+    merged = set(current).union(value)
+    merged.discard(None)  # array_agg keeps a NULL argument; it sorts last, so only short sketches carry one
+    return sorted(merged)[:size]
+
+
+def merge_values(current, value):
+    """Union of two distinct-value lists."""
+    return list(set(current).union(value))
+
+
+def count_distinct(state, size=None):
+    """Final distinct count from a merged state: exact for value lists (size None), estimated from a KMV sketch."""
+    if not state:
+        return 0
+    values = [v for v in state if v is not None]
+    if size is None or len(values) < size:
+        # Fewer hashes than the sketch holds: every distinct value is in it
+        return len(values)
+    kth = (max(values) + HASH_SPACE // 2 + 1) / HASH_SPACE
+    return round((size - 1) / kth)
+
+
+def percentile(func, fraction, summaries, counts):
+    """
+    Merged PERCENTILE_CONT/PERCENTILE_DISC(fraction) from per-partition quantile
+    summaries and their row counts (parallel lists, one entry per partition).
+    None when no partition had a non-null value, or when PERCENTILE_CONT
+    values can't be interpolated (non-numeric).
+    """
+    parts = [(summary, n) for summary, n in zip(summaries, counts) if summary and n]
+    if not parts:
+        return None
+    total = sum(n for _, n in parts)
+    points = sorted(set().union(*(s for s, _ in parts)))
+    try:
+        if func == 'percentile_disc':
+            target = max(1, math.ceil(fraction * total))
+            return points[first_reaching(points, lambda v: sum(disc_rows(s, n, v) for s, n in parts), target)]
+        # PERCENTILE_CONT: position fraction * (rows - 1), interpolated between neighbouring points
+        def position(v, left=False):
+            return sum(cont_rows(s, n, v, left) for s, n in parts) - 1
+        target = fraction * (total - 1)
+        i = first_reaching(points, position, target)
+        if i == 0:
+            return points[0]
+        low, high = points[i - 1], points[i]
+        start, end = position(low), position(high, left=True)
+        if target >= end:
+            return high
+        return low + (target - start) / (end - start) * (high - low)
+    except TypeError:
+        return None
+
+
+def first_reaching(points, rows, target):
+    """Index of the smallest sorted point whose rows(point) reaches target (the last point if none does)."""
+    return min(bisect_left(points, True, key=lambda v: rows(v) >= target), len(points) - 1)
+
+
+def cont_rows(summary, n, v, left=False):
+    """
+    Rows of a partition at or below v (strictly below when left), counting
+    fractional rows between summary points; summary holds the quantiles at
+    0, 1/q, ..., 1 of its n rows, i.e. the values at positions j * (n - 1) / q.
+    """
+    q = len(summary) - 1
+    j = (bisect_left(summary, v) if left else bisect_right(summary, v)) - 1
+    if j < 0:
+        return 0
+    if j == q:
+        return n
+    return (j + (v - summary[j]) / (summary[j + 1] - summary[j])) * (n - 1) / q + 1
+
+
+def disc_rows(summary, n, v):
+    """Rows of a partition at or below v that its summary vouches for (a lower bound between summary points)."""
+    q = len(summary) - 1
+    j = bisect_right(summary, v) - 1
+    if j < 0:
+        return 0
+    if j == q:
+        return n
+    return max(1, math.ceil(j * n / q))
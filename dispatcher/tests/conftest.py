@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+# The dispatcher's modules import each other by flat name (uvicorn main:app runs from this directory)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeConnection:
+    """asyncpg connection stand-in answering fetch/fetchval/fetchrow from a handler(method, sql, args)."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queries = []
+
+    async def fetch(self, sql, *args):
+        self.queries.append(sql)
+        return self.handler("fetch", sql, args)
+
+    async def fetchval(self, sql, *args):
+        self.queries.append(sql)
+        return self.handler("fetchval", sql, args)
+
+    async def fetchrow(self, sql, *args):
+        self.queries.append(sql)
+        return self.handler("fetchrow", sql, args)
+
+
+class FakePool:
+    """asyncpg pool stand-in with a single FakeConnection."""
+
+    def __init__(self, handler):
+        self.conn = FakeConnection(handler)
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+        return Acquire()
+
+
+@pytest.fixture
+def fake_pool():
+    return FakePool
+
+
+class FakeCatalog:
+    """
+    StatsCatalog stand-in: the same statistics for every column (None without
+    low/high), columns[(table, column)] overriding them, and fixed key columns.
+    """
+
+    def __init__(self, low=None, high=None, histogram=None, rows=None, keys=(), columns=None, type=None):
+        self.stats = None
+        if low is not None:
+            self.stats = {"low": low, "high": high, "histogram": histogram, "type": type,
+                          "row_estimate": rows if rows is not None else high - low + 1}
+        self.keys = list(keys)
+        self.columns = columns or {}
+        self.lookups = []
+
+    async def get(self, table, column):
+        self.lookups.append((table, column))
+        return self.columns.get((table, column), self.stats)
+
+    async def key_columns(self, table):
+        return self.keys
+
+
+@pytest.fixture
+def fake_catalog(monkeypatch):
+    """Install FakeCatalog(*args, **kwargs) as the dispatcher's statistics catalog and return it."""
+    import main
+
+    def install(*args, **kwargs):
+        catalog = FakeCatalog(*args, **kwargs)
+        monkeypatch.setattr(main, "stats_catalog", catalog)
+        return catalog
+    return install
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import main
+from admission import AdmissionController, Overloaded
+
+
+def test_grant_is_capped_by_the_per_client_limit():
+    async def go():
+        control = AdmissionController(max_inflight=10, per_client=3)
+        grant = await control.acquire("a", "interactive", 8)
+        assert (grant.slots, control.inflight, control.cap("interactive")) == (3, 3, 3)
+        control.release(grant)
+        assert control.inflight == 0
+    asyncio.run(go())
+
+
+def test_batch_queries_fill_only_their_share():
+    control = AdmissionController(max_inflight=8, batch_share=0.5)
+    assert (control.cap("interactive"), control.cap("batch")) == (8, 4)
+    assert AdmissionController(max_inflight=0).cap("batch") is None
+
+
+def test_waiters_are_admitted_interactive_first():
+    async def go():
+        control = AdmissionController(max_inflight=2, queue_timeout=1)
+        held = await control.acquire("a", "interactive", 2)
+        order = []
+
+        async def wait(priority):
+            grant = await control.acquire(priority, priority, 2)
+            order.append(priority)
+            control.release(grant)
+        waiters = [asyncio.ensure_future(wait("batch")), asyncio.ensure_future(wait("interactive"))]
+        await asyncio.sleep(0)
+        assert control.queued == 2
+        control.release(held)
+        await asyncio.gather(*waiters)
+        return order
+    assert asyncio.run(go()) == ["interactive", "batch"]
+
+
+def test_full_queue_sheds_batch_before_interactive():
+    async def go():
+        control = AdmissionController(max_inflight=1, queue_size=1, queue_timeout=1)
+        held = await control.acquire("a")
+        batch = asyncio.ensure_future(control.acquire("b", "batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(control.acquire("c", "interactive"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as displaced:
+            await batch
+        with pytest.raises(Overloaded) as full:
+            await control.acquire("d", "batch")
+        control.release(held)
+        control.release(await interactive)
+        return displaced.value.reason, full.value.reason, control.inflight
+    assert asyncio.run(go()) == ("displaced", "queue_full", 0)
+
+
+def test_waiter_times_out():
+    async def go():
+        control = AdmissionController(max_inflight=1, queue_timeout=0.01)
+        await control.acquire("a")
+        with pytest.raises(Overloaded) as e:
+            await control.acquire("b")
+        return e.value.reason, control.queued
+    assert asyncio.run(go()) == ("timeout", 0)
+
+
+def test_try_acquire_takes_only_free_slots():
+    async def go():
+        control = AdmissionController(max_inflight=4, per_client=3)
+        await control.acquire("a", "interactive", 2)
+        extra = control.try_acquire("a", "interactive", 5)
+        assert extra.slots == 1
+        assert control.try_acquire("a", "interactive", 1) is None
+        assert control.try_acquire("b", "interactive", 5).slots == 1
+        assert control.try_acquire("c", "interactive", 1) is None
+    asyncio.run(go())
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """fetch_partition() stand-in recording how many sub-queries run at once; delays[sql] slows one down."""
+    state = {'running': 0, 'peak': 0, 'calls': [], 'delays': {}}
+
+    async def fetch_partition(sql, worker, cost=1.0):
+        state['calls'].append(sql)
+        state['running'] += 1
+        state['peak'] = max(state['peak'], state['running'])
+        try:
+            await asyncio.sleep(state['delays'].get(sql, 0.02))
+            return [{"sql": sql}]
+        finally:
+            state['running'] -= 1
+            main.worker_scheduler.release(worker, cost)
+
+    monkeypatch.setattr(main, "fetch_partition", fetch_partition)
+    monkeypatch.setattr(main, "subquery_latency", main.LatencyWindow())
+    return state
+
+
+def run_partitions(partitions, plan=None, client="c"):
+    return asyncio.run(main.run_partitions(partitions, plan, None, client, "interactive"))
+
+
+def test_no_more_partitions_run_at_once_than_were_granted(workers, monkeypatch):
+    monkeypatch.setattr(main, "admission", AdmissionController(max_inflight=10, per_client=2))
+    results = run_partitions([{'sql': f"q{i}", 'col': None} for i in range(5)])
+    assert [rows[0][0]["sql"] for rows in results] == [f"q{i}" for i in range(5)]
+    assert workers['peak'] == 2
+    assert main.admission.inflight == 0
+
+
+def test_hedge_needs_a_free_slot(workers, monkeypatch):
+    monkeypatch.setattr(main, "admission", AdmissionController(max_inflight=1))
+    monkeypatch.setattr(main, "HEDGE_MIN_SAMPLES", 1)
+    main.subquery_latency.add(0.001)
+    workers['delays']['q'] = 0.1
+    run_partitions([{'sql': "q", 'col': None}])
+    assert workers['calls'] == ["q"]
+
+    monkeypatch.setattr(main, "admission", AdmissionController(max_inflight=2))
+    main.subquery_latency = main.LatencyWindow()
+    main.subquery_latency.add(0.001)
+    run_partitions([{'sql': "q", 'col': None}])
+    assert workers['calls'] == ["q", "q", "q"]
+    assert main.admission.inflight == 0
+
+
+def test_resplit_ranges_run_in_the_slots_that_are_free(workers, monkeypatch):
+    monkeypatch.setattr(main, "admission", AdmissionController(max_inflight=2))
+    monkeypatch.setattr(main, "SUBQUERY_TIMEOUT", 0.05)
+    monkeypatch.setattr(main, "RESPLIT_WAYS", 4)
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    part = main.make_partition(plan, None, "id", 0, 100, False, 0, 100)
+    workers['delays'][part['sql']] = 1.0
+    results = run_partitions([part], plan)
+    assert len(results[0]) == 4
+    assert workers['peak'] == 2
+    assert main.admission.inflight == 0
+
+
+def test_split_is_capped_by_the_slots_a_query_can_hold(monkeypatch, fake_catalog):
+    fake_catalog(1, 1000000, keys=["id"])
+    monkeypatch.setattr(main, "SPLIT_MIN_COST", 0)
+    monkeypatch.setattr(main, "MAX_PARTS", 8)
+    monkeypatch.setattr(main, "ROWS_PER_PART", 1000)
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    assert len(asyncio.run(main.make_subqueries(plan, None))) == 8
+    assert len(asyncio.run(main.make_subqueries(plan, None, max_parts=3))) == 3
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlglot.errors import ParseError
+from starlette.requests import Request
+
+import batch
+import main
+
+
+def planned(sql):
+    plan, literals, _ = main.plan_query(sql)
+    return plan, main.bound_where(plan, literals)
+
+
+def share_key(sql):
+    return batch.share_key(*planned(sql), main.SQL_DIALECT)
+
+
+def test_statements_differing_in_aggregates_share_a_key():
+    key = share_key("SELECT grp, COUNT(*) AS n FROM numbers WHERE id > 5 GROUP BY grp")
+    assert key is not None
+    assert share_key("SELECT grp, SUM(val) AS s FROM numbers WHERE id > 5 GROUP BY grp ORDER BY s DESC LIMIT 1") == key
+    assert share_key("SELECT grp, COUNT(*) AS n FROM numbers WHERE id > 6 GROUP BY grp") != key
+    assert share_key("SELECT id, val FROM numbers WHERE id > 5") is None
+
+
+def test_combined_plans_read_each_state_once():
+    plans = [planned(sql)[0] for sql in ("SELECT grp, COUNT(*) AS n, SUM(val) AS s FROM numbers GROUP BY grp",
+                                         "SELECT grp, AVG(val) AS a FROM numbers GROUP BY grp HAVING COUNT(*) > 1")]
+    combined, specs = batch.combine_plans(plans, main.SQL_DIALECT)
+    assert combined['template'].sql(dialect=main.SQL_DIALECT) == (
+        "SELECT grp, COUNT(*) AS __b0, SUM(val) AS __b1, COUNT(val) AS __b2 FROM numbers GROUP BY grp")
+    assert combined['merge_spec'] is None and combined['unsplit'] is None
+    parts = [[{"grp": "x", "__b0": 2, "__b1": 6.0, "__b2": 2}, {"grp": "y", "__b0": 1, "__b1": 1.0, "__b2": 1}],
+             [{"grp": "x", "__b0": 1, "__b1": 3.0, "__b2": 1}]]
+    assert main.finish_aggregate(plans[0], parts, specs[0]) == [{"grp": "x", "n": 3, "s": 9.0}, {"grp": "y", "n": 1, "s": 1.0}]
+    assert main.finish_aggregate(plans[1], parts, specs[1]) == [{"grp": "x", "a": 3.0}]
+
+
+def test_errors_map_to_statuses():
+    assert main.batch_error(HTTPException(status_code=429, detail="busy")) == {"error": "busy", "status": 429}
+    assert main.batch_error(ParseError("bad"))["status"] == 400
+    assert main.batch_error(RuntimeError("boom")) == {"error": "boom", "status": 500}
+    assert main.http_error(RuntimeError("boom")) is None
+
+
+def request():
+    return Request({"type": "http", "headers": []})
+
+
+INVALID = "SELECT FROM WHERE ("
+
+
+def test_invalid_sql_is_a_400_on_every_endpoint():
+    with pytest.raises(HTTPException) as single:
+        asyncio.run(main.dispatch({"sql": INVALID}, request(), Response()))
+    with pytest.raises(HTTPException) as explained:
+        asyncio.run(main.explain({"sql": INVALID}))
+    answer = asyncio.run(main.dispatch_batch({"queries": [INVALID, {"sql": ""}]}, request(), Response()))
+    assert single.value.status_code == explained.value.status_code == 400
+    assert answer["results"][0] == {"error": single.value.detail, "status": 400}
+    assert answer["results"][1] == {"error": "Missing `sql` field", "status": 400}
@@ -0,0 +1,52 @@
+import os
+import sys
+
+# The benchmark suite is the bench package at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from bench import datagen, loadgen, mock_worker  # noqa: E402
+
+
+def test_datagen_writes_every_table_at_scale(tmp_path):
+    path = str(tmp_path / "bench.db")
+    datagen.write_sqlite(path, scale=0.01)
+    worker = mock_worker.MockWorker(("127.0.0.1", 0), path)
+    try:
+        for table, size in datagen.table_sizes(0.01).items():
+            columns, rows = worker.execute(f"SELECT COUNT(*) AS n FROM {table}")
+            assert columns == ["n"] and rows == [(size,)]
+        # Sampled sub-queries run through the random row filter standing in for TABLESAMPLE
+        _, rows = worker.execute("SELECT COUNT(*) FROM order_items TABLESAMPLE SYSTEM (100)")
+        assert rows == [(datagen.table_sizes(0.01)["order_items"],)]
+    finally:
+        worker.server_close()
+
+
+def test_load_queries_reads_markdown_sql_blocks(tmp_path):
+    path = tmp_path / "queries.md"
+    path.write_text("# Top Products\n```sql\nSELECT *\n  FROM products\n```\n"
+                    "## Slow\n```sql\nSELECT pg_sleep(1)\n```\n```sql\nSELECT 1\n```\n")
+    assert loadgen.load_queries(str(path)) == [("top_products", "SELECT * FROM products"), ("slow", "SELECT 1")]
+    lines = tmp_path / "queries.sql"
+    lines.write_text("-- comment\nSELECT 1\n\nSELECT 2\n")
+    assert loadgen.load_queries(str(lines)) == [("q1", "SELECT 1"), ("q2", "SELECT 2")]
+
+
+def test_latency_summary_and_metrics():
+    assert loadgen.percentile([], 50) is None
+    summary = loadgen.latency_summary([i / 1000 for i in range(1, 101)])
+    assert (summary["p50"], summary["p95"], summary["p99"], summary["max"]) == (50.0, 95.0, 99.0, 100.0)
+    text = "# HELP x\nprocess_cpu_seconds_total 12.5\nother{a=\"b\"} 1\nprocess_resident_memory_bytes 1e6\n"
+    assert loadgen.parse_metrics(text, {"process_cpu_seconds_total", "process_resident_memory_bytes"}) == {
+        "process_cpu_seconds_total": 12.5, "process_resident_memory_bytes": 1e6}
+
+
+def test_compare_reports_the_change_against_a_baseline():
+    def result(qps, p95):
+        latency = {"p50": 1.0, "p95": p95, "p99": 9.0}
+        return {"summary": {"throughput_qps": qps, "latency_ms": latency},
+                "queries": {"q1": {"latency_ms": latency}}}
+
+    lines = loadgen.compare(result(120.0, 4.0), result(100.0, 5.0))
+    assert "+20.0%" in lines[1] and "-20.0%" in lines[3] and lines[-1].split()[-1] == "-20.0%"
+    assert loadgen.change(1.0, 0) == "n/a"
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+import catalog
+from catalog import StatsCatalog
+
+
+class Database:
+    """Answers the catalog's queries; tables maps table -> {'type', 'rows', 'histogram', 'bounds', 'sample'}."""
+
+    def __init__(self, tables, keys=()):
+        self.tables = tables
+        self.keys = list(keys)
+        self.queries = []
+
+    def __call__(self, method, sql, args):
+        self.queries.append(sql)
+        table = self.tables.get(args[0]) if args and isinstance(args[0], str) else None
+        if sql == catalog.COLUMN_TYPE_SQL:
+            return table and table.get("type")
+        if sql == catalog.KEY_COLUMNS_SQL:
+            return [(column,) for column in self.keys]
+        if "FROM pg_class" in sql:
+            return {"reltuples": table["rows"], "histogram": table.get("histogram")}
+        if sql.startswith("SELECT MIN("):
+            name = sql.rsplit(" ", 1)[-1]
+            return self.tables[name].get("bounds") or (None, None)
+        if "TABLESAMPLE" in sql:
+            return next(t.get("sample") for name, t in self.tables.items() if f"FROM {name} " in sql)
+        raise AssertionError(sql)
+
+
+@pytest.fixture
+def database(fake_pool):
+    db = Database({
+        "orders": {"type": "integer", "rows": 1000, "histogram": [1, 10, 500, 1000]},
+        "fresh": {"type": "integer", "rows": 50000, "bounds": (3, 90), "sample": [3, 5, 40, 90, None]},
+        "empty": {"type": "integer", "rows": 0, "bounds": None},
+    }, keys=["id", "customer_id", "id"])
+    return db, fake_pool(db)
+
+
+def lookups(result):
+    return REGISTRY.get_sample_value("dispatcher_stats_lookups_total", {"result": result}) or 0.0
+
+
+def test_pg_stats_histograms_are_cached(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool)
+    hits, misses = lookups("hit"), lookups("miss")
+
+    async def run():
+        return await stats.get("orders", "id"), await stats.get("orders", "id")
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert (first["low"], first["high"], first["histogram"], first["row_estimate"], first["type"], first["source"]) == (
+        1, 1000, [1, 10, 500, 1000], 1000, "integer", "pg_stats")
+    assert len(db.queries) == 2
+    assert lookups("hit") - hits == 1 and lookups("miss") - misses == 1
+
+
+def test_unanalyzed_tables_fall_back_to_min_max_and_a_sample(database):
+    db, pool = database
+    entry = asyncio.run(StatsCatalog(lambda: pool, sample_rows=500).get("fresh", "id"))
+    assert (entry["low"], entry["high"], entry["histogram"], entry["source"]) == (3, 90, [3, 5, 40, 90], "probe")
+    assert any("TABLESAMPLE SYSTEM" in sql for sql in db.queries)
+
+
+def test_lookups_that_find_nothing_are_cached_briefly(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool, negative_ttl=30.0)
+    missing = lookups("missing")
+
+    async def run():
+        return [await stats.get(table, "id") for table in ("empty", "empty", "nope", "nope")]
+
+    assert asyncio.run(run()) == [None] * 4
+    assert lookups("missing") - missing == 2
+    asked = len(db.queries)
+    # Once the negative TTL is over, the table is asked again
+    for entry in stats._entries.values():
+        entry["loaded_at"] -= 31
+    assert asyncio.run(stats.get("empty", "id")) is None
+    assert len(db.queries) > asked
+
+
+def test_entries_expire_and_the_least_recently_used_is_evicted(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool, ttl=60.0, max_entries=2)
+
+    async def run():
+        await stats.get("orders", "id")
+        await stats.get("orders", "customer_id")
+        await stats.get("orders", "id")
+        await stats.get("fresh", "id")
+
+    asyncio.run(run())
+    assert list(stats._entries) == [("orders", "id"), ("fresh", "id")]
+    stats._entries[("orders", "id")]["loaded_at"] -= 61
+    expired = lookups("expired")
+    asyncio.run(stats.get("orders", "id"))
+    assert lookups("expired") - expired == 1
+
+
+def test_background_refresh_reloads_used_entries_and_drops_idle_ones(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool, ttl=300.0, refresh_interval=60.0)
+
+    async def run():
+        await stats.get("orders", "id")
+        await stats.get("fresh", "id")
+        stats._entries[("orders", "id")]["loaded_at"] -= 61
+        stats._entries[("fresh", "id")]["last_used"] -= 301
+        db.tables["orders"]["histogram"] = [1, 2000]
+        await stats._refresh_stale()
+
+    asyncio.run(run())
+    assert list(stats._entries) == [("orders", "id")]
+    assert stats._entries[("orders", "id")]["high"] == 2000
+
+
+def test_key_columns_lead_with_the_primary_key(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool)
+    assert asyncio.run(stats.key_columns("orders")) == ["id", "customer_id"]
+    asyncio.run(stats.key_columns("orders"))
+    assert db.queries.count(catalog.KEY_COLUMNS_SQL) == 1
+    assert asyncio.run(StatsCatalog(lambda: None).key_columns("orders")) == []
+
+
+def test_invalidate_and_refresh(database):
+    db, pool = database
+    stats = StatsCatalog(lambda: pool)
+    asyncio.run(stats.get("orders", "id"))
+    assert stats.invalidate("orders") == 1 and len(stats._entries) == 0
+    assert asyncio.run(stats.refresh("orders", "id")) == [("orders", "id")]
+    assert ("orders", "id") in stats._entries
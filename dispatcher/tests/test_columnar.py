@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+import columnar
+import main
+from rowformat import RowBatch
+
+pytest.importorskip("numpy")
+
+SQL = "SELECT region, status, AVG(amount), COUNT(*), MIN(amount), MAX(qty) FROM orders GROUP BY region, status"
+
+
+def spec():
+    plan, _, _ = main.plan_query(SQL)
+    return plan['merge_spec']
+
+
+def partial_rows(n, seed):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        total = rng.choice([None, rng.uniform(0, 100)])
+        rows.append({'region': rng.choice("abc"), 'status': rng.choice(["paid", "open", None]),
+                     '__a0_sum': total, '__a0_count': 0 if total is None else rng.randint(1, 5),
+                     '__a1_count': rng.randint(1, 5), '__a2_min': total, '__a3_max': rng.choice([None, rng.randint(0, 9)])})
+    return rows
+
+
+def test_columnar_merge_matches_dict_merge():
+    merge_spec = spec()
+    parts = [partial_rows(200, seed) for seed in range(3)]
+    expected = main.build_result_rows(main.merge_partial_states(parts, merge_spec), merge_spec)
+    assert columnar.merge_result_rows(parts, merge_spec) == expected
+
+
+def test_columnar_merge_reads_row_batches():
+    merge_spec = spec()
+    parts = [partial_rows(50, seed) for seed in range(2)]
+    batches = [RowBatch(list(rows[0]), [list(row.values()) for row in rows]) for rows in parts]
+    assert columnar.merge_result_rows(batches, merge_spec) == columnar.merge_result_rows(parts, merge_spec)
+
+
+def test_columnar_merge_declines_non_numeric_states():
+    merge_spec = spec()
+    parts = [partial_rows(10, 1)]
+    parts[0][0]['__a2_min'] = "text"
+    assert columnar.merge_result_rows(parts, merge_spec) is None
+
+
+def test_columnar_merge_declines_sums_that_could_overflow():
+    plan, _, _ = main.plan_query("SELECT SUM(amount) FROM orders")
+    parts = [[{'__a0_sum': 2 ** 62}, {'__a0_sum': 2 ** 62}]]
+    assert columnar.merge_result_rows(parts, plan['merge_spec']) is None
+    assert main.merge_result_rows(parts, plan['merge_spec']) == [{'sum': 2 ** 63}]
@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import pytest
+
+import costmodel
+import main
+from costmodel import CostEstimator
+
+
+def explain(cost, rows, result_rows=1):
+    return json.dumps([{"Plan": {"Total Cost": cost, "Plan Rows": result_rows,
+                                 "Plans": [{"Plan Rows": rows}]}}])
+
+
+def test_scan_rows_counts_every_parallel_worker():
+    plan = {"Plan Rows": 1, "Plans": [{"Workers Planned": 2, "Plan Rows": 3,
+                                       "Plans": [{"Plan Rows": 100}, {"Plan Rows": 5}]}]}
+    assert costmodel.scan_rows(plan) == 315
+
+
+def test_estimates_are_cached_and_scaled_to_the_requested_rows(fake_pool):
+    pool = fake_pool(lambda method, sql, args: explain(500.0, 100))
+    estimator = CostEstimator(lambda: pool)
+
+    async def run():
+        first = await estimator.estimate("shape", lambda: "SELECT 1", rows=100)
+        wider = await estimator.estimate("shape", lambda: "SELECT 1", rows=500)
+        return first, wider
+
+    first, wider = asyncio.run(run())
+    assert len(pool.conn.queries) == 1 and pool.conn.queries[0] == "EXPLAIN (FORMAT JSON) SELECT 1"
+    assert first == {"cost": 500.0, "rows": 100, "result_rows": 1}
+    assert wider == {"cost": 2500.0, "rows": 500, "result_rows": 1}
+
+
+def test_estimates_are_not_scaled_across_row_bands(fake_pool):
+    costs = iter([500.0, 90000.0])
+    pool = fake_pool(lambda method, sql, args: explain(next(costs), 100))
+    estimator = CostEstimator(lambda: pool, max_scale=10.0)
+
+    async def run():
+        return [(await estimator.estimate("shape", lambda: "SELECT 1", rows=rows))["cost"] for rows in (100, 50000, 150)]
+
+    assert asyncio.run(run()) == [500.0, 90000.0, 750.0]
+    assert len(pool.conn.queries) == 2
+    assert costmodel.row_band(99, 10.0) == 1 and costmodel.row_band(100, 10.0) == 2 and costmodel.row_band(0, 10.0) == 0
+
+
+def test_concurrent_misses_share_one_explain(fake_pool):
+    pool = fake_pool(lambda method, sql, args: explain(10.0, 10))
+    estimator = CostEstimator(lambda: pool)
+
+    async def run():
+        return await asyncio.gather(*(estimator.estimate("shape", lambda: "SELECT 1", rows=rows) for rows in (10, 20)))
+
+    assert [e["cost"] for e in asyncio.run(run())] == [10.0, 20.0]
+    assert len(pool.conn.queries) == 1
+
+
+def test_failed_explains_are_not_cached(fake_pool):
+    def fail(method, sql, args):
+        raise RuntimeError("no such table")
+    estimator = CostEstimator(lambda: fake_pool(fail))
+    assert asyncio.run(estimator.estimate("shape", lambda: "SELECT 1")) is None
+    assert len(estimator) == 0
+    assert asyncio.run(CostEstimator(lambda: None).estimate("shape", lambda: "SELECT 1")) is None
+
+
+@pytest.fixture
+def catalog(monkeypatch, fake_pool, fake_catalog):
+    """1M ids with a 101-bound histogram; EXPLAIN: an index probe for point lookups, a scan for ranges."""
+    def handler(method, sql, args):
+        return explain(8.0, 1) if "BETWEEN 5 AND 5" in sql or "BETWEEN 7 AND 7" in sql else explain(40000.0, 900000)
+    pool = fake_pool(handler)
+    fake_catalog(1, 1_000_000, histogram=list(range(1, 1_000_000, 10_000)) + [1_000_000], keys=["id"])
+    monkeypatch.setattr(main, "cost_estimator", CostEstimator(lambda: pool))
+    monkeypatch.setattr(main, "SPLIT_MIN_COST", 1000.0)
+    monkeypatch.setattr(main, "current_worker_count", lambda: asyncio.sleep(0, result=4))
+    return pool
+
+
+def subqueries(sql):
+    plan, literals, _ = main.plan_query(sql)
+    return asyncio.run(main.make_subqueries(plan, main.bound_where(plan, literals)))
+
+
+def test_point_lookups_run_whole_and_wide_ranges_of_the_same_shape_split(catalog):
+    # The point lookup's estimate is cached first; scaled up 90x it would keep the wide range unsplit
+    assert len(subqueries("SELECT * FROM orders WHERE id BETWEEN 5 AND 5")) == 1
+    assert len(subqueries("SELECT * FROM orders WHERE id BETWEEN 1 AND 900000")) == 4
+    assert len(catalog.conn.queries) == 2
+    # Both bands stay cached
+    assert len(subqueries("SELECT * FROM orders WHERE id BETWEEN 7 AND 7")) == 1
+    assert len(subqueries("SELECT * FROM orders WHERE id BETWEEN 1 AND 800000")) == 4
+    assert len(catalog.conn.queries) == 2
+
+
+@pytest.fixture
+def capacity(monkeypatch):
+    """Four workers with two slots each and nothing in flight; returns a setter for the in-flight count."""
+    monkeypatch.setattr(main, "ADAPTIVE_PARTS", True)
+    monkeypatch.setattr(main, "MIN_PARTS", 1)
+    monkeypatch.setattr(main, "MAX_PARTS", 16)
+    monkeypatch.setattr(main, "COST_PER_PART", 1000.0)
+    monkeypatch.setattr(main, "ROWS_PER_PART", 100)
+    monkeypatch.setattr(main, "WORKER_SLOTS", 2)
+    monkeypatch.setattr(main, "inflight_subqueries", 0)
+    monkeypatch.setattr(main, "current_worker_count", lambda: asyncio.sleep(0, result=4))
+    return lambda n: monkeypatch.setattr(main, "inflight_subqueries", n)
+
+
+def count(rows, cost=None):
+    return asyncio.run(main.choose_partition_count(rows, cost))
+
+
+def test_partition_count_follows_the_cost_then_the_rows(capacity):
+    assert count(10, 500.0) == 1
+    assert count(10, 3500.0) == 4
+    assert count(250) == 3
+    assert count(None) == 4  # nothing known: one part per worker
+
+
+def test_partition_count_is_clamped_to_min_and_max(capacity, monkeypatch):
+    assert count(1_000_000) == 8  # 4 workers x 2 slots
+    monkeypatch.setattr(main, "current_worker_count", lambda: asyncio.sleep(0, result=20))
+    assert count(1_000_000) == 16
+    monkeypatch.setattr(main, "MIN_PARTS", 2)
+    assert count(1, 1.0) == 2
+
+
+def test_partition_count_shrinks_with_load_and_few_workers(capacity, monkeypatch):
+    capacity(5)
+    assert count(1_000_000) == 3
+    capacity(50)
+    assert count(1_000_000) == 1
+    capacity(0)
+    monkeypatch.setattr(main, "current_worker_count", lambda: asyncio.sleep(0, result=1))
+    assert count(1_000_000) == 2
+    monkeypatch.setattr(main, "ADAPTIVE_PARTS", False)
+    assert count(1) == 16
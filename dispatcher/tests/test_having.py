@@ -0,0 +1,46 @@
+import pytest
+from sqlglot import parse_one
+
+import main
+
+
+def predicate(condition, keys):
+    node = parse_one(f"SELECT 1 FROM t HAVING {condition}", read="postgres").args["having"].this
+    return main.compile_predicate(node, lambda n: keys.get(n.sql()))
+
+
+@pytest.mark.parametrize("condition, row, expected", [
+    ("c > 5", {'c': 6}, True),
+    ("c > 5", {'c': None}, None),
+    ("c > 5 AND s = 'x'", {'c': 1, 's': None}, False),
+    ("c > 5 OR s = 'x'", {'c': 9, 's': None}, True),
+    ("c > 5 OR s = 'x'", {'c': 1, 's': None}, None),
+    ("NOT c BETWEEN 1 AND 3", {'c': 2}, False),
+    ("c IN (1, 2, NULL)", {'c': 5}, None),
+    ("c IN (1, 2)", {'c': 2}, True),
+    ("c / 2 = 3", {'c': 7}, True),
+    ("-c < 0 AND s IS NULL", {'c': 1, 's': None}, True),
+])
+def test_compiled_predicate_uses_three_valued_logic(condition, row, expected):
+    assert predicate(condition, {'c': 'c', 's': 's'})(row) is expected
+
+
+def test_unresolvable_operand_is_rejected_at_compile_time():
+    with pytest.raises(ValueError):
+        predicate("missing > 1", {})
+
+
+def test_having_is_applied_after_merge_to_aggregates_outside_select():
+    plan, _, _ = main.plan_query("SELECT status FROM orders GROUP BY status HAVING SUM(amount) > 10")
+    assert plan['having_filter'] is not None
+    assert "HAVING" not in main.render_query(plan, None)
+    parts = [[{'status': 'a', '__a0_sum': 8}, {'status': 'b', '__a0_sum': 20}], [{'status': 'a', '__a0_sum': 4}]]
+    assert main.finish_aggregate(plan, parts) == [{'status': 'a'}, {'status': 'b'}]
+    parts = [[{'status': 'a', '__a0_sum': 8}, {'status': 'b', '__a0_sum': 20}]]
+    assert main.finish_aggregate(plan, parts) == [{'status': 'b'}]
+
+
+def test_unsupported_having_runs_unsplit():
+    plan, _, _ = main.plan_query("SELECT status FROM orders GROUP BY status HAVING status LIKE 'a%'")
+    assert not plan['splittable']
+    assert "HAVING" in main.render_query(plan, None)
@@ -0,0 +1,53 @@
+from sqlglot import parse_one
+
+import main
+
+
+def partitioning(sql):
+    table, col, columns = main.join_partitioning(parse_one(sql, read=main.SQL_DIALECT))
+    return table, col, [c.sql() for c in columns]
+
+
+def test_fact_tables_are_co_partitioned_on_the_latest_fact_join():
+    assert partitioning(
+        "SELECT p.category, SUM(oi.quantity) FROM orders o "
+        "JOIN order_items oi ON oi.order_id = o.order_id "
+        "JOIN products p ON p.product_id = oi.product_id GROUP BY p.category"
+    ) == ("orders", "order_id", ["o.order_id", "oi.order_id"])
+
+
+def test_outer_joins_keep_the_range_on_the_key_alone():
+    assert partitioning(
+        "SELECT * FROM orders o LEFT JOIN order_items oi ON oi.order_id = o.order_id"
+    ) == ("orders", "order_id", ["o.order_id"])
+
+
+def test_a_single_fact_table_splits_on_its_where_or_join_column():
+    assert partitioning(
+        "SELECT e.emp_name, d.dept_name FROM employees e "
+        "JOIN departments d ON d.dept_id = e.dept_id WHERE e.salary > 100"
+    ) == ("employees", "salary", ["e.salary"])
+    assert partitioning(
+        "SELECT e.emp_name FROM employees e JOIN departments d ON d.dept_id = e.dept_id"
+    ) == ("employees", "dept_id", ["e.dept_id"])
+
+
+def test_partition_keys_override_the_join_key(monkeypatch):
+    monkeypatch.setitem(main.PARTITION_KEYS, "order_items", "item_id")
+    assert partitioning(
+        "SELECT * FROM orders o JOIN order_items oi ON oi.order_id = o.order_id"
+    ) == ("order_items", "item_id", ["oi.item_id"])
+
+
+def test_broadcast_only_and_derived_joins_are_not_split():
+    assert main.join_partitioning(parse_one(
+        "SELECT * FROM products p JOIN departments d ON d.dept_id = p.product_id")) is None
+    assert main.join_partitioning(parse_one(
+        "SELECT * FROM orders o JOIN (SELECT order_id FROM order_items) x ON x.order_id = o.order_id")) is None
+
+
+def test_join_plans_split_on_the_chosen_key():
+    plan, _, _ = main.plan_query(
+        "SELECT p.category, COUNT(*) FROM orders o JOIN order_items oi ON oi.order_id = o.order_id "
+        "JOIN products p ON p.product_id = oi.product_id GROUP BY p.category")
+    assert plan['splittable'] and plan['table'] == "orders" and plan['partition_col'] == "order_id"
@@ -0,0 +1,45 @@
+import main
+
+
+def spec_for(sql):
+    plan, _, _ = main.plan_query(sql)
+    return plan, plan['merge_spec']
+
+
+def test_grouped_aggregates_are_rewritten_into_partial_states():
+    plan, spec = spec_for("SELECT status, AVG(amount), COUNT(*), MIN(amount), MAX(amount) FROM orders GROUP BY 1")
+    assert plan['merge'] == "grouped"
+    assert [op for _, op in spec['states']] == ['add', 'add', 'add', 'min', 'max']
+    sql = main.render_query(plan, None)
+    assert "SUM(amount) AS __a0_sum, COUNT(amount) AS __a0_count" in sql
+    assert sql.endswith("GROUP BY status")
+
+
+def test_merge_partial_states_combines_groups_across_partitions():
+    _, spec = spec_for("SELECT status, AVG(amount), COUNT(*), MIN(amount), MAX(amount) FROM orders GROUP BY 1")
+    parts = [
+        [{'status': 'paid', '__a0_sum': 30, '__a0_count': 2, '__a1_count': 3, '__a2_min': 10, '__a3_max': 20},
+         {'status': 'open', '__a0_sum': None, '__a0_count': 0, '__a1_count': 1, '__a2_min': None, '__a3_max': None}],
+        [{'status': 'paid', '__a0_sum': 60, '__a0_count': 1, '__a1_count': 1, '__a2_min': 60, '__a3_max': 60}],
+    ]
+    rows = main.build_result_rows(main.merge_partial_states(parts, spec), spec)
+    assert rows == [{'status': 'paid', 'avg': 30.0, 'count': 4, 'min': 10, 'max': 60},
+                    {'status': 'open', 'avg': None, 'count': 1, 'min': None, 'max': None}]
+
+
+def test_scalar_aggregate_over_no_rows_returns_one_row():
+    _, spec = spec_for("SELECT COUNT(*), SUM(amount) FROM orders")
+    assert main.merge_aggregates([[], []], spec) == {"rows": [{'count': 0, 'sum': None}]}
+
+
+def test_group_by_key_missing_from_select_still_separates_groups():
+    plan, spec = spec_for("SELECT SUM(amount) FROM orders GROUP BY status")
+    assert spec['group_cols'] == [('__k0', None)]
+    parts = [[{'__k0': 'a', '__a0_sum': 1}], [{'__k0': 'b', '__a0_sum': 2}, {'__k0': 'a', '__a0_sum': 3}]]
+    assert main.merge_result_rows(parts, spec) == [{'sum': 4}, {'sum': 2}]
+
+
+def test_window_functions_run_unsplit():
+    plan, spec = spec_for("SELECT status, SUM(amount) OVER () FROM orders")
+    assert not plan['splittable']
+    assert spec is None
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from admission import AdmissionController
+
+
+def plan_for(sql):
+    plan, literals, _ = main.plan_query(sql)
+    return plan, main.render_query(plan, main.bound_where(plan, literals))
+
+
+def test_row_query_pushes_order_and_offset_plus_limit_to_partitions():
+    plan, sql = plan_for("SELECT id, amount FROM orders WHERE id > 0 ORDER BY amount DESC LIMIT 3 OFFSET 2")
+    assert plan['order'] == [{'key': 'amount', 'desc': True, 'nulls_first': True}]
+    assert (plan['limit'], plan['offset']) == (3, 2)
+    assert sql.endswith("ORDER BY amount DESC LIMIT 5")
+
+
+def test_order_by_unselected_column_travels_as_hidden_column():
+    plan, sql = plan_for("SELECT id FROM orders WHERE id > 0 ORDER BY amount LIMIT 3")
+    assert plan['hidden'] == ['__order0']
+    assert "amount AS __order0" in sql
+
+
+def test_aggregate_query_sorts_after_merge():
+    plan, sql = plan_for("SELECT status, COUNT(*) FROM orders GROUP BY status ORDER BY COUNT(*) DESC LIMIT 2")
+    assert plan['order'] == [{'key': 'count', 'desc': True, 'nulls_first': True}]
+    assert plan['limit'] == 2
+    assert "ORDER BY" not in sql and "LIMIT" not in sql
+
+
+def test_order_by_unselected_aggregate_becomes_hidden_state():
+    plan, sql = plan_for("SELECT status, SUM(amount) FROM orders GROUP BY status ORDER BY MAX(amount) DESC")
+    assert plan['order'][0]['key'] == '__agg1'
+    assert plan['hidden'] == ['__agg1']
+    assert "MAX(amount) AS __a1_max" in sql
+
+
+def test_distinct_rows_run_as_one_query():
+    # Two partitions could each return 'a': the merged answer would repeat it
+    for query in ("SELECT DISTINCT status FROM orders ORDER BY status LIMIT 3",
+                  "SELECT DISTINCT ON (status) status, id FROM orders ORDER BY status, id",
+                  "SELECT DISTINCT status FROM orders GROUP BY status, region"):
+        plan, sql = plan_for(query)
+        assert not plan['splittable'] and plan['order'] is None
+        assert sql == main.parse_one(query, read=main.SQL_DIALECT).sql(dialect=main.SQL_DIALECT)
+
+
+def test_apply_order_and_limit_merges_presorted_parts_lazily():
+    plan = {'order': [{'key': 'v', 'desc': False, 'nulls_first': False}], 'limit': 3, 'offset': 1, 'hidden': []}
+    parts = [[{'v': 1}, {'v': 5}], [{'v': 2}, {'v': 3}, {'v': 8}]]
+    assert main.apply_order_and_limit(None, plan, presorted_parts=parts) == [{'v': 2}, {'v': 3}, {'v': 5}]
+
+
+def test_order_key_places_nulls_like_postgres():
+    rows = [{'a': 2, 'b': None}, {'a': None, 'b': 1}, {'a': 1, 'b': 3}, {'a': 1, 'b': None}]
+    plan = {'order': [{'key': 'a', 'desc': True, 'nulls_first': True},
+                      {'key': 'b', 'desc': False, 'nulls_first': False}],
+            'limit': None, 'offset': 0, 'hidden': ['b']}
+    assert main.apply_order_and_limit(rows, plan) == [{'a': None}, {'a': 2}, {'a': 1}, {'a': 1}]
+    assert [row['a'] for row in sorted(rows, key=main.order_key(plan['order']))] == [None, 2, 1, 1]
+
+
+def test_stream_sorted_partitions_merges_sorted_streams(monkeypatch):
+    answers = {"a": [{"v": 1}, {"v": 4}, {"v": 7}], "b": [{"v": 2}, {"v": 3}, {"v": 9}]}
+
+    async def stream_from_worker(sql, queue):
+        for row in answers[sql]:
+            await queue.put(json.dumps(row))
+
+    async def collect(body):
+        return [json.loads(line) async for chunk in body for line in chunk.splitlines()]
+
+    monkeypatch.setattr(main, "stream_from_worker", stream_from_worker)
+    plan = {'order': [{'key': 'v', 'desc': False, 'nulls_first': False}], 'limit': 4, 'offset': 0, 'hidden': []}
+    rows = asyncio.run(collect(main.stream_sorted_partitions(["a", "b"], plan)))
+    assert [row["v"] for row in rows] == [1, 2, 3, 4]
+
+
+def test_sort_columns_see_through_aliases_and_min_max():
+    plan, _ = plan_for("SELECT status AS s, COUNT(*) AS n FROM orders GROUP BY status ORDER BY s, n, MAX(lower(city))")
+    assert plan['sort_columns'] == ['status', 'city']
+    assert plan_for("SELECT id FROM orders")[0]['sort_columns'] == []
+
+
+@pytest.fixture
+def collated_db(monkeypatch, fake_catalog):
+    """name is text, id an integer; every sub-query answers in en_US order (case-insensitive)."""
+    numbers = {"low": 1, "high": 1_000_000, "histogram": None, "row_estimate": 1_000_000, "type": "integer"}
+    fake_catalog(1, 1_000_000, keys=["id"], columns={("orders", "id"): numbers,
+                                                     ("orders", "name"): dict(numbers, type="text")})
+    monkeypatch.setattr(main, "SPLIT_MIN_COST", 0)
+    monkeypatch.setattr(main, "admission", AdmissionController(max_inflight=8))
+    monkeypatch.setattr(main, "subquery_latency", main.LatencyWindow())
+    queries = []
+
+    async def fetch_partition(sql, worker, cost=1.0):
+        queries.append(sql)
+        main.worker_scheduler.release(worker, cost)
+        return [{"id": 1, "name": "apple"}, {"id": 2, "name": "Banana"}, {"id": 3, "name": "cherry"}]
+
+    monkeypatch.setattr(main, "fetch_partition", fetch_partition)
+    return queries
+
+
+def execute(sql):
+    plan, literals, _ = main.plan_query(sql)
+    return asyncio.run(main.execute_query(plan, main.bound_where(plan, literals)))["rows"]
+
+
+def test_text_order_runs_unsplit_in_the_database_collation(collated_db):
+    # Merged in Python, 'Banana' < 'apple'; Postgres (en_US) puts apple first
+    assert [row["name"] for row in execute("SELECT id, name FROM orders ORDER BY name")] == ["apple", "Banana", "cherry"]
+    assert collated_db == ["SELECT id, name FROM orders ORDER BY name"]
+
+    collated_db.clear()
+    execute("SELECT id, name FROM orders ORDER BY id LIMIT 2")
+    assert len(collated_db) > 1
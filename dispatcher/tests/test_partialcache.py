@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+import main
+from partialcache import PartialCache
+
+
+def test_partial_cache_ignores_entries_of_another_version():
+    cache = PartialCache()
+    cache.put("q", (0, 0, 1), [{"n": 1}])
+    assert cache.get("q", (0, 0, 1)) == [{"n": 1}]
+    assert cache.get("q", (1, 0, 1)) is None
+    assert cache.get("q", (0, 0, 1)) is None  # the stale entry was dropped
+
+
+def test_partial_cache_stays_within_its_byte_budget():
+    cache = PartialCache(max_bytes=60)
+    cache.put("a", None, [{"n": "x" * 20}])
+    cache.put("b", None, [{"n": "y" * 20}])
+    assert cache.get("a", None) is None
+    assert cache.get("b", None) is not None
+    assert cache.bytes <= 60
+
+
+class Versions:
+    def __init__(self):
+        self.version = (100, 0, 0, 1)
+
+    async def current_versions(self, tables):
+        return {t: self.version for t in tables}
+
+
+@pytest.fixture
+def append_only(monkeypatch, fake_catalog):
+    versions = Versions()
+    fake_catalog(0, 99)
+    monkeypatch.setattr(main, "result_cache", versions)
+    monkeypatch.setattr(main, "partial_cache", PartialCache())
+    monkeypatch.setattr(main, "MAX_PARTS", 4)
+    return versions
+
+
+def run_incremental(plan):
+    cached, subqueries, fresh = asyncio.run(main.incremental_subqueries(plan, None, "id"))
+    for i, (key, version) in fresh.items():
+        main.partial_cache.put(key, version, [{"from": subqueries[i]['lower']}])
+    return cached, subqueries
+
+
+def test_closed_ranges_come_from_the_partial_cache(append_only):
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    cached, subqueries = run_incremental(plan)
+    assert cached == []
+    assert [(p['lower'], p['upper']) for p in subqueries] == [(None, 32), (32, 64), (64, 96), (96, None)]
+
+    # Inserts only move the insert counter: closed ranges stay cached, the open top range re-runs
+    append_only.version = (150, 0, 0, 1)
+    cached, subqueries = run_incremental(plan)
+    assert cached == [[{"from": None}], [{"from": 32}], [{"from": 64}]]
+    assert [(p['lower'], p['upper']) for p in subqueries] == [(96, None)]
+
+
+def test_updates_invalidate_closed_ranges(append_only):
+    plan, _, _ = main.plan_query("SELECT SUM(amount) FROM orders")
+    run_incremental(plan)
+    append_only.version = (100, 1, 0, 1)
+    cached, subqueries = run_incremental(plan)
+    assert cached == []
+    assert len(subqueries) == 4
+
+
+def test_unknown_versions_bypass_the_partial_cache(append_only):
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    append_only.version = None
+    main.partial_cache.put(main.make_partition(plan, None, "id", None, 32, False, 0, 99)['sql'], None, [{"stale": 1}])
+    cached, subqueries, fresh = asyncio.run(main.incremental_subqueries(plan, None, "id"))
+    assert cached == [] and fresh == {}
+    assert len(subqueries) == 4
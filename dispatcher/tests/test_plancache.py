@@ -0,0 +1,60 @@
+import main
+from plancache import PlanCache, normalize_sql
+
+
+def test_normalize_sql_replaces_literals_with_typed_markers():
+    shape, literals = normalize_sql("SELECT * FROM orders WHERE id = 5 AND status = 'paid'", "postgres")
+    other, _ = normalize_sql("select * from orders where id = 70 and status = 'open'", "postgres")
+    assert shape == other
+    assert [t.text for t in literals] == ["5", "paid"]
+    assert "?n" in shape.split("\x1f") and "?s" in shape.split("\x1f")
+
+
+def test_normalize_sql_keeps_quoted_identifier_case():
+    quoted, _ = normalize_sql('SELECT "Total" FROM t', "postgres")
+    folded, _ = normalize_sql('SELECT "total" FROM t', "postgres")
+    assert quoted != folded
+
+
+def plan_stub(fixed_slots):
+    return {"fixed_slots": fixed_slots}
+
+
+def test_plan_cache_keys_variants_by_fixed_literals():
+    cache = PlanCache()
+    shape, literals = normalize_sql("SELECT * FROM t WHERE id > 1 LIMIT 10", "postgres")
+    plan = plan_stub((1,))
+    cache.put(shape, literals, plan)
+    _, same_limit = normalize_sql("SELECT * FROM t WHERE id > 99 LIMIT 10", "postgres")
+    _, other_limit = normalize_sql("SELECT * FROM t WHERE id > 1 LIMIT 20", "postgres")
+    assert cache.get(shape, same_limit) is plan
+    assert cache.get(shape, other_limit) is None
+
+
+def test_plan_cache_evicts_least_recently_used_shape():
+    cache = PlanCache(max_entries=2)
+    entries = [normalize_sql(sql, "postgres") for sql in ("SELECT a FROM t", "SELECT b FROM t", "SELECT c FROM t")]
+    plans = [plan_stub(()) for _ in entries]
+    cache.put(*entries[0], plans[0])
+    cache.put(*entries[1], plans[1])
+    assert cache.get(*entries[0]) is plans[0]
+    cache.put(*entries[2], plans[2])
+    assert cache.get(*entries[1]) is None
+    assert cache.get(*entries[0]) is plans[0]
+    assert cache.get(*entries[2]) is plans[2]
+
+
+def test_plan_query_reuses_plan_and_binds_request_literals():
+    plan, literals, key = main.plan_query("SELECT * FROM orders WHERE id BETWEEN 1 AND 10")
+    again, other, other_key = main.plan_query("SELECT * FROM orders WHERE id BETWEEN 5 AND 50")
+    assert again is plan
+    assert key != other_key
+    assert main.bound_where(plan, literals).sql() == "id BETWEEN 1 AND 10"
+    assert main.bound_where(again, other).sql() == "id BETWEEN 5 AND 50"
+
+
+def test_plan_query_plans_fixed_literals_separately():
+    first, _, _ = main.plan_query("SELECT * FROM orders WHERE id > 3 LIMIT 5")
+    second, _, _ = main.plan_query("SELECT * FROM orders WHERE id > 3 LIMIT 6")
+    assert first is not second
+    assert (first['limit'], second['limit']) == (5, 6)
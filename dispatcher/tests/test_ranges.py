@@ -0,0 +1,122 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+from sqlglot import parse_one
+
+import main
+
+
+def predicates(where_sql):
+    where = parse_one(f"SELECT * FROM t WHERE {where_sql}", read=main.SQL_DIALECT).args["where"].this
+    return [(column.name, op, value) for column, op, value in main.range_predicates(where)]
+
+
+def test_range_predicates_read_top_level_and_terms():
+    assert predicates("a > 5 AND 10 >= a AND b BETWEEN 1 AND 3 AND c IN (4, 2)") == [
+        ("a", ">", 5), ("a", "<=", 10), ("b", ">=", 1), ("b", "<=", 3), ("c", "in", [4, 2])]
+
+
+def test_range_predicates_skip_or_and_column_comparisons():
+    assert predicates("(a > 5 OR a < 1) AND a = b AND NOT c > 3") == []
+
+
+def test_intersect_range_keeps_the_tightest_interval():
+    assert main.intersect_range([('>', 5), ('>=', 7), ('<', 20), ('<=', 12)]) == {'low': 7, 'high': 12, 'values': None}
+    assert main.intersect_range([('>=', 3)]) == {'low': 3, 'high': None, 'values': None}
+    assert main.intersect_range([]) is None
+
+
+def test_intersect_range_narrows_in_lists_to_the_range():
+    assert main.intersect_range([('in', [1, 5, 9, 15]), ('>', 4), ('<=', 10)]) == {'low': 5, 'high': 9, 'values': [5, 9]}
+    assert main.intersect_range([('in', [1, 2]), ('=', 2)]) == {'low': 2, 'high': 2, 'values': [2]}
+
+
+def test_intersect_range_detects_contradictions_and_mixed_types():
+    assert main.intersect_range([('>', 10), ('<', 5)]) == 'empty'
+    assert main.intersect_range([('in', [1, 2]), ('>', 3)]) == 'empty'
+    assert main.intersect_range([('>', 10), ('<', '2024-01-01')]) is None
+
+
+@pytest.fixture
+def choose(fake_catalog):
+    def choose(sql, keys):
+        fake_catalog(keys=keys)
+        plan, _, _ = main.plan_query(sql)
+        where = parse_one(sql, read=main.SQL_DIALECT).args.get("where")
+        return asyncio.run(main.choose_partition_column(plan, where.this if where else None))
+    return choose
+
+
+def test_choose_partition_column_prefers_bounded_indexed_columns(choose):
+    assert choose("SELECT * FROM orders WHERE order_id > 100 AND status = 'x'",
+                  ["order_id", "customer_id"]) == ("order_id", {'low': 100, 'high': None, 'values': None})
+    assert choose("SELECT * FROM orders WHERE customer_id BETWEEN 5 AND 9",
+                  ["order_id", "customer_id"]) == ("customer_id", {'low': 5, 'high': 9, 'values': None})
+
+
+def test_choose_partition_column_falls_back_to_the_key_or_a_bounded_column(choose):
+    assert choose("SELECT * FROM orders WHERE status = 'x'", ["order_id"]) == ("order_id", None)
+    assert choose("SELECT * FROM orders WHERE total > 50 AND status = 'x'", []) == (
+        "total", {'low': 50, 'high': None, 'values': None})
+
+
+def test_split_points_follow_a_skewed_histogram():
+    # Most rows sit below 10: the points crowd there instead of splitting 0..1000 evenly
+    assert main.choose_split_points(0, 1000, [0, 1, 2, 3, 4, 5, 6, 7, 8, 1000], 4) == [2, 4, 7]
+    # A value repeated across bounds yields one split point, not an empty partition
+    assert main.choose_split_points(0, 10, [0, 5, 5, 5, 5, 10], 3) == [5]
+
+
+def test_split_points_fall_back_to_equal_width():
+    assert main.choose_split_points(0, 99, [0, 50, 99], 4) == [25, 50, 75]
+    assert main.choose_split_points(0, 99, None, 4) == [25, 50, 75]
+    assert main.choose_split_points("a", "z", None, 4) == []
+    assert main.choose_split_points(5, 5, None, 4) == []
+    assert main.choose_split_points(0, "z", None, 4) == []
+    assert main.choose_split_points(0, 99, None, 1) == []
+
+
+def test_interpolate_bounds_splits_dates_and_timestamps():
+    assert main.interpolate_bounds(date(2024, 1, 1), date(2024, 1, 5), 2) == [date(2024, 1, 3)]
+    assert main.interpolate_bounds(datetime(2024, 1, 1), datetime(2024, 1, 2), 4) == [
+        datetime(2024, 1, 1, 6), datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 18)]
+    assert main.interpolate_bounds(0.0, 1.0, 4) == [0.25, 0.5, 0.75]
+    assert main.interpolate_bounds(True, False, 2) == []
+
+
+def literal(sql):
+    return main.literal_value(parse_one(sql, read=main.SQL_DIALECT))
+
+
+def test_literal_value_converts_dates_only_when_typed():
+    assert (literal("5"), literal("2.5"), literal("'2024-01-01'"), literal("'x'")) == (5, 2.5, "2024-01-01", None)
+    assert literal("CAST('2024-01-01' AS DATE)") == date(2024, 1, 1)
+    assert literal("CAST('2024-01-01 10:30' AS TIMESTAMP)") == datetime(2024, 1, 1, 10, 30)
+    assert (literal("CAST('2024-01-01' AS TEXT)"), literal("CAST('abc' AS TEXT)")) == ("2024-01-01", None)
+    assert literal("a + 1") is None
+    assert main.temporal_value("2024-01-01", "date") == date(2024, 1, 1)
+    assert main.temporal_value("2024-01-01", "timestamp with time zone") == datetime(2024, 1, 1)
+    assert main.temporal_value("2024-01-01", "text") == "2024-01-01"
+    assert main.temporal_value("soon", "date") == "soon"
+
+
+def partition_sql(sql):
+    plan, literals, _ = main.plan_query(sql)
+    return [p['sql'] for p in asyncio.run(main.make_subqueries(plan, main.bound_where(plan, literals), n_parts=2))]
+
+
+def test_iso_strings_on_text_columns_stay_strings(fake_catalog):
+    fake_catalog("2024-01-01", "2024-12-31", histogram=["2024-01-01", "2024-07-01", "2024-12-31"],
+                 rows=1000, keys=["code"], type="text")
+    parts = partition_sql("SELECT * FROM orders WHERE code >= '2024-03-01'")
+    assert len(parts) == 2
+    assert not any("DATE" in sql for sql in parts)
+    assert "code >= '2024-07-01'" in parts[1]
+
+
+def test_iso_strings_on_date_columns_split_as_dates(fake_catalog):
+    fake_catalog(date(2024, 1, 1), date(2024, 12, 31), rows=1000, keys=["day"], type="date")
+    parts = partition_sql("SELECT * FROM orders WHERE day >= '2024-03-01'")
+    assert len(parts) == 2
+    assert "CAST('2024-07-31' AS DATE)" in parts[1]
@@ -0,0 +1,91 @@
+import asyncio
+
+from resultcache import ResultCache
+
+
+class Runner:
+    def __init__(self, result="rows"):
+        self.result = result
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.result
+
+
+def lookup(cache, key, run, tables=("orders",)):
+    return asyncio.run(cache.get_or_run(key, list(tables), run))
+
+
+def test_second_lookup_is_a_hit():
+    cache, run = ResultCache(lambda: None), Runner([{"n": 1}])
+    assert lookup(cache, "k", run) == ([{"n": 1}], "miss")
+    assert lookup(cache, "k", run) == ([{"n": 1}], "hit")
+    assert run.calls == 1
+
+
+def test_identical_requests_in_flight_share_one_run():
+    cache, run = ResultCache(lambda: None), Runner()
+
+    async def both():
+        return await asyncio.gather(cache.get_or_run("k", ["orders"], run), cache.get_or_run("k", ["orders"], run))
+    outcomes = sorted(outcome for _, outcome in asyncio.run(both()))
+    assert outcomes == ["coalesced", "miss"]
+    assert run.calls == 1
+
+
+def test_notify_for_a_read_table_makes_entries_stale():
+    cache, run = ResultCache(lambda: None), Runner()
+    lookup(cache, "k", run)
+    cache._on_notify(None, 0, "changes", "customers")
+    assert lookup(cache, "k", run)[1] == "hit"
+    cache._on_notify(None, 0, "changes", "orders")
+    assert lookup(cache, "k", run)[1] == "miss"  # invalidated right away
+    assert run.calls == 2
+
+
+def test_entries_expire_after_ttl():
+    cache, run = ResultCache(lambda: None, ttl=0), Runner()
+    lookup(cache, "k", run)
+    assert lookup(cache, "k", run)[1] == "expired"
+
+
+def test_failed_runs_are_not_cached():
+    cache = ResultCache(lambda: None)
+
+    async def fail():
+        raise RuntimeError("worker down")
+    try:
+        lookup(cache, "k", fail)
+    except RuntimeError:
+        pass
+    assert len(cache) == 0
+
+
+def test_byte_budget_evicts_oldest_entries():
+    cache = ResultCache(lambda: None, max_bytes=40)
+    lookup(cache, "a", Runner("x" * 20))
+    lookup(cache, "b", Runner("y" * 20))
+    assert len(cache) == 1 and cache.bytes <= 40
+    assert lookup(cache, "b", Runner())[1] == "hit"
+
+
+def test_invalidate_drops_entries_of_one_table():
+    cache = ResultCache(lambda: None)
+    lookup(cache, "a", Runner(), tables=("orders",))
+    lookup(cache, "b", Runner(), tables=("customers",))
+    assert cache.invalidate("orders") == 1
+    assert len(cache) == 1
+
+
+def test_version_probe_makes_results_of_changed_tables_stale(fake_pool):
+    versions = {"orders": (10, 0, 0, 1)}
+    pool = fake_pool(lambda method, sql, args: [(t,) + versions[t] for t in args[0]])
+    cache, run = ResultCache(lambda: pool), Runner()
+    lookup(cache, "k", run)
+    assert lookup(cache, "k", run)[1] == "hit"
+    versions["orders"] = (11, 0, 0, 1)
+    assert asyncio.run(cache.probe(["orders"])) == {"orders": (11, 0, 0, 1)}
+    assert lookup(cache, "k", run)[1] == "miss"
+    assert run.calls == 2
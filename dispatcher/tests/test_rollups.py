@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+import rollups
+from rollups import Rollup, RollupSet
+
+DECLARED = ("SELECT p.category, o.status, SUM(oi.quantity) AS q, COUNT(*) AS n FROM order_items oi "
+            "JOIN products p ON p.product_id = oi.product_id JOIN orders o ON o.order_id = oi.order_id "
+            "GROUP BY p.category, o.status")
+QUERY = ("SELECT prod.category, SUM(items.quantity) AS total FROM order_items items "
+         "JOIN products prod ON items.product_id = prod.product_id JOIN orders o ON o.order_id = items.order_id "
+         "{where} GROUP BY prod.category ORDER BY total DESC")
+ROWS = [{"category": "A", "status": "shipped", "__a0_sum": 10, "__a1_count": 2},
+        {"category": "A", "status": "new", "__a0_sum": 5, "__a1_count": 1},
+        {"category": "B", "status": "shipped", "__a0_sum": 30, "__a1_count": 3}]
+
+
+@pytest.fixture
+def rollup():
+    rollup = Rollup("sales", DECLARED, main.build_plan(DECLARED, []), main.SQL_DIALECT)
+    rollup.publish({None: ROWS}, ROWS, [], {}, (None, None, None, None, None))
+    return rollup
+
+
+def test_load_definitions(tmp_path):
+    path = tmp_path / "rollups.json"
+    path.write_text(json.dumps({"rollups": [{"name": "a", "sql": "SELECT 1"}, {"sql": "SELECT 2"}]}))
+    assert rollups.load_definitions(str(path)) == [{"name": "a", "sql": "SELECT 1"}, {"name": "rollup1", "sql": "SELECT 2"}]
+    path.write_text(json.dumps([{"name": "a"}]))
+    with pytest.raises(ValueError):
+        rollups.load_definitions(str(path))
+
+
+def test_load_rollups_skips_what_it_cant_maintain(tmp_path):
+    path = tmp_path / "rollups.json"
+    path.write_text(json.dumps([{"name": "ok", "sql": DECLARED},
+                                {"name": "filtered", "sql": "SELECT status, COUNT(*) FROM orders WHERE id > 5 GROUP BY status"},
+                                {"name": "rows", "sql": "SELECT * FROM orders"}]))
+    assert [r.name for r in main.load_rollups(str(path))] == ["ok"]
+
+
+def test_value_kind():
+    assert rollups.value_kind([1, 2.5, None]) == 'number'
+    assert rollups.value_kind(["a", "b"]) == 'text'
+    assert rollups.value_kind(["2024-01-01", "x"]) == 'other'
+    assert rollups.value_kind([True]) == 'other'
+
+
+def test_queries_match_whatever_their_aliases(rollup):
+    plan, _, _ = main.plan_query(QUERY.format(where="WHERE o.status = 'shipped'"))
+    assert rollup.match(plan, main.SQL_DIALECT) == {
+        'groups': [('category', 'category')], 'states': [('__a0_sum', '__a0_sum')], 'filters': {'o.status': 'status'}}
+
+
+@pytest.mark.parametrize("sql", [
+    QUERY.format(where="WHERE items.quantity > 2"),  # filter on a non-dimension
+    "SELECT p.category, AVG(oi.quantity) FROM order_items oi JOIN products p ON p.product_id = oi.product_id "
+    "JOIN orders o ON o.order_id = oi.order_id GROUP BY p.category",  # state the rollup doesn't keep
+    "SELECT p.category, SUM(oi.quantity) FROM order_items oi JOIN products p ON p.product_id = oi.product_id "
+    "GROUP BY p.category",  # other joins
+])
+def test_queries_the_rollup_cant_answer(rollup, sql):
+    plan, _, _ = main.plan_query(sql)
+    assert rollup.match(plan, main.SQL_DIALECT) is None
+
+
+def test_partial_rows_filter_and_rename(rollup):
+    mapping = {'groups': [('g', 'category')], 'states': [('s', '__a0_sum')], 'filters': {}}
+    assert rollup.partial_rows(mapping, lambda row: row["status"] == "shipped") == [{"g": "A", "s": 10}, {"g": "B", "s": 30}]
+
+
+def test_text_dimensions_only_filter_on_equality(rollup):
+    mapping = {'filters': {'o.status': 'status'}}
+    where = lambda sql: main.parse_one(f"SELECT 1 WHERE {sql}", read=main.SQL_DIALECT).args["where"].this
+    assert main.rollup_predicate(rollup, mapping, where("o.status = 'new'"))(ROWS[1]) is True
+    with pytest.raises(ValueError):
+        main.rollup_predicate(rollup, mapping, where("o.status > 'new'"))
+
+
+class Versions:
+    async def current_versions(self, tables):
+        return {}
+
+
+def test_matching_queries_are_answered_from_the_rollup(monkeypatch, rollup):
+    monkeypatch.setattr(main, "rollup_set", RollupSet([rollup]))
+    monkeypatch.setattr(main, "result_cache", Versions())
+
+    async def fetch_partition(sql, worker, cost=1.0):
+        raise AssertionError(f"no sub-query should run: {sql}")
+    monkeypatch.setattr(main, "fetch_partition", fetch_partition)
+
+    def run(where):
+        plan, literals, _ = main.plan_query(QUERY.format(where=where))
+        return asyncio.run(main.execute_query(plan, main.bound_where(plan, literals)))
+
+    assert run("") == {"rows": [{"category": "B", "total": 30}, {"category": "A", "total": 15}]}
+    assert run("WHERE o.status = 'new'") == {"rows": [{"category": "A", "total": 5}]}
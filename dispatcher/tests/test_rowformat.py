@@ -0,0 +1,29 @@
+import json
+
+import rowformat
+from rowformat import RowBatch
+
+
+def test_compact_responses_decode_to_row_batches():
+    body = json.dumps({"columns": ["a", "b"], "rows": [[1, "x"], [2, None]]}).encode()
+    rows = rowformat.decode_rows(rowformat.COMPACT_TYPE + "; charset=utf-8", body)
+    assert isinstance(rows, RowBatch)
+    assert list(rows) == [{"a": 1, "b": "x"}, {"a": 2, "b": None}]
+    assert rows[1:] == [{"a": 2, "b": None}]
+
+
+def test_json_responses_decode_to_dicts():
+    body = json.dumps({"rows": [{"a": 1}]}).encode()
+    assert rowformat.decode_rows("application/json", body) == [{"a": 1}]
+    assert rowformat.decode_rows("application/json", b'{"rows": null}') == []
+
+
+def test_columns_and_records_read_both_formats_alike():
+    batch = RowBatch(["a", "b"], [[1, "x"], [2, "y"]])
+    dicts = list(batch)
+    for rows in (batch, dicts):
+        assert rowformat.column(rows, "b") == ["x", "y"]
+        assert list(rowformat.records(rows, ["b", "a"])) == [("x", 1), ("y", 2)]
+        assert list(rowformat.records(rows, ["a", "missing"])) == [(1, None), (2, None)]
+    assert rowformat.column(batch, "missing") == [None, None]
+    assert list(batch.records([])) == [(), ()]
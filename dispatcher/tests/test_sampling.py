@@ -0,0 +1,61 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+import sampling
+
+
+def test_parse_options():
+    assert sampling.parse_options(None) is None and sampling.parse_options({"fraction": 1}) is None
+    options = sampling.parse_options({"fraction": "0.05", "method": "SYSTEM", "confidence": 0.9, "seed": 3})
+    assert (options['fraction'], options['method'], options['seed']) == (0.05, "system", 3)
+    assert options['z'] == pytest.approx(1.6449, abs=1e-4)
+
+
+@pytest.mark.parametrize("value", [0.1, {}, {"fraction": 0}, {"fraction": 2}, {"fraction": 0.1, "method": "rows"},
+                                   {"fraction": 0.1, "confidence": 1}, {"fraction": 0.1, "seed": True}])
+def test_parse_options_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        sampling.parse_options(value)
+
+
+def test_estimates_scale_counts_and_sums_with_intervals():
+    options = sampling.parse_options({"fraction": 0.1})
+    count, interval = sampling.estimate('count', [100], [0], None, options)
+    assert count == 1000 and interval[0] < 1000 < interval[1]
+    total, interval = sampling.estimate('sum', [50.0, 300.0], [0], 1, options)
+    assert total == 500.0 and interval[0] < 500 < interval[1]
+    assert sampling.estimate('avg', [50.0, 10, 300.0], [0, 1], 2, options)[0] == 5.0
+    assert sampling.estimate('max', [7], [0], None, options) == (7, None)
+    assert sampling.estimate('sum', [None, None], [0], 1, options) == (None, None)
+
+
+def sampled(sql, **option):
+    plan, _, _ = main.plan_query(sql)
+    return plan, main.sampled_plan(plan, sampling.parse_options({"fraction": 0.1, **option}))
+
+
+def test_sampled_plans_read_through_tablesample_with_square_states():
+    plan, variant = sampled("SELECT grp, COUNT(*) AS n, AVG(val) AS a FROM numbers GROUP BY grp", seed=7)
+    sql = variant['template'].sql(dialect=main.SQL_DIALECT)
+    assert "numbers TABLESAMPLE BERNOULLI (10) REPEATABLE (7)" in sql and "AS __a1_sq" in sql
+    assert variant['merge_spec']['squares'] == {1: 3} and variant['shape'] != plan['shape']
+    # Variants are cached on the plan; the plan itself is left alone
+    assert main.sampled_plan(plan, variant['sample'])['template'] is variant['template']
+    assert "TABLESAMPLE" not in plan['template'].sql(dialect=main.SQL_DIALECT)
+
+
+def test_sampled_plans_need_a_splittable_aggregate():
+    for sql in ("SELECT * FROM numbers", "SELECT COUNT(DISTINCT grp) FROM numbers"):
+        with pytest.raises(HTTPException) as error:
+            sampled(sql)
+        assert error.value.status_code == 400
+
+
+def test_sampled_rows_carry_estimates_and_intervals():
+    _, variant = sampled("SELECT grp, COUNT(*) AS n, AVG(val) AS a FROM numbers GROUP BY grp")
+    parts = [[{"grp": "x", "__a0_count": 10, "__a1_sum": 40.0, "__a1_count": 10, "__a1_sq": 260.0}],
+             [{"grp": "x", "__a0_count": 10, "__a1_sum": 60.0, "__a1_count": 10, "__a1_sq": 340.0}]]
+    [row] = main.merge_result_rows(parts, variant['merge_spec'], variant['sample'])
+    assert row["grp"] == "x" and row["n"] == 200 and row["a"] == 5.0
+    assert row["n_ci"][0] < 200 < row["n_ci"][1] and row["a_ci"][0] < 5.0 < row["a_ci"][1]
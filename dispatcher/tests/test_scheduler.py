@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from scheduler import WorkerScheduler
+
+URL = "http://worker-svc:8001/execute"
+ENDPOINTS = ["http://10.0.0.1:8001/execute", "http://10.0.0.2:8001/execute", "http://10.0.0.3:8001/execute"]
+
+
+def test_least_strategy_picks_worker_with_least_outstanding_cost():
+    scheduler = WorkerScheduler(URL, endpoints=ENDPOINTS, strategy="least")
+    first = scheduler.acquire(1000)
+    second = scheduler.acquire(10)
+    third = scheduler.acquire(10)
+    assert len({first.url, second.url, third.url}) == 3
+    scheduler.release(second, 10)
+    assert scheduler.acquire(5) is second
+
+
+def test_p2c_never_picks_the_busier_of_two_candidates():
+    scheduler = WorkerScheduler(URL, endpoints=ENDPOINTS[:2], strategy="p2c")
+    busy = scheduler.acquire(100)
+    for _ in range(5):
+        assert scheduler.acquire(1) is not busy
+
+
+def test_avoided_workers_are_skipped_unless_nothing_else_is_left():
+    scheduler = WorkerScheduler(URL, endpoints=ENDPOINTS[:2], strategy="least")
+    assert scheduler.acquire(avoid={ENDPOINTS[0]}).url == ENDPOINTS[1]
+    assert scheduler.acquire(avoid=set(ENDPOINTS[:2])).url in ENDPOINTS[:2]
+
+
+def test_release_updates_latency_average_and_load():
+    scheduler = WorkerScheduler(URL, endpoints=ENDPOINTS[:1])
+    worker = scheduler.acquire(50)
+    scheduler.release(worker, 50, elapsed=1.0)
+    worker = scheduler.acquire(50)
+    scheduler.release(worker, 50, elapsed=2.0)
+    assert (worker.outstanding, worker.cost) == (0, 0.0)
+    assert worker.latency == pytest.approx(1.2)
+
+
+def test_headless_service_records_become_workers(monkeypatch):
+    scheduler = WorkerScheduler(URL, dns_name="worker-headless")
+    assert scheduler.discovered == 0
+
+    async def resolve():
+        loop = asyncio.get_running_loop()
+
+        async def getaddrinfo(host, port, type=0):
+            return [(2, 1, 6, "", ("10.1.0.7", 0)), (10, 1, 6, "", ("fd00::8", 0, 0, 0))]
+        monkeypatch.setattr(loop, "getaddrinfo", getaddrinfo)
+        await scheduler.refresh()
+    asyncio.run(resolve())
+    assert sorted(scheduler.workers) == ["http://10.1.0.7:8001/execute", "http://[fd00::8]:8001/execute"]
+    assert scheduler.discovered == 2
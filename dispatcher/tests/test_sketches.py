@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import pytest
+
+import main
+import sketches
+
+
+def test_kmv_sketches_merge_to_the_smallest_hashes():
+    assert sketches.merge_kmv([1, 5, 9], [2, 5, None], 3) == [1, 2, 5]
+    assert sketches.count_distinct([1, 2, 5], size=4) == 3
+    assert sketches.count_distinct(None, size=4) == 0
+    # A full sketch estimates from its largest hash: k hashes spread over 1/4 of the space ~ 4k values
+    size = 1024
+    full = [int((i + 1) / size / 4 * sketches.HASH_SPACE) - sketches.HASH_SPACE // 2 for i in range(size)]
+    assert sketches.count_distinct(full, size) == pytest.approx(4 * size, rel=0.01)
+
+
+def test_exact_mode_counts_the_union_of_values():
+    assert sketches.count_distinct(sketches.merge_values([1, 2], [2, 3])) == 3
+
+
+def test_percentiles_merge_from_partition_summaries():
+    rng = random.Random(1)
+    values = [rng.random() * 100 for _ in range(4000)]
+    halves = sorted(values[:2000]), sorted(values[2000:])
+    q = 100
+    summaries = [[half[round(j / q * (len(half) - 1))] for j in range(q + 1)] for half in halves]
+    ordered = sorted(values)
+    median = sketches.percentile('percentile_cont', 0.5, summaries, [2000, 2000])
+    assert median == pytest.approx((ordered[1999] + ordered[2000]) / 2, abs=2.0)
+    assert sketches.percentile('percentile_disc', 1.0, summaries, [2000, 2000]) == ordered[-1]
+    assert sketches.percentile('percentile_cont', 0.5, [None, []], [0, 0]) is None
+
+
+COUNT_DISTINCT = "SELECT page, COUNT(DISTINCT user_id) AS users, COUNT(*) AS n FROM visits WHERE id > 0 GROUP BY page"
+
+
+def test_sketched_plans_keep_the_original_statement():
+    plan, _, _ = main.plan_query(COUNT_DISTINCT)
+    assert plan['sketches'] == ['approx_distinct'] and plan['sketched'] == ['users']
+    unsplit = plan['unsplit']
+    assert unsplit['merge'] == "concat" and not unsplit['splittable'] and not unsplit['sketched']
+    assert "COUNT(DISTINCT user_id) AS users" in main.render_query(unsplit, None)
+
+
+def test_explicit_approximations_and_exact_merges_have_no_unsplit_plan():
+    plan, _, _ = main.plan_query("SELECT APPROX_COUNT_DISTINCT(user_id) AS users FROM visits")
+    assert plan['unsplit'] is None and plan['sketched'] == ['users']
+    plan, _, _ = main.plan_query("SELECT page, COUNT(*) AS n FROM visits GROUP BY page")
+    assert plan['unsplit'] is None and plan['sketched'] == []
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """fetch_partition() stand-in answering every sub-query with rows(sql)."""
+    calls = []
+
+    async def fetch_partition(sql, worker, cost=1.0):
+        calls.append(sql)
+        main.worker_scheduler.release(worker, cost)
+        if "COUNT(DISTINCT" in sql:
+            return [{"page": "a", "users": 3, "n": 4}]
+        return [{"page": "a", "__a0_kmv": [1, 2], "__a1_count": 2}]
+
+    monkeypatch.setattr(main, "fetch_partition", fetch_partition)
+    return calls
+
+
+def execute(monkeypatch, partitions):
+    async def build_subqueries(plan, where, max_parts=None):
+        return partitions(plan, where)
+    monkeypatch.setattr(main, "build_subqueries", build_subqueries)
+    plan, literals, _ = main.plan_query(COUNT_DISTINCT)
+    return asyncio.run(main.execute_query(plan, main.bound_where(plan, literals)))
+
+
+def test_a_single_whole_sub_query_runs_the_exact_statement(monkeypatch, worker):
+    body = execute(monkeypatch, lambda plan, where: [main.whole_query(plan, where)])
+    assert body == {"rows": [{"page": "a", "users": 3, "n": 4}]}
+    assert worker == ["SELECT page, COUNT(DISTINCT user_id) AS users, COUNT(*) AS n FROM visits WHERE id > 0 GROUP BY page"]
+
+
+def test_split_answers_flag_their_sketched_columns(monkeypatch, worker):
+    body = execute(monkeypatch, lambda plan, where: [
+        main.make_partition(plan, where, "id", None, 10, False), main.make_partition(plan, where, "id", 10, None, True)])
+    assert body == {"rows": [{"page": "a", "users": 2, "n": 4}], "approximate": {"sketched": ["users"]}}
+    assert len(worker) == 2 and all("__a0_kmv" in sql for sql in worker)
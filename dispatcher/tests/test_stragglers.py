@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    """fetch_partition() stand-in: behaviours[sql] is a list of per-attempt (delay, rows or exception)."""
+    behaviours, calls = {}, []
+
+    async def fetch_partition(sql, worker, cost=1.0):
+        try:
+            attempt = sum(1 for s in calls if s == sql)
+            calls.append(sql)
+            script = behaviours.get(sql, [(0, [{"sql": sql}])])
+            delay, outcome = script[min(attempt, len(script) - 1)]
+            await asyncio.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        finally:
+            main.worker_scheduler.release(worker, cost)
+
+    monkeypatch.setattr(main, "fetch_partition", fetch_partition)
+    monkeypatch.setattr(main, "subquery_latency", main.LatencyWindow())
+    monkeypatch.setattr(main, "SUBQUERY_RETRIES", 1)
+    return behaviours, calls
+
+
+def run(part, plan=None, timeout=5.0):
+    async def go():
+        deadline = asyncio.get_running_loop().time() + timeout
+        return await main.run_partition(part, plan, None, deadline)
+    return asyncio.run(go())
+
+
+def test_latency_window_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(main, "HEDGE_MIN_SAMPLES", 3)
+    window = main.LatencyWindow()
+    window.add(1.0)
+    window.add(2.0)
+    assert window.quantile(0.5) is None
+    window.add(3.0)
+    assert window.quantile(0.5) == 2.0
+    assert window.quantile(0.99) == 3.0
+
+
+def test_failed_attempt_is_retried(fake_fetch):
+    behaviours, calls = fake_fetch
+    behaviours["q"] = [(0, RuntimeError("connection reset")), (0, [{"n": 1}])]
+    assert run({'sql': "q", 'col': None}) == [[{"n": 1}]]
+    assert calls == ["q", "q"]
+
+
+def test_partition_fails_once_retries_are_used_up(fake_fetch):
+    behaviours, _ = fake_fetch
+    behaviours["q"] = [(0, RuntimeError("connection reset"))]
+    with pytest.raises(HTTPException) as e:
+        run({'sql': "q", 'col': None})
+    assert e.value.status_code == 502
+
+
+def test_slow_attempt_is_hedged(fake_fetch, monkeypatch):
+    behaviours, calls = fake_fetch
+    monkeypatch.setattr(main, "HEDGE_MIN_SAMPLES", 1)
+    main.subquery_latency.add(0.01)
+    behaviours["q"] = [(2.0, [{"n": "slow"}]), (0, [{"n": "hedge"}])]
+    started = time.perf_counter()
+    assert run({'sql': "q", 'col': None}) == [[{"n": "hedge"}]]
+    assert time.perf_counter() - started < 1.0
+    assert calls == ["q", "q"]
+
+
+def test_timed_out_range_is_resplit(fake_fetch, monkeypatch):
+    behaviours, _ = fake_fetch
+    monkeypatch.setattr(main, "SUBQUERY_TIMEOUT", 0.05)
+    monkeypatch.setattr(main, "RESPLIT_WAYS", 4)
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    part = main.make_partition(plan, None, "id", 0, 100, False, 0, 100)
+    behaviours[part['sql']] = [(1.0, [])]
+    results = run(part, plan)
+    assert len(results) == 4
+    assert [rows[0]["sql"].split("WHERE ")[1] for rows in results] == [
+        "id >= 0 AND id < 25", "id >= 25 AND id < 50", "id >= 50 AND id < 75", "id >= 75 AND id < 100"]
+
+
+def test_resplit_keeps_open_ends_open():
+    plan, _, _ = main.plan_query("SELECT COUNT(*) FROM orders")
+    part = main.make_partition(plan, None, "id", None, 40, False, 0, 100)
+    pieces = main.resplit_partition(part, plan, None)
+    assert [(p['lower'], p['upper']) for p in pieces] == [(None, 10), (10, 20), (20, 30), (30, 40)]
+    assert main.resplit_partition(main.whole_query(plan, None), plan, None) == []
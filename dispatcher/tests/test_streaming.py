@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import main
+
+
+@pytest.fixture
+def fake_workers(monkeypatch):
+    """Workers answering sub-query name -> rows (or an exception) through stream_from_worker()."""
+    answers = {}
+
+    async def stream_from_worker(sql, queue):
+        result = answers[sql]
+        if isinstance(result, Exception):
+            raise result
+        for row in result:
+            await queue.put(json.dumps(row))
+
+    monkeypatch.setattr(main, "stream_from_worker", stream_from_worker)
+    return answers
+
+
+def read_body(body):
+    async def collect():
+        return [chunk async for chunk in body]
+    return [json.loads(line) for chunk in asyncio.run(collect()) for line in chunk.splitlines()]
+
+
+def row_plan(order=None, limit=None, offset=0):
+    return {'order': order, 'limit': limit, 'offset': offset, 'hidden': []}
+
+
+def test_stream_partitions_forwards_every_row(fake_workers):
+    fake_workers.update({"a": [{"id": 1}, {"id": 2}], "b": [{"id": 3}]})
+    rows = read_body(main.stream_partitions(["a", "b"], row_plan()))
+    assert sorted(row["id"] for row in rows) == [1, 2, 3]
+
+
+def test_stream_partitions_applies_offset_and_limit(fake_workers):
+    fake_workers.update({"a": [{"id": i} for i in range(10)]})
+    rows = read_body(main.stream_partitions(["a"], row_plan(limit=3, offset=2)))
+    assert [row["id"] for row in rows] == [2, 3, 4]
+
+
+def test_stream_partitions_ends_with_error_line(fake_workers):
+    fake_workers.update({"a": RuntimeError("Worker error: boom")})
+    rows = read_body(main.stream_partitions(["a"], row_plan()))
+    assert rows == [{"error": "Worker error: boom"}]
+
+
+def test_stream_result_rows_chunks_merged_rows(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_ROWS", 2)
+    rows = [{"n": i} for i in range(5)]
+
+    async def collect():
+        return [chunk async for chunk in main.stream_result_rows(rows)]
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 3
+    assert [json.loads(line) for chunk in chunks for line in chunk.splitlines()] == rows
+
+
+def respond(response, send):
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+    asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+
+
+def test_streamed_response_calls_on_done_after_the_body():
+    done, messages = [], []
+
+    async def body():
+        yield '{"n": 1}\n'
+
+    async def send(message):
+        messages.append(message)
+    respond(main.StreamedResponse(body(), lambda: done.append(True)), send)
+    assert done == [True]
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_streamed_response_calls_on_done_when_the_body_never_starts():
+    done, started = [], []
+
+    async def body():
+        started.append(True)
+        yield '{"n": 1}\n'
+
+    async def send(message):
+        raise OSError("client went away")
+    with pytest.raises(ClientDisconnect):
+        respond(main.StreamedResponse(body(), lambda: done.append(True)), send)
+    assert done == [True]
+    assert started == []
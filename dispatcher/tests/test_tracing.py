@@ -0,0 +1,71 @@
+import contextvars
+import json
+import logging
+
+import tracing
+
+PARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def in_context(fn):
+    """Run fn in a copy of the context, so the trace it starts doesn't leak into other tests."""
+    return contextvars.copy_context().run(fn)
+
+
+def test_parse_traceparent():
+    assert tracing.parse_traceparent(PARENT) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert tracing.parse_traceparent(PARENT.upper()[:-1] + "0")[2] is False
+    for bad in (None, "", "garbage", "ff" + PARENT[2:], "00-" + "0" * 32 + "-00f067aa0ba902b7-01"):
+        assert tracing.parse_traceparent(bad) is None
+
+
+def test_start_continues_an_incoming_trace():
+    def run():
+        trace = tracing.start(PARENT)
+        return trace, tracing.current(), tracing.headers({"Accept": "x"})
+
+    trace, current, headers = in_context(run)
+    assert current is trace and trace.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736" and trace.sampled
+    assert headers == {"Accept": "x", "traceparent": f"00-{trace.trace_id}-{trace.span_id}-01"}
+
+
+def test_unsampled_traces_skip_the_breakdown():
+    def run():
+        trace = tracing.start(sample_rate=0.0)
+        with tracing.stage("parse"):
+            pass
+        return trace, tracing.headers()
+
+    trace, headers = in_context(run)
+    assert not trace.sampled and trace.stages is None and len(trace.trace_id) == 32
+    assert headers == {"traceparent": f"00-{trace.trace_id}-{trace.span_id}-00"}
+    assert tracing.headers({"Accept": "x"}) == {"Accept": "x"}
+
+
+def test_sampled_traces_record_and_log_their_stages(caplog):
+    def run():
+        trace = tracing.start(sample_rate=1.0)
+        for _ in range(2):
+            with tracing.stage("worker"):
+                pass
+        with tracing.stage("merge"):
+            pass
+        tracing.finish(trace, 200, parts=2)
+        return trace
+
+    with caplog.at_level(logging.INFO, logger="dispatcher.trace"):
+        trace = in_context(run)
+    assert trace.stages["worker"][0] == 2 and trace.stages["merge"][0] == 1
+    record = caplog.records[-1]
+    assert record.status == 200 and record.parts == 2 and set(record.stages) == {"worker", "merge"}
+    assert "worker=" in record.getMessage() and "/2" in record.getMessage()
+
+
+def test_json_formatter_keeps_extra_fields_and_trace_id():
+    record = logging.LogRecord("dispatcher", logging.INFO, __file__, 1, "query %d", (200,), None)
+    record.trace_id = "abc"
+    record.stages = {"merge": {"count": 1, "ms": 0.5}}
+    entry = json.loads(tracing.JsonFormatter().format(record))
+    assert entry["msg"] == "query 200" and entry["trace_id"] == "abc" and entry["level"] == "INFO"
+    assert entry["stages"] == {"merge": {"count": 1, "ms": 0.5}}
+    assert "args" not in entry and "levelno" not in entry
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from prometheus_client import REGISTRY
+
+import main
+
+
+class Worker(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"rows": [{"n": 1}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def worker_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Worker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/execute"
+    server.shutdown()
+    server.server_close()
+
+
+def connections(kind):
+    return REGISTRY.get_sample_value("dispatcher_worker_connections_total", {"connection": kind}) or 0.0
+
+
+def test_one_client_is_shared_and_closed_on_shutdown(monkeypatch, worker_url):
+    monkeypatch.setattr(main, "DB_DSN", "")
+    monkeypatch.setattr(main, "ROLLUPS_FILE", "")
+    new, reused = connections("new"), connections("reused")
+    waits = REGISTRY.get_sample_value("dispatcher_worker_pool_wait_seconds_count")
+
+    async def run():
+        await main.startup()
+        client = main.worker_client
+        try:
+            for _ in range(3):
+                response = await main.post_to_worker("SELECT 1", worker_url)
+                assert response.json() == {"rows": [{"n": 1}]}
+            assert main.worker_client is client
+        finally:
+            await main.shutdown()
+        return client
+
+    client = asyncio.run(run())
+    assert client.is_closed and main.worker_client is None
+    # The first request opens the connection, the others find it in the pool
+    assert connections("new") - new == 1 and connections("reused") - reused == 2
+    assert REGISTRY.get_sample_value("dispatcher_worker_pool_wait_seconds_count") - waits == 3
+
+
+def test_client_limits_come_from_the_settings(monkeypatch):
+    monkeypatch.setattr(main, "WORKER_MAX_CONNECTIONS", 7)
+    monkeypatch.setattr(main, "WORKER_POOL_TIMEOUT", 1.5)
+    monkeypatch.setattr(main, "WORKER_HTTP2", False)
+
+    async def run():
+        client = main.create_worker_client()
+        try:
+            return client.timeout, client._transport._pool._max_connections
+        finally:
+            await client.aclose()
+
+    timeout, max_connections = asyncio.run(run())
+    assert timeout.pool == 1.5 and max_connections == 7
@@ -0,0 +1,206 @@
+"""
+Per-query tracing, stage timings and structured logging.
+
+QUERY_LATENCY says how long a query took, not where the time went. stage()
+times one step of a query (parse, analyze, bounds lookup, sub-query
+generation, each worker round trip, decode, merge, HAVING) into the
+dispatcher_stage_duration_seconds histogram, for every query.
+
+Every query also gets a trace ID, taken from an incoming W3C traceparent
+header or generated, which is attached to its log records and sent on to the
+workers in a traceparent header. A sampled share of queries (or those whose
+caller sampled them upstream) additionally record OpenTelemetry spans, when
+the opentelemetry API and an SDK are configured, and log their per-stage
+breakdown once they finish. Unsampled queries only pay for the histogram
+observations, so tracing can stay on in production.
+"""
+import contextvars
+import json
+import logging
+import random
+import re
+import secrets
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Histogram
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional dependency
+    otel_trace = None
+
+log = logging.getLogger("dispatcher.trace")
+
+STAGE_LATENCY = Histogram("dispatcher_stage_duration_seconds", "Time spent per query stage", ["stage"],
+                          buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+
+_current = contextvars.ContextVar("dispatcher_trace", default=None)
+_tracer = otel_trace.get_tracer("dispatcher") if otel_trace is not None else None
+_stage_metrics = {}
+
+
+class QueryTrace:
+    """Trace ID, sampling decision and, when sampled, the stage timings of one query."""
+
+    __slots__ = ("trace_id", "span_id", "sampled", "stages", "started", "span", "context")
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.stages = {} if sampled else None  # stage -> [count, seconds]
+        self.started = time.perf_counter()
+        self.span = None     # OpenTelemetry root span ("query")
+        self.context = None  # OpenTelemetry context holding span
+
+    def traceparent(self):
+        """traceparent header for a request made on behalf of this query, parented to the current span."""
+        span_id = self.span_id
+        if self.context is not None:
+            current = otel_trace.get_current_span().get_span_context()
+            if current.is_valid:
+                span_id = format(current.span_id, "016x")
+        return f"00-{self.trace_id}-{span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value):
+    """(trace_id, parent span_id, sampled) from a W3C traceparent header, or None if absent or malformed."""
+    match = TRACEPARENT.fullmatch(value.strip().lower()) if value else None
+    if match is None or match.group(1) == "ff" or not int(match.group(2), 16) or not int(match.group(3), 16):
+        return None
+    return match.group(2), match.group(3), bool(int(match.group(4), 16) & 1)
+
+
+def start(traceparent=None, sample_rate=0.0):
+    """
+    Begin the trace of one query in the current context. An incoming traceparent
+    supplies the trace ID and the sampling decision; otherwise a new ID is
+    generated and sample_rate of the queries are sampled.
+    """
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = sample_rate > 0 and random.random() < sample_rate
+    trace = QueryTrace(trace_id, secrets.token_hex(8), sampled)
+    if sampled and _tracer is not None:
+        context = None
+        if parent_id is not None:
+            remote = otel_trace.SpanContext(int(trace_id, 16), int(parent_id, 16), is_remote=True,
+                                            trace_flags=otel_trace.TraceFlags(otel_trace.TraceFlags.SAMPLED))
+            context = otel_trace.set_span_in_context(otel_trace.NonRecordingSpan(remote))
+        span = _tracer.start_span("query", context=context)
+        span_context = span.get_span_context()
+        if span_context.is_valid:
+            # An SDK is configured: the spans carry the IDs the logs and workers see
+            trace.trace_id = format(span_context.trace_id, "032x")
+            trace.span_id = format(span_context.span_id, "016x")
+            trace.span = span
+            trace.context = otel_trace.set_span_in_context(span)
+    _current.set(trace)
+    return trace
+
+
+def current():
+    """The trace of the query running in this context, or None."""
+    return _current.get()
+
+
+def headers(base=None):
+    """base plus the traceparent header of the current query (base itself outside a query)."""
+    trace = _current.get()
+    if trace is None:
+        return base
+    extra = {"traceparent": trace.traceparent()}
+    return {**base, **extra} if base else extra
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the current query; sampled queries also get a span and a breakdown entry."""
+    metric = _stage_metrics.get(name)
+    if metric is None:
+        metric = _stage_metrics[name] = STAGE_LATENCY.labels(stage=name)
+    trace = _current.get()
+    started = time.perf_counter()
+    try:
+        if trace is not None and trace.context is not None:
+            # Top-level stages hang off the query span, nested ones off their enclosing stage
+            parent = None if otel_trace.get_current_span().get_span_context().is_valid else trace.context
+            with otel_trace.use_span(_tracer.start_span(name, context=parent), end_on_exit=True):
+                yield
+        else:
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metric.observe(elapsed)
+        if trace is not None and trace.stages is not None:
+            entry = trace.stages.get(name)
+            if entry is None:
+                trace.stages[name] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+
+def finish(trace, status=200, **fields):
+    """End a query's trace: close its span and log the stage breakdown of a sampled query."""
+    if trace is None or not trace.sampled:
+        return
+    elapsed = time.perf_counter() - trace.started
+    if trace.span is not None:
+        trace.span.set_attribute("http.status_code", status)
+        for key, value in fields.items():
+            trace.span.set_attribute(f"query.{key}", value)
+        trace.span.end()
+    stages = {name: {"count": count, "ms": round(seconds * 1000, 3)} for name, (count, seconds) in trace.stages.items()}
+    summary = " ".join(f"{name}={entry['ms']:g}ms" + (f"/{entry['count']}" if entry["count"] > 1 else "")
+                       for name, entry in stages.items())
+    log.info("query %d in %.1fms: %s", status, elapsed * 1000, summary,
+             extra={"status": status, "duration_ms": round(elapsed * 1000, 3), "stages": stages, **fields})
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current query's trace_id ("-" outside a query) to every record."""
+
+    def filter(self, record):
+        trace = _current.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed with extra= become keys of their own."""
+
+    STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level, fmt="text"):
+    """Root logging setup: leveled records carrying trace IDs, as text lines or JSON objects (fmt="json")."""
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(trace_id)s]: %(message)s"))
+    logging.basicConfig(level=level, handlers=[handler])
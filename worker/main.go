@@ -6,10 +6,18 @@ import (
 	"log"
 	"net/http"
 	"os"
+	"strings"
 
+	"github.com/jackc/pgx/v5"
 	"github.com/jackc/pgx/v5/pgxpool"
 )
 
+const (
+    ndjsonType      = "application/x-ndjson"
+    compactType     = "application/x-parallax-rows+json"
+    streamFlushRows = 256
+)
+
 type request struct {
     SQL string `json:"sql"`
 }
@@ -18,6 +26,12 @@ type response struct {
     Rows []map[string]interface{} `json:"rows"`
 }
 
+// compactResponse names the columns once; each row is a value array in that order.
+type compactResponse struct {
+    Columns []string        `json:"columns"`
+    Rows    [][]interface{} `json:"rows"`
+}
+
 func main() {
     dsn := os.Getenv("DB_DSN") // e.g. "postgres://user:pw@postgres:5432/dbname"
     pool, err := pgxpool.New(context.Background(), dsn)
@@ -34,11 +48,22 @@ func main() {
         }
         rows, err := pool.Query(context.Background(), req.SQL)
         if err != nil {
+            // traceparent carries the dispatcher's trace ID for the query this sub-query belongs to
+            log.Printf("query failed (traceparent=%s): %v", r.Header.Get("traceparent"), err)
             http.Error(w, err.Error(), http.StatusBadGateway)
             return
         }
         defer rows.Close()
 
+        if strings.Contains(r.Header.Get("Accept"), ndjsonType) {
+            streamRows(w, rows)
+            return
+        }
+        if strings.Contains(r.Header.Get("Accept"), compactType) {
+            writeCompact(w, rows)
+            return
+        }
+
         var out []map[string]interface{}
         for rows.Next() {
             values, err := rows.Values()
@@ -61,3 +86,60 @@ func main() {
     log.Println("worker listening on :8001")
     log.Fatal(http.ListenAndServe(":8001", nil))
 }
+
+// streamRows writes one JSON object per line and flushes as rows arrive, so
+// the dispatcher can forward them before the query finishes. Errors after the
+// header has been sent are reported in-band as a {"__error": "..."} line.
+func streamRows(w http.ResponseWriter, rows pgx.Rows) {
+    w.Header().Set("Content-Type", ndjsonType)
+    flusher, _ := w.(http.Flusher)
+    enc := json.NewEncoder(w)
+    descr := rows.FieldDescriptions()
+    n := 0
+    for rows.Next() {
+        values, err := rows.Values()
+        if err != nil {
+            enc.Encode(map[string]string{"__error": err.Error()})
+            return
+        }
+        rowMap := make(map[string]interface{}, len(values))
+        for i, v := range values {
+            rowMap[string(descr[i].Name)] = v
+        }
+        if err := enc.Encode(rowMap); err != nil {
+            // Dispatcher went away; stop reading from Postgres
+            return
+        }
+        n++
+        if flusher != nil && n%streamFlushRows == 0 {
+            flusher.Flush()
+        }
+    }
+    if err := rows.Err(); err != nil {
+        enc.Encode(map[string]string{"__error": err.Error()})
+    }
+}
+
+// writeCompact answers with compactResponse, so column names are sent once
+// instead of on every row.
+func writeCompact(w http.ResponseWriter, rows pgx.Rows) {
+    descr := rows.FieldDescriptions()
+    resp := compactResponse{Columns: make([]string, len(descr)), Rows: [][]interface{}{}}
+    for i, d := range descr {
+        resp.Columns[i] = d.Name
+    }
+    for rows.Next() {
+        values, err := rows.Values()
+        if err != nil {
+            http.Error(w, err.Error(), http.StatusInternalServerError)
+            return
+        }
+        resp.Rows = append(resp.Rows, values)
+    }
+    if err := rows.Err(); err != nil {
+        http.Error(w, err.Error(), http.StatusBadGateway)
+        return
+    }
+    w.Header().Set("Content-Type", compactType)
+    json.NewEncoder(w).Encode(resp)
+}